@@ -202,15 +202,20 @@ class Handle4xxMiddleware:
                 404: "Page Not Found - The requested resource could not be found",
                 405: "Method Not Allowed",
                 415: "Unsupported Media Type",
+                416: "Range Not Satisfiable - The requested range is outside of the resource",
                 429: "Too Many Requests",
             }
             
             error_message = default_messages.get(response.status_code, "An error occurred")
             status_code = response.status_code
             
-            return render(request, '4xx.html', {
+            page = render(request, '4xx.html', {
                 'error_message': error_message,
                 'status_code': status_code
             }, status=status_code)
+            # A 416 tells the client the size of the resource
+            if response.has_header('Content-Range'):
+                page['Content-Range'] = response['Content-Range']
+            return page
 
         return response
\ No newline at end of file
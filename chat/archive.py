@@ -0,0 +1,114 @@
+import logging
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q, QuerySet
+from .models import ChatArchive, ChatMessage
+
+log = logging.getLogger(__name__)
+
+RETENTION_DAYS: float = getattr(settings, 'CHAT_RETENTION_DAYS', 90.0)
+SEGMENT_SIZE: int = getattr(settings, 'CHAT_ARCHIVE_SEGMENT_SIZE', 500)
+BATCH_SIZE: int = getattr(settings, 'CHAT_ARCHIVE_BATCH_SIZE', 5000)
+
+# Segments read at once when paging through the archive
+SEGMENTS_PER_READ = 2
+
+Row = Dict[str, Any]
+Position = Tuple[datetime, int]
+
+def _position(row: Row) -> Position:
+    return (row['timestamp'], row['id'])
+
+def archive_messages(now: datetime, batch_size: int = BATCH_SIZE) -> int:
+    """
+    Moves messages older than `CHAT_RETENTION_DAYS` out of the message table.
+
+    They are appended to the newest segment of their conversation until it
+    holds `CHAT_ARCHIVE_SEGMENT_SIZE` messages, then new segments are started.
+    Each batch is moved in one transaction. Archived messages are out of
+    search.
+    """
+    old = ChatMessage.objects.filter(timestamp__lt=now - timedelta(days=RETENTION_DAYS))
+    archived = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                old.order_by('conversation', 'timestamp', 'id')
+                .values('id', 'conversation', 'sender_id', 'recipient_id', 'content', 'timestamp')[:batch_size]
+            )
+            if not rows:
+                return archived
+            conversations: Dict[int, List[Row]] = {}
+            for row in rows:
+                conversations.setdefault(row.pop('conversation'), []).append(row)
+
+            # Only the newest segment of a conversation can have room left
+            partial = {
+                segment.conversation: segment
+                for segment in ChatArchive.objects.filter(conversation__in=conversations, count__lt=SEGMENT_SIZE)
+                .order_by('last_timestamp', 'last_id').select_for_update()
+            }
+            updated, created = [], []
+            for key, messages in conversations.items():
+                segment = partial.get(key)
+                if segment is not None:
+                    room = SEGMENT_SIZE - segment.count
+                    segment.pack(segment.messages() + messages[:room])
+                    updated.append(segment)
+                    messages = messages[room:]
+                for start in range(0, len(messages), SEGMENT_SIZE):
+                    segment = ChatArchive(conversation=key)
+                    segment.pack(messages[start:start + SEGMENT_SIZE])
+                    created.append(segment)
+            ChatArchive.objects.bulk_update(
+                updated, ['first_timestamp', 'first_id', 'last_timestamp', 'last_id', 'count', 'ids', 'data']
+            )
+            ChatArchive.objects.bulk_create(created)
+            ChatMessage.objects.filter(pk__in=[row['id'] for row in rows]).delete()
+        archived += len(rows)
+        if len(rows) < batch_size:
+            return archived
+
+def find_archived(key: int, message_id: int) -> Optional[Position]:
+    """Position of an archived message of a conversation, None if it is not archived"""
+    segment = ChatArchive.objects.filter(conversation=key, ids__contains=[message_id]).only('data').first()
+    if segment is None:
+        return None
+    for row in segment.messages():
+        if row['id'] == message_id:
+            return _position(row)
+    return None
+
+def _segment_rows(segments: QuerySet, newest_first: bool) -> Iterator[Row]:
+    """Messages of ordered segments, read a few segments at a time"""
+    start = 0
+    while True:
+        batch = list(segments[start:start + SEGMENTS_PER_READ])
+        for segment in batch:
+            messages = segment.messages()
+            yield from reversed(messages) if newest_first else messages
+        if len(batch) < SEGMENTS_PER_READ:
+            return
+        start += SEGMENTS_PER_READ
+
+def archived_before(key: int, position: Optional[Position], limit: int) -> List[Row]:
+    """Archived messages of a conversation before a position, or the latest ones, newest first"""
+    segments = ChatArchive.objects.filter(conversation=key).only('data')
+    if position is not None:
+        segments = segments.filter(
+            Q(first_timestamp__lt=position[0]) | Q(first_timestamp=position[0], first_id__lt=position[1])
+        )
+    rows = _segment_rows(segments.order_by('-last_timestamp', '-last_id'), newest_first=True)
+    return list(islice((row for row in rows if position is None or _position(row) < position), limit))
+
+def archived_after(key: int, position: Position, limit: int) -> List[Row]:
+    """Archived messages of a conversation after a position, oldest first"""
+    segments = ChatArchive.objects.filter(
+        Q(last_timestamp__gt=position[0]) | Q(last_timestamp=position[0], last_id__gt=position[1]),
+        conversation=key
+    ).only('data')
+    rows = _segment_rows(segments.order_by('first_timestamp', 'first_id'), newest_first=False)
+    return list(islice((row for row in rows if _position(row) > position), limit))
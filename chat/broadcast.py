@@ -0,0 +1,31 @@
+import asyncio, logging, zlib
+from typing import Any, Dict
+from django.conf import settings
+from channels.layers import BaseChannelLayer
+
+log = logging.getLogger(__name__)
+
+BROADCAST_SHARDS: int = getattr(settings, 'CHAT_BROADCAST_SHARDS', 16)
+
+def broadcast_group(channel_name: str) -> str:
+    """
+    Broadcast shard of a chat socket.
+
+    Every socket joins one of `CHAT_BROADCAST_SHARDS` groups instead of a
+    single group of all users, so joining and leaving touch a group that
+    does not grow with the whole user base, and a broadcast is split into
+    sends small enough not to hold the event loop.
+    """
+    return f"all_users_{zlib.crc32(channel_name.encode()) % BROADCAST_SHARDS}"
+
+async def broadcast(channel_layer: BaseChannelLayer, message: Dict[str, Any]) -> None:
+    """Sends a message to every chat socket, to all shards concurrently"""
+    results = await asyncio.gather(
+        *(channel_layer.group_send(f"all_users_{shard}", message) for shard in range(BROADCAST_SHARDS)),
+        return_exceptions=True
+    )
+    for shard, result in enumerate(results):
+        if isinstance(result, Exception):
+            log.error(f"Error broadcasting to shard {shard}: {str(result)}", extra={
+                'message_type': message.get('type')
+            })
@@ -1,19 +1,22 @@
 import json
 import logging
-from typing import Optional, Dict, Any, List, Set, Union
+from typing import Optional, Dict, Any, List, Union
 from django.contrib.auth.models import AbstractUser
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.layers import BaseChannelLayer
-from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from .models import BlockedUser, ChatMessage
+from transcendence.rate_limit import RateLimiter
+from .broadcast import broadcast_group
+from .models import ChatMessage
 from .handler import ChatHandler
+from .presence import MAX_WATCHED, presence, presence_group
 
 User = get_user_model()
 
 log: logging.Logger = logging.getLogger(__name__)
 
-all: str = 'all_users'
+RATE_LIMITS = getattr(settings, 'CHAT_RATE_LIMITS', {})
 
 class MessageSender:
     """Handles message formatting, logging, and sending through WebSocket"""
@@ -107,26 +110,26 @@ class ChatConsumer(AsyncWebsocketConsumer):
         if not self.user or self.user.is_anonymous:
             await self.close()
         else:
+            self.limiter = RateLimiter('chat', RATE_LIMITS)
             await self.accept()
             self.user_group_name = f"chat_{self.user.id}"
             self.handler = ChatHandler(self)
+            self.watched: List[int] = []
             
-            await self.channel_layer.group_add(all, self.channel_name)
+            await self.channel_layer.group_add(broadcast_group(self.channel_name), self.channel_name)
             await self.channel_layer.group_add(self.user_group_name, self.channel_name)
-            if not await self.set_user_online():
-                await self.close()
-                return
-            await self.broadcast_status()
+            await presence.connect(self)
             log.info('WebSocket connected', extra={
                 'user_id': self.user.id
             })
 
     async def disconnect(self, close_code: int) -> None:
         if hasattr(self, 'user') and self.user.is_authenticated:
-            await self.set_user_offline()
-            await self.broadcast_status()
+            presence.disconnect(self)
+            for user_id in getattr(self, 'watched', []):
+                await self.channel_layer.group_discard(presence_group(user_id), self.channel_name)
             await self.channel_layer.group_discard(self.user_group_name, self.channel_name)
-        await self.channel_layer.group_discard(all, self.channel_name)
+        await self.channel_layer.group_discard(broadcast_group(self.channel_name), self.channel_name)
         log.info(f"WebSocket disconnected", extra={
             'user_id': getattr(self.user, 'id', 'Unknown')
         })
@@ -135,11 +138,20 @@ class ChatConsumer(AsyncWebsocketConsumer):
         log.debug(f"Received data: {text_data}", extra={
             'user_id': self.user.id if self.user else None
         })
+        if not self.limiter.allow():
+            await self.reject_message()
+            return
         try:
             data: dict = json.loads(text_data)
             message_type: Optional[str] = data.get('type')
             if not message_type:
                 raise KeyError('type')
+            presence.heartbeat(self)
+            if message_type == 'heartbeat':
+                return
+            if not self.limiter.allow(message_type):
+                await self.reject_message()
+                return
             if message_type == 'chat_message':
                 message_content = data.get('message', {}).get('content', '')
                 if (len(message_content) > 300):
@@ -155,39 +167,35 @@ class ChatConsumer(AsyncWebsocketConsumer):
         except Exception as e:
             await MessageSender.send_error(self, 'An error occurred while processing your request')
 
-    @database_sync_to_async
-    def set_user_online(self) -> bool:
-        if self.user and self.user.is_authenticated:
-            try:
-                User.objects.filter(id=self.user.id).update(online=True)
-                self.user.refresh_from_db()
-            except User.DoesNotExist:
-                return False
-            return True
-        return False
-
-    @database_sync_to_async
-    def set_user_offline(self) -> None:
-        if self.user and self.user.is_authenticated:
-            try:
-                User.objects.filter(id=self.user.id).update(online=False)
-                self.user.refresh_from_db()
-            except User.DoesNotExist:
-                pass
+    async def reject_message(self) -> None:
+        if self.limiter.notify():
+            await MessageSender.send_error(self, 'Too many messages, slow down')
 
     async def broadcast_status(self) -> None:
-        user_ids: List[int] = await self.get_allowed_user_ids()
-        for recipient_id in user_ids:
-            if recipient_id == self.user.id:
-                continue
-            await self.channel_layer.group_send(
-                f"chat_{recipient_id}",
-                MessageSender.status_update(self.user.chat_user)
-            )
+        await presence.publish(self.channel_layer, {**self.user.chat_user, 'online': presence.is_online(self.user.id)})
+
+    async def watch_status(self, user_id: int) -> None:
+        """Follows the presence of a user this socket looked up or wrote to, keeping the latest MAX_WATCHED"""
+        if user_id == self.user.id or user_id in self.watched:
+            return
+        await self.channel_layer.group_add(presence_group(user_id), self.channel_name)
+        self.watched.append(user_id)
+        if len(self.watched) > MAX_WATCHED:
+            await self.channel_layer.group_discard(presence_group(self.watched.pop(0)), self.channel_name)
+
+    async def unwatch_status(self, user_id: int) -> None:
+        if user_id in self.watched:
+            self.watched.remove(user_id)
+            await self.channel_layer.group_discard(presence_group(user_id), self.channel_name)
 
     async def chat_message(self, event: Dict[str, Any]) -> None:
         """Handle incoming chat message from channel layer"""
         await MessageSender.send_message(self, MessageSender.chat_message(event['message'], event))
+
+    async def chat_messages(self, event: Dict[str, Any]) -> None:
+        """Handle several chat messages for this user sent as one channel layer event"""
+        for message in event['messages']:
+            await MessageSender.send_message(self, MessageSender.chat_message(message, event))
     
     async def friend_request_message(self, event: Dict[str, Any]) -> None:
         """Handle incoming friends request message from channel layer"""
@@ -209,6 +217,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
         """Handle incoming load friend requests message from channel layer"""
         await MessageSender.send_message(self, event)
 
+    async def block_list_changed(self, event: Dict[str, Any]) -> None:
+        """Drop the cached block list after a block or unblock involving this user"""
+        self.handler.block_list = None
+
     async def status_update(self, event: Dict[str, Any]) -> None:
         """Handle status update event"""
         user = event.get('user')  # Get user from event
@@ -228,26 +240,6 @@ class ChatConsumer(AsyncWebsocketConsumer):
             )
         )
 
-    @database_sync_to_async
-    def get_allowed_user_ids(self) -> List[int]:
-        if not self.user or not self.user.is_authenticated:
-            return []
-        # Exclude users who have blocked the current user or whom the current user has blocked
-        blocked_by_ids: Set[int] = set(BlockedUser.objects.filter(
-            blocked_user=self.user
-        ).values_list('user_id', flat=True))
-        
-        blocking_ids: Set[int] = set(BlockedUser.objects.filter(
-            user=self.user
-        ).values_list('blocked_user_id', flat=True))
-        
-        excluded_ids: Set[int] = blocked_by_ids | blocking_ids
-        allowed_users: List[int] = list(User.objects.exclude(
-            id__in=excluded_ids
-        ).values_list('id', flat=True))
-        
-        return allowed_users
-
     async def refresh_friends(self, event: Dict[str, Any]) -> None:
         """Handle friend list refresh requests"""
         await self.send(text_data=json.dumps({
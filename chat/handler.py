@@ -1,12 +1,14 @@
+import asyncio
 import json
 import logging
-from typing import Dict, Any, Optional, Callable, Awaitable, TypedDict, Union, List
+from typing import Dict, Any, Optional, Callable, Awaitable, TypedDict, List, FrozenSet, Set
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import IntegrityError, models
 from channels.db import database_sync_to_async
 from django.core.exceptions import ObjectDoesNotExist
 from django.contrib.auth import get_user_model
-from .models import ChatMessage, BlockedUser
+from .models import ChatMessage, BlockedUser, Conversation
+from .message_store import message_store
 from pong.models import PongRoom
 
 User = get_user_model()
@@ -22,6 +24,10 @@ class MessageResponse(TypedDict, total=False):
 class ChatHandler:
     def __init__(self, consumer):
         self.consumer = consumer
+        # Loaded on first use, dropped when a block involving the user changes
+        self.block_list: Optional[FrozenSet[int]] = None
+        # Pending sender acks, referenced until done so they are not collected mid-flight
+        self.acks: Set[asyncio.Task] = set()
 
     async def send_response(self, response_type: str, success: bool = True, data: Optional[Dict[str, Any]] = None, error: Optional[str] = None) -> None:
         """
@@ -51,6 +57,7 @@ class ChatHandler:
             'load_friend_requests': self.handle_load_friend_requests,
             'remove_friend': self.handle_remove_friend,
             'unselect_user': self.handle_unselect_user,
+            'mark_read': self.handle_mark_read,
         }
 
         try:
@@ -86,20 +93,22 @@ class ChatHandler:
         })
         await self.send_response('tournament_warning_received', success=True)
 
+    async def is_blocked(self, recipient_id: int) -> bool:
+        if self.block_list is None:
+            self.block_list = await self.load_block_list()
+        return int(recipient_id) in self.block_list
+
     @database_sync_to_async
-    def is_blocked(self, recipient_id: int) -> bool:
-        try:
-            return BlockedUser.objects.filter(
-                models.Q(user_id=recipient_id, blocked_user=self.consumer.user) |
-                models.Q(user=self.consumer.user, blocked_user_id=recipient_id)
-            ).exists()
-        except Exception as e:
-            log.error('Error checking blocked status', extra={
-                'user_id': self.consumer.user.id,
-                'recipient_id': recipient_id,
-                'error': str(e)
-            })
-            return False
+    def load_block_list(self) -> FrozenSet[int]:
+        """Ids of the users the current user blocked or is blocked by"""
+        user_id = self.consumer.user.id
+        return frozenset(
+            other_id
+            for blocker_id, blocked_id in BlockedUser.objects.filter(
+                models.Q(user_id=user_id) | models.Q(blocked_user_id=user_id)
+            ).values_list('user_id', 'blocked_user_id')
+            for other_id in (blocker_id, blocked_id) if other_id != user_id
+        )
 
     @database_sync_to_async
     def get_user(self, username: Optional[str] = None, id: Optional[int] = None) -> AbstractUser:
@@ -261,7 +270,13 @@ class ChatHandler:
                 await self.send_response('error', success=False, error='Message blocked: User is blocked')
                 return
 
-            saved_message = await self.save_message(message, recipient_id)
+            content = message.get('content') if isinstance(message, dict) else message
+            saved_message = ChatMessage(sender_id=self.consumer.user.id, recipient_id=int(recipient_id), content=content)
+            delivered = await message_store.assign_id(saved_message)
+            stored = message_store.save(saved_message)
+            if not delivered:
+                # No id before the insert: deliver once stored
+                await stored
             formatted_message = {
                 'id': saved_message.id,
                 'content': saved_message.content,
@@ -279,16 +294,56 @@ class ChatHandler:
                 }
             )
 
-            await self.send_response('chat_message', success=True, data={'message': formatted_message})
+            # The sender hears back once the message is stored, without holding up its next messages
+            ack = asyncio.ensure_future(self.acknowledge_message(stored, formatted_message, recipient_id))
+            self.acks.add(ack)
+            ack.add_done_callback(self.acknowledged)
 
-        except ObjectDoesNotExist:
-            await self.send_response('chat_message', success=False, error='Recipient not found')
+        except IntegrityError:
+            await self.recipient_not_found(recipient_id)
         except Exception as e:
             log.error(f'Error handling chat message from recipient {recipient_id}: {str(e)}', extra={
                 'user_id': self.consumer.user.id
             })
             raise
 
+    async def acknowledge_message(self, stored: Awaitable[None], formatted_message: Dict[str, Any], recipient_id: int) -> None:
+        try:
+            await stored
+        except IntegrityError:
+            await self.recipient_not_found(recipient_id)
+            return
+        except Exception as e:
+            log.error(f'Error storing chat message for recipient {recipient_id}: {str(e)}', extra={
+                'user_id': self.consumer.user.id
+            })
+            # Same error the consumer sends when a message fails before it is queued
+            await self.consumer.send(text_data=json.dumps({
+                'type': 'error',
+                'message': 'An error occurred while processing your request'
+            }))
+            return
+        await self.send_response('chat_message', success=True, data={'message': formatted_message})
+        await self.consumer.watch_status(recipient_id)
+
+    def acknowledged(self, ack: asyncio.Task) -> None:
+        self.acks.discard(ack)
+        if not ack.cancelled() and ack.exception() is not None:
+            log.error(f'Error acknowledging chat message: {str(ack.exception())}', extra={
+                'user_id': self.consumer.user.id
+            })
+
+    async def recipient_not_found(self, recipient_id: int) -> None:
+        log.error(f"Recipient with id {recipient_id} not found", extra={
+            'user_id': self.consumer.user.id
+        })
+        await self.send_response('chat_message', success=False, error='Recipient not found')
+
+    async def handle_mark_read(self, data: Dict[str, Any]) -> None:
+        if 'user_id' not in data:
+            raise KeyError('user_id')
+        await database_sync_to_async(Conversation.objects.mark_read)(self.consumer.user.id, int(data['user_id']))
+
     async def handle_user_status_change(self, data: Dict[str, Any]) -> None:
         if 'user_id' not in data or 'status' not in data:
             raise KeyError('user_id, status')
@@ -298,7 +353,7 @@ class ChatHandler:
         
         try:
             if user_id == self.consumer.user.id:
-                await self.consumer.broadcast_status(status)
+                await self.consumer.broadcast_status()
                 await self.send_response('status_change', success=True, data={'status': status})
             else:
                 await self.send_response('status_change', success=False, error='Can only change own status')
@@ -332,9 +387,10 @@ class ChatHandler:
                 return
             
             # Add recipient to pending invitations
-            success = await self.add_to_pending_invitations(room_id, recipient_id)
-            if not success:
+            changed_rooms = await self.add_to_pending_invitations(room_id, recipient_id)
+            if not changed_rooms:
                 raise Exception('Failed to add recipient to pending invitations')
+            await self.refresh_rooms(changed_rooms)
 
             # Send invitation to recipient
             await self.consumer.channel_layer.group_send(
@@ -369,18 +425,33 @@ class ChatHandler:
             return None
 
     @database_sync_to_async
-    def add_to_pending_invitations(self, room_id: str, recipient_id: int) -> bool:
+    def add_to_pending_invitations(self, room_id: str, recipient_id: int) -> List[str]:
+        """Moves a user's invitation to a room; returns the ids of the rooms changed, empty on failure"""
         try:
             room = PongRoom.objects.get(room_id=room_id)
             recipient = User.objects.get(id=recipient_id)
+            changed_rooms = []
             all_room = PongRoom.objects.filter(pending_invitations__id=recipient_id)
             for r in all_room:
                 r.pending_invitations.remove(recipient)
+                changed_rooms.append(r.room_id)
             room.pending_invitations.add(recipient)
-            return True
+            if room_id not in changed_rooms:
+                changed_rooms.append(room_id)
+            return changed_rooms
         except (PongRoom.DoesNotExist, User.DoesNotExist) as e:
             log.error(f"Error adding to pending invitations room {room_id} recipient {recipient_id}: {str(e)}")
-            return False
+            return []
+
+    async def refresh_rooms(self, room_ids: List[str]) -> None:
+        """
+        Has the room consumers reload rooms changed from chat.
+
+        Room sockets may live on another worker than this chat socket, so their
+        cache is refreshed through the room group rather than invalidated here.
+        """
+        for room_id in room_ids:
+            await self.consumer.channel_layer.group_send(f"pong_room_{room_id}", {'type': 'update_room'})
 
     @database_sync_to_async
     def check_room_full(self, room: PongRoom) -> tuple[bool, int]:
@@ -446,8 +517,14 @@ class ChatHandler:
             log.error(f"Error getting room with pending invitation: {str(e)}")
             return None
 
+    async def remove_from_pending_invitations(self, room_id: str) -> bool:
+        removed = await self.remove_pending_invitation(room_id)
+        if removed:
+            await self.refresh_rooms([room_id])
+        return removed
+
     @database_sync_to_async
-    def remove_from_pending_invitations(self, room_id: str) -> bool:
+    def remove_pending_invitation(self, room_id: str) -> bool:
         try:
             room = PongRoom.objects.get(room_id=room_id)
             room.pending_invitations.remove(self.consumer.user)
@@ -460,7 +537,11 @@ class ChatHandler:
             raise KeyError('user_id')
             
         try:
+            # Watch first so a status change right after the lookup is not missed
+            await self.consumer.watch_status(data['user_id'])
             profile = await self.get_user_profile(data['user_id'])
+            if profile is None or await self.is_blocked(data['user_id']):
+                await self.consumer.unwatch_status(data['user_id'])
             if profile:
                 await self.send_response('user_profile', success=True, data={'profile': profile})
             else:
@@ -490,28 +571,6 @@ class ChatHandler:
         except Exception as e:
             raise e
 
-    @database_sync_to_async
-    def save_message(self, message: Union[str, Dict[str, Any]], recipient_id: int) -> ChatMessage:
-        try:
-            recipient = User.objects.get(id=recipient_id)
-            # Extract content from message object if it's a dict
-            content = message.get('content') if isinstance(message, dict) else message
-            return ChatMessage.objects.create(
-                sender=self.consumer.user,
-                recipient=recipient,
-                content=content
-            )
-        except ObjectDoesNotExist:
-            log.error(f"Recipient with id {recipient_id} not found", extra={
-                'user_id': self.consumer.user.id
-            })
-            raise ObjectDoesNotExist("Recipient not found")
-        except Exception as e:
-            log.error(f"Error saving message: {str(e)}", extra={
-                'user_id': self.consumer.user.id
-            })
-            raise e
-
     @database_sync_to_async
     def get_room_owner_id(self, room: PongRoom) -> int:
         return room.owner.id
@@ -0,0 +1,37 @@
+import logging, time, traceback
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+from chat.archive import archive_messages
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Moves chat messages past their retention age into the archive, periodically or once'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run a single pass and exit')
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=getattr(settings, 'CHAT_ARCHIVE_INTERVAL', 3600.0),
+            help='Seconds between two passes'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            try:
+                archived = archive_messages(timezone.now())
+                if archived:
+                    logger.info(f"Chat archive pass - archived_messages: {archived}")
+                if options['once']:
+                    self.stdout.write(f'archived_messages={archived}')
+            except Exception as e:
+                logger.error(f"Chat archive pass failed - error: {str(e)}, traceback: {traceback.format_exc()}")
+                if options['once']:
+                    raise
+            if options['once']:
+                return
+            time.sleep(options['interval'])
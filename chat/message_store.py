@@ -0,0 +1,133 @@
+import asyncio, logging, traceback
+from typing import List, Optional, Tuple
+from django.conf import settings
+from django.db import connection, transaction
+from channels.db import database_sync_to_async
+from .models import ChatMessage
+
+log = logging.getLogger(__name__)
+
+WRITE_INTERVAL: float = getattr(settings, 'CHAT_WRITE_INTERVAL', 0.02)
+WRITE_BATCH_SIZE: int = getattr(settings, 'CHAT_WRITE_BATCH_SIZE', 100)
+ID_BLOCK_SIZE: int = getattr(settings, 'CHAT_ID_BLOCK_SIZE', 32)
+
+def reserve_ids(count: int) -> List[int]:
+    """Takes `count` ids from the message id sequence, or none if the database has no sequences"""
+    if connection.vendor != 'postgresql':
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+            [ChatMessage._meta.db_table, count]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+def insert_messages(messages: List[ChatMessage]) -> List[Optional[Exception]]:
+    """
+    Inserts messages with one statement.
+
+    If the batch fails, every message is retried on its own so a single bad
+    row (an unknown recipient) only fails itself. Returns the error of each
+    message, None for the ones stored.
+    """
+    try:
+        with transaction.atomic():
+            ChatMessage.objects.bulk_create(messages)
+        return [None] * len(messages)
+    except Exception:
+        if len(messages) == 1:
+            raise
+    errors: List[Optional[Exception]] = []
+    for message in messages:
+        try:
+            with transaction.atomic():
+                ChatMessage.objects.bulk_create([message])
+            errors.append(None)
+        except Exception as e:
+            errors.append(e)
+    return errors
+
+class MessageStore:
+    """
+    Write-behind store for chat messages.
+
+    Messages get their id up front from blocks of `CHAT_ID_BLOCK_SIZE` ids
+    taken from the table's sequence, so they can be delivered before they
+    are stored. Queued messages are inserted together every
+    `CHAT_WRITE_INTERVAL` seconds, or as soon as `CHAT_WRITE_BATCH_SIZE`
+    are waiting. Without a sequence (SQLite), ids come back from the insert
+    and messages can only be delivered once stored.
+    """
+
+    def __init__(self, interval: float, batch_size: int, id_block_size: int):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.id_block_size = id_block_size
+        self._ids: List[int] = []
+        self._sequenced: Optional[bool] = None
+        self._reserving: Optional[asyncio.Task] = None
+        self._queue: List[Tuple[ChatMessage, asyncio.Future]] = []
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def assign_id(self, message: ChatMessage) -> bool:
+        """Gives a message its id ahead of the insert; returns False if ids come from the insert"""
+        loop = asyncio.get_running_loop()
+        while not self._ids:
+            if self._sequenced is False:
+                return False
+            if self._reserving is None or self._reserving.get_loop() is not loop:
+                self._reserving = loop.create_task(self._reserve())
+            # Concurrent messages share one reservation
+            await asyncio.shield(self._reserving)
+        message.id = self._ids.pop()
+        return True
+
+    async def _reserve(self) -> None:
+        try:
+            ids = await database_sync_to_async(reserve_ids)(self.id_block_size)
+        finally:
+            self._reserving = None
+        self._sequenced = bool(ids)
+        # Popped from the end, so handed out in ascending order
+        self._ids.extend(reversed(ids))
+
+    def save(self, message: ChatMessage) -> asyncio.Future:
+        """Queues a message; the returned future resolves once it is stored"""
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._full = asyncio.Event()
+            self._task = loop.create_task(self._run())
+        done = loop.create_future()
+        self._queue.append((message, done))
+        if len(self._queue) >= self.batch_size:
+            self._full.set()
+        return done
+
+    async def _run(self) -> None:
+        while self._queue:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        while self._queue:
+            batch, self._queue = self._queue[:self.batch_size], self._queue[self.batch_size:]
+            messages = [message for message, _ in batch]
+            try:
+                errors = await database_sync_to_async(insert_messages)(messages)
+            except Exception as e:
+                log.error(f"Error storing chat messages - count: {len(batch)}, error: {str(e)}, traceback: {traceback.format_exc()}")
+                errors = [e] * len(batch)
+            for (_, done), error in zip(batch, errors):
+                if done.done():
+                    continue
+                if error is None:
+                    done.set_result(None)
+                else:
+                    done.set_exception(error)
+
+message_store = MessageStore(WRITE_INTERVAL, WRITE_BATCH_SIZE, ID_BLOCK_SIZE)
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:05
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Greatest, Least
+
+
+def set_conversation(apps, schema_editor):
+    ChatMessage = apps.get_model('chat', 'ChatMessage')
+    ChatMessage.objects.update(
+        conversation=Least('sender_id', 'recipient_id') * 4294967296 + Greatest('sender_id', 'recipient_id')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_delete_gameinvitation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmessage',
+            name='conversation',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(set_conversation, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['conversation', 'timestamp', 'id'], name='chatmessage_conversation'),
+        ),
+    ]
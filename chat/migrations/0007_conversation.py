@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:14
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def create_conversations(apps, schema_editor):
+    ChatMessage = apps.get_model('chat', 'ChatMessage')
+    Conversation = apps.get_model('chat', 'Conversation')
+    # Existing messages count as read
+    latest = {}
+    messages = ChatMessage.objects.order_by('timestamp', 'id').values('id', 'sender_id', 'recipient_id', 'content', 'timestamp')
+    for message in messages.iterator():
+        for side in {(message['sender_id'], message['recipient_id']), (message['recipient_id'], message['sender_id'])}:
+            latest[side] = message
+    Conversation.objects.bulk_create([
+        Conversation(
+            user_id=user_id,
+            other_id=other_id,
+            last_message_id=message['id'],
+            last_sender_id=message['sender_id'],
+            preview=message['content'][:100],
+            last_timestamp=message['timestamp'],
+            read_at=message['timestamp'],
+        )
+        for (user_id, other_id), message in latest.items()
+    ], batch_size=1000)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_alter_chatmessage_timestamp'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('preview', models.CharField(blank=True, max_length=100)),
+                ('last_timestamp', models.DateTimeField(null=True)),
+                ('unread', models.PositiveIntegerField(default=0)),
+                ('read_at', models.DateTimeField(null=True)),
+                ('last_message', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.chatmessage')),
+                ('last_sender', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('other', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversations', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-last_timestamp'], name='conversation_inbox')],
+                'unique_together': {('user', 'other')},
+            },
+        ),
+        migrations.RunPython(create_conversations, migrations.RunPython.noop),
+    ]
@@ -1,13 +1,62 @@
-from django.db import models
+import json, zlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db import models, transaction
+from django.utils import timezone
+
+# Characters of the last message kept in a conversation
+PREVIEW_LENGTH = 100
+
+# Text search configuration of messages: they are written in any language, so words are not stemmed
+SEARCH_CONFIG = 'simple'
+
+def conversation_key(user_id: int, other_id: int) -> int:
+    """Same key for both directions of a conversation between two users"""
+    low, high = sorted((int(user_id), int(other_id)))
+    return (low << 32) | high
+
+class ChatMessageManager(models.Manager):
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for message in objs:
+            message.conversation = conversation_key(message.sender_id, message.recipient_id)
+        with transaction.atomic():
+            created = super().bulk_create(objs, *args, **kwargs)
+            Conversation.objects.record_messages(created)
+        return created
 
 class ChatMessage(models.Model):
     sender = models.ForeignKey('authentication.User', related_name='sent_messages', on_delete=models.CASCADE)
     recipient = models.ForeignKey('authentication.User', related_name='received_messages', on_delete=models.CASCADE)
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the message is sent, which can be before it is written
+    timestamp = models.DateTimeField(default=timezone.now)
+    # conversation_key() of the sender and recipient, set on save
+    conversation = models.BigIntegerField(default=0)
+    # Maintained by the database from the content
+    search = models.GeneratedField(
+        expression=SearchVector('content', config=SEARCH_CONFIG),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+
+    objects = ChatMessageManager()
 
     class Meta:
-        ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['conversation', 'timestamp', 'id'], name='chatmessage_conversation'),
+            GinIndex(fields=['search'], name='chatmessage_search'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.conversation = conversation_key(self.sender_id, self.recipient_id)
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            Conversation.objects.record_messages([self])
         
 class BlockedUser(models.Model):
     user = models.ForeignKey('authentication.User', related_name='blocking', on_delete=models.CASCADE)
@@ -15,4 +64,134 @@ class BlockedUser(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
 
     class Meta:
-        unique_together = ('user', 'blocked_user')
\ No newline at end of file
+        unique_together = ('user', 'blocked_user')
+
+class ConversationManager(models.Manager):
+    def record_messages(self, messages):
+        """Updates both sides of the conversations of newly stored messages"""
+        sides = {}
+        for message in messages:
+            for side in {(message.sender_id, message.recipient_id), (message.recipient_id, message.sender_id)}:
+                sides.setdefault(side, []).append(message)
+        if not sides:
+            return
+        pairs = sorted(sides)
+        with transaction.atomic():
+            # Missing rows are created first so that every side can be locked,
+            # in the same order on every worker
+            self.bulk_create([self.model(user_id=user_id, other_id=other_id) for user_id, other_id in pairs], ignore_conflicts=True)
+            matching = models.Q()
+            for user_id, other_id in pairs:
+                matching |= models.Q(user_id=user_id, other_id=other_id)
+            conversations = list(self.filter(matching).select_for_update().order_by('user_id', 'other_id'))
+            for conversation in conversations:
+                for message in sides[(conversation.user_id, conversation.other_id)]:
+                    conversation.add_message(message)
+            self.bulk_update(conversations, ['last_message', 'last_sender', 'preview', 'last_timestamp', 'unread'])
+
+    def mark_read(self, user_id, other_id):
+        """Marks every message a user received in a conversation as read"""
+        return self.filter(user_id=user_id, other_id=other_id).update(unread=0, read_at=timezone.now())
+
+class Conversation(models.Model):
+    """
+    One user's side of a conversation with another user.
+
+    Kept up to date as messages are stored and read, so that the inbox is
+    read without touching the messages.
+    """
+    user = models.ForeignKey('authentication.User', related_name='conversations', on_delete=models.CASCADE)
+    other = models.ForeignKey('authentication.User', related_name='+', on_delete=models.CASCADE)
+    # Still valid once the message moved to the archive
+    last_message = models.ForeignKey(ChatMessage, related_name='+', null=True, on_delete=models.DO_NOTHING, db_constraint=False)
+    last_sender = models.ForeignKey('authentication.User', related_name='+', null=True, on_delete=models.CASCADE)
+    preview = models.CharField(max_length=PREVIEW_LENGTH, blank=True)
+    last_timestamp = models.DateTimeField(null=True)
+    # Messages received since read_at
+    unread = models.PositiveIntegerField(default=0)
+    read_at = models.DateTimeField(null=True)
+
+    objects = ConversationManager()
+
+    class Meta:
+        unique_together = ('user', 'other')
+        indexes = [
+            models.Index(fields=['user', '-last_timestamp'], name='conversation_inbox'),
+        ]
+
+    def add_message(self, message):
+        # Messages sent before the conversation was last read were seen live
+        if message.recipient_id == self.user_id != message.sender_id and (self.read_at is None or message.timestamp > self.read_at):
+            self.unread += 1
+        if self.last_timestamp is None or (message.timestamp, message.id or 0) > (self.last_timestamp, self.last_message_id or 0):
+            self.last_message_id = message.id
+            self.last_sender_id = message.sender_id
+            self.preview = message.content[:PREVIEW_LENGTH]
+            self.last_timestamp = message.timestamp
+
+class ChatPresence(models.Model):
+    """
+    A worker holding chat sockets of a user.
+
+    Workers count sockets on their own, and go through these rows to tell
+    whether a user they no longer hold is still connected to another one.
+    Rows are refreshed while the sockets stay open, so the rows of a worker
+    that died go stale.
+    """
+    user = models.ForeignKey('authentication.User', related_name='+', on_delete=models.CASCADE)
+    worker = models.CharField(max_length=32)
+    seen_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ('user', 'worker')
+        indexes = [
+            models.Index(fields=['seen_at'], name='chatpresence_seen_at'),
+        ]
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+class ChatArchive(models.Model):
+    """
+    Segment of consecutive archived messages of a conversation.
+
+    The messages are kept as zlib-compressed JSON, oldest first, and are
+    never queried one by one: only the bounds of the segment and the ids
+    it holds are searchable.
+    """
+    conversation = models.BigIntegerField()
+    first_timestamp = models.DateTimeField()
+    first_id = models.BigIntegerField()
+    last_timestamp = models.DateTimeField()
+    last_id = models.BigIntegerField()
+    count = models.PositiveIntegerField()
+    ids = ArrayField(models.BigIntegerField())
+    data = models.BinaryField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['conversation', 'last_timestamp', 'last_id'], name='chatarchive_conversation'),
+            GinIndex(fields=['ids'], name='chatarchive_ids'),
+        ]
+
+    def messages(self):
+        """The archived messages as history rows, oldest first"""
+        return [{
+            'id': message_id,
+            'sender_id': sender_id,
+            'recipient_id': recipient_id,
+            'timestamp': EPOCH + timedelta(microseconds=micros),
+            'content': content,
+        } for message_id, sender_id, recipient_id, micros, content in json.loads(zlib.decompress(self.data))]
+
+    def pack(self, messages):
+        """Stores history rows, sorted oldest first, as the content of the segment"""
+        first, last = messages[0], messages[-1]
+        self.first_timestamp, self.first_id = first['timestamp'], first['id']
+        self.last_timestamp, self.last_id = last['timestamp'], last['id']
+        self.count = len(messages)
+        self.ids = [message['id'] for message in messages]
+        self.data = zlib.compress(json.dumps([
+            [message['id'], message['sender_id'], message['recipient_id'],
+             (message['timestamp'] - EPOCH) // timedelta(microseconds=1), message['content']]
+            for message in messages
+        ], separators=(',', ':')).encode())
@@ -0,0 +1,283 @@
+import asyncio, logging, secrets, time, traceback
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set, Tuple
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from channels.db import database_sync_to_async
+from channels.layers import BaseChannelLayer, get_channel_layer
+from .models import BlockedUser, ChatPresence
+
+User = get_user_model()
+
+log = logging.getLogger(__name__)
+
+FLAP_WINDOW: float = getattr(settings, 'CHAT_PRESENCE_FLAP_WINDOW', 2.0)
+FLUSH_INTERVAL: float = getattr(settings, 'CHAT_PRESENCE_FLUSH_INTERVAL', 2.0)
+HEARTBEAT_TIMEOUT: float = getattr(settings, 'CHAT_PRESENCE_TIMEOUT', 75.0)
+
+# Users whose presence a chat socket follows besides its friends
+MAX_WATCHED: int = 16
+
+def presence_group(user_id: int) -> str:
+    """Group of the sockets watching a user they are not friends with"""
+    return f"presence_{user_id}"
+
+def friend_statuses(user_id: int) -> List[Tuple[int, bool]]:
+    """Ids and stored online flags of a user's friends, minus those on either side of a block"""
+    blocks = BlockedUser.objects.filter(
+        Q(user_id=OuterRef('pk'), blocked_user_id=user_id) |
+        Q(user_id=user_id, blocked_user_id=OuterRef('pk'))
+    )
+    return list(
+        User.objects.filter(friends=user_id)
+        .filter(~Exists(blocks))
+        .values_list('id', 'online')
+    )
+
+def join_presence(user_id: int, worker: str, stale_before: datetime) -> bool:
+    """Records a worker holding sockets of a user; returns whether another worker already does"""
+    ChatPresence.objects.bulk_create(
+        [ChatPresence(user_id=user_id, worker=worker)],
+        update_conflicts=True, unique_fields=['user', 'worker'], update_fields=['seen_at']
+    )
+    return ChatPresence.objects.filter(user_id=user_id, seen_at__gte=stale_before).exclude(worker=worker).exists()
+
+def leave_presence(user_id: int, worker: str, stale_before: datetime) -> bool:
+    """
+    Drops a worker's row of a user; returns whether another worker still holds sockets of them.
+
+    Both statements commit on their own: of two workers leaving at once, the
+    last one to check sees both rows gone.
+    """
+    ChatPresence.objects.filter(user_id=user_id, worker=worker).delete()
+    return ChatPresence.objects.filter(user_id=user_id, seen_at__gte=stale_before).exclude(worker=worker).exists()
+
+def refresh_presence(user_ids: List[int], worker: str) -> None:
+    """Marks the users a worker holds as still connected"""
+    ChatPresence.objects.bulk_create(
+        [ChatPresence(user_id=user_id, worker=worker) for user_id in user_ids],
+        update_conflicts=True, unique_fields=['user', 'worker'], update_fields=['seen_at']
+    )
+
+def sweep_presence(stale_before: datetime) -> List[Any]:
+    """Takes offline the users left online by workers that stopped refreshing them; returns them"""
+    with transaction.atomic():
+        ChatPresence.objects.filter(seen_at__lt=stale_before).delete()
+        # Rows locked by another worker are being swept there
+        users = list(
+            User.objects.filter(online=True)
+            .filter(~Exists(ChatPresence.objects.filter(user_id=OuterRef('pk'))))
+            .select_for_update(skip_locked=True)
+        )
+        User.objects.filter(id__in=[user.id for user in users]).update(online=False)
+    for user in users:
+        user.online = False
+    return users
+
+def write_online(changes: Dict[int, bool]) -> None:
+    """Stores presence transitions with one update per value"""
+    for online in (True, False):
+        user_ids = [user_id for user_id, value in changes.items() if value is online]
+        if not user_ids:
+            continue
+        users = User.objects.filter(id__in=user_ids)
+        if not online:
+            # Reconnected to another worker since
+            users = users.filter(~Exists(ChatPresence.objects.filter(user_id=OuterRef('pk'))))
+        users.update(online=online)
+
+class PresenceTracker:
+    """
+    Chat connections per user on this worker.
+
+    A user's first connection publishes them online and their last one
+    publishes them offline `CHAT_PRESENCE_FLAP_WINDOW` seconds later, unless
+    they reconnect in between: a page reload or a flaky network sends no
+    update at all, and extra tabs never do. Sockets silent for
+    `CHAT_PRESENCE_TIMEOUT` seconds are closed and count as gone.
+
+    Sockets of a user on other browsers or devices may sit on other workers,
+    so workers record the users they hold in `ChatPresence`: a user is only
+    published online by the first worker to hold them, and offline by the
+    last one to let them go. Rows are refreshed every third of the timeout,
+    and workers that stop refreshing count as gone after the timeout.
+
+    Transitions are written to the `online` column every
+    `CHAT_PRESENCE_FLUSH_INTERVAL` seconds, so only a user's first socket on
+    a worker and their offline transition cost a query, and the column may
+    lag by one interval.
+    """
+
+    def __init__(self, window: float, interval: float, timeout: float):
+        self.window = window
+        self.interval = interval
+        self.timeout = timeout
+        self.worker = secrets.token_hex(8)
+        self._refreshed_at = self._swept_at = time.monotonic()
+        # channel name -> (consumer, last heartbeat)
+        self._sockets: Dict[str, Tuple[Any, float]] = {}
+        self._connections: Dict[int, int] = {}
+        self._offline: Dict[int, asyncio.TimerHandle] = {}
+        # Offline transitions under way, referenced until done
+        self._offline_tasks: Set[asyncio.Task] = set()
+        self._changes: Dict[int, bool] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def is_online(self, user_id: int) -> bool:
+        return user_id in self._connections or user_id in self._offline
+
+    async def connect(self, consumer) -> None:
+        user = consumer.user
+        self._sockets[consumer.channel_name] = (consumer, time.monotonic())
+        count = self._connections.get(user.id, 0)
+        self._connections[user.id] = count + 1
+        self._ensure_task()
+        if count:
+            return
+        pending = self._offline.pop(user.id, None)
+        if pending is not None:
+            # Back within the window: the offline update was never sent
+            pending.cancel()
+            return
+        try:
+            if await database_sync_to_async(join_presence)(user.id, self.worker, self._stale_before()):
+                # Already online through another worker
+                return
+        except Exception as e:
+            log.error(f"Error recording presence: {str(e)}", extra={
+                'user_id': user.id
+            })
+        self._changes[user.id] = True
+        await self.publish(consumer.channel_layer, {**user.chat_user, 'online': True})
+
+    def heartbeat(self, consumer) -> None:
+        if consumer.channel_name in self._sockets:
+            self._sockets[consumer.channel_name] = (consumer, time.monotonic())
+
+    def disconnect(self, consumer) -> None:
+        if self._sockets.pop(consumer.channel_name, None) is None:
+            return
+        user = consumer.user
+        count = self._connections.get(user.id, 0) - 1
+        if count > 0:
+            self._connections[user.id] = count
+            return
+        self._connections.pop(user.id, None)
+        self._offline[user.id] = asyncio.get_running_loop().call_later(
+            self.window, self._start_offline, consumer.channel_layer, user
+        )
+
+    async def publish(self, channel_layer: BaseChannelLayer, user_data: Dict[str, Any]) -> None:
+        """Sends a user's status to their online friends and to the sockets watching them"""
+        friends = await database_sync_to_async(friend_statuses)(user_data['id'])
+        message = {'type': 'status_update', 'user': user_data}
+        await asyncio.gather(
+            channel_layer.group_send(presence_group(user_data['id']), message),
+            *(
+                channel_layer.group_send(f"chat_{friend_id}", message)
+                # The stored flag lags behind for friends who just came online here
+                for friend_id, online in friends if online or self.is_online(friend_id)
+            )
+        )
+
+    def _start_offline(self, channel_layer: BaseChannelLayer, user) -> None:
+        task = asyncio.get_running_loop().create_task(self._go_offline(channel_layer, user))
+        self._offline_tasks.add(task)
+        task.add_done_callback(self._offline_tasks.discard)
+
+    async def _go_offline(self, channel_layer: BaseChannelLayer, user) -> None:
+        self._offline.pop(user.id, None)
+        try:
+            elsewhere = await database_sync_to_async(leave_presence)(user.id, self.worker, self._stale_before())
+        except Exception as e:
+            elsewhere = False
+            log.error(f"Error releasing presence: {str(e)}", extra={
+                'user_id': user.id
+            })
+        if elsewhere or self.is_online(user.id):
+            # Still connected to another worker, or back here meanwhile
+            return
+        self._changes[user.id] = False
+        self._ensure_task()
+        try:
+            await self.publish(channel_layer, {**user.chat_user, 'online': False})
+        except Exception as e:
+            log.error(f"Error publishing offline status: {str(e)}", extra={
+                'user_id': user.id
+            })
+
+    def _ensure_task(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self._task.get_loop() is loop:
+            return
+        self._task = loop.create_task(self._run())
+
+    def _stale_before(self) -> datetime:
+        return timezone.now() - timedelta(seconds=self.timeout)
+
+    async def _run(self) -> None:
+        while self._sockets or self._offline or self._changes:
+            await asyncio.sleep(self.interval)
+            await self._expire()
+            await self.flush()
+            await self._refresh()
+            await self._sweep()
+
+    async def _refresh(self) -> None:
+        now = time.monotonic()
+        if now - self._refreshed_at < self.timeout / 3:
+            return
+        self._refreshed_at = now
+        user_ids = [*self._connections, *self._offline]
+        if not user_ids:
+            return
+        try:
+            await database_sync_to_async(refresh_presence)(user_ids, self.worker)
+        except Exception as e:
+            log.error(f"Error refreshing presence - users: {user_ids}, error: {str(e)}")
+
+    async def _sweep(self) -> None:
+        now = time.monotonic()
+        if now - self._swept_at < self.timeout:
+            return
+        self._swept_at = now
+        try:
+            users = await database_sync_to_async(sweep_presence)(self._stale_before())
+            channel_layer = get_channel_layer()
+            for user in users:
+                log.info("Taking offline a user of a gone worker", extra={
+                    'user_id': user.id
+                })
+                await self.publish(channel_layer, user.chat_user)
+        except Exception as e:
+            log.error(f"Error sweeping presence: {str(e)}, traceback: {traceback.format_exc()}")
+
+    async def _expire(self) -> None:
+        deadline = time.monotonic() - self.timeout
+        for consumer, last_seen in list(self._sockets.values()):
+            if last_seen < deadline:
+                log.info("Closing chat socket without heartbeat", extra={
+                    'user_id': consumer.user.id
+                })
+                self.disconnect(consumer)
+                try:
+                    await consumer.close()
+                except Exception:
+                    pass
+
+    async def flush(self) -> None:
+        """Writes the pending online transitions"""
+        changes, self._changes = self._changes, {}
+        if not changes:
+            return
+        try:
+            await database_sync_to_async(write_online)(changes)
+        except Exception as e:
+            # Keep newer transitions that arrived meanwhile
+            self._changes = {**changes, **self._changes}
+            log.error(f"Error writing presence - users: {list(changes)}, error: {str(e)}, traceback: {traceback.format_exc()}")
+
+presence = PresenceTracker(FLAP_WINDOW, FLUSH_INTERVAL, HEARTBEAT_TIMEOUT)
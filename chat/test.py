@@ -1,19 +1,27 @@
 import asyncio
+from datetime import timedelta
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.utils.timezone import now
 from authentication.models import User
+from pong.models import PongRoom
+from pong.routing import websocket_urlpatterns as pong_urlpatterns
 from unittest import mock
 from channels.testing import WebsocketCommunicator
 from django.contrib.auth import get_user_model
+from django.db import IntegrityError
 from django.test import TransactionTestCase
 from django.urls import path
 from channels.routing import URLRouter
 from channels.auth import AuthMiddlewareStack
 from channels.layers import get_channel_layer
 from channels.db import database_sync_to_async
+from .archive import archive_messages
+from .broadcast import broadcast
 from .consumers import ChatConsumer
-from .models import BlockedUser, ChatMessage
+from .message_store import MessageStore
+from .models import BlockedUser, ChatMessage, ChatPresence, Conversation
+from .presence import PresenceTracker, presence_group, sweep_presence, write_online
 
 class ChatViewsTestCase(APITestCase):
 
@@ -57,6 +65,78 @@ class ChatViewsTestCase(APITestCase):
         self.assertEqual(data[0]['content'], 'Hello')
         self.assertEqual(data[1]['content'], 'Hi')
 
+    def test_message_history_paging(self):
+        self.login('user1', 'password123')
+
+        start = now()
+        ids = [
+            ChatMessage.objects.create(
+                sender=self.user1, recipient=self.user2, content=f'Message {i}', timestamp=start + timedelta(seconds=i)
+            ).id
+            for i in range(5)
+        ]
+
+        def page(**params):
+            response = self.client.get(f'/chat/history/{self.user2.id}/', params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return [message['id'] for message in response.json()]
+
+        self.assertEqual(page(limit=2), ids[3:])
+        self.assertEqual(page(before=ids[3], limit=2), ids[1:3])
+        self.assertEqual(page(after=ids[1], limit=2), ids[2:4])
+        self.assertEqual(page(after=ids[3]), ids[4:])
+        self.assertEqual(page(limit=0), ids[4:])
+        for params in ({'limit': 'ten'}, {'before': 'x'}, {'after': '1.5'}):
+            response = self.client.get(f'/chat/history/{self.user2.id}/', params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_message_history_archive(self):
+        self.login('user1', 'password123')
+
+        ChatMessage.objects.create(sender=self.user1, recipient=self.user2, content='Long ago', timestamp=now() - timedelta(days=365))
+        ChatMessage.objects.create(sender=self.user2, recipient=self.user1, content='Hi', timestamp=now())
+        self.assertEqual(archive_messages(now()), 1)
+
+        response = self.client.get(f'/chat/history/{self.user2.id}/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([message['content'] for message in response.json()], ['Long ago', 'Hi'])
+        self.assertEqual(ChatMessage.objects.count(), 1)
+
+    def test_inbox(self):
+        self.login('user1', 'password123')
+
+        ChatMessage.objects.create(sender=self.user2, recipient=self.user1, content='Hello', timestamp=now())
+        ChatMessage.objects.create(sender=self.user2, recipient=self.user1, content='Are you there?', timestamp=now())
+
+        response = self.client.get('/chat/inbox/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]['user']['id'], self.user2.id)
+        self.assertEqual(data[0]['last_message']['content'], 'Are you there?')
+        self.assertEqual(data[0]['unread'], 2)
+
+        Conversation.objects.mark_read(self.user1.id, self.user2.id)
+        self.assertEqual(self.client.get('/chat/inbox/').json()[0]['unread'], 0)
+
+    def test_search_messages(self):
+        self.login('user1', 'password123')
+        user3 = User.objects.create_user(username='user3', password='password123', email='user3@test.com')
+
+        ChatMessage.objects.create(sender=self.user1, recipient=self.user2, content='Pong tonight? <b>8pm</b>', timestamp=now())
+        ChatMessage.objects.create(sender=self.user2, recipient=self.user1, content='Sure', timestamp=now())
+        ChatMessage.objects.create(sender=self.user2, recipient=user3, content='Pong with user1 tonight', timestamp=now())
+
+        response = self.client.get('/chat/search/', {'q': 'pong'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]['headline'], '<mark>Pong</mark> tonight? &lt;b&gt;8pm&lt;/b&gt;')
+        self.assertEqual(self.client.get('/chat/search/').status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_get_blocked_users(self):
         self.login('user1', 'password123')
 
@@ -198,6 +278,12 @@ class ChatConsumerTestCase(TransactionTestCase):
             self.assertEqual(response.get('message', {}).get('content'), 'Hello!')
             self.assertEqual(response.get('sender_id'), test_sender.id)
 
+            # Messages are stored after delivery, the sender's ack confirms the write
+            ack = await sender_comm.receive_json_from()
+            while ack.get('type') != 'chat_message':
+                ack = await sender_comm.receive_json_from()
+            self.assertTrue(ack.get('success'))
+
             messages = await database_sync_to_async(ChatMessage.objects.filter)(
                 sender=test_sender, recipient=test_recipient)
             self.assertEqual(await database_sync_to_async(messages.count)(), 1)
@@ -326,21 +412,89 @@ class ChatConsumerTestCase(TransactionTestCase):
 
         await communicator.disconnect()
 
-    @mock.patch('chat.models.ChatMessage.objects.create')
-    async def test_database_error_handling(self, mock_create):
-        mock_create.side_effect = Exception('Database error')
+    @mock.patch.dict('chat.consumers.RATE_LIMITS', {'*': (1.0, 3.0)}, clear=True)
+    async def test_rate_limit(self):
+        communicator = await self.create_communicator()
+        await communicator.connect()
+
+        # Heartbeats get no reply, only the dropped one is reported
+        for _ in range(4):
+            await communicator.send_json_to({'type': 'heartbeat'})
+        response = await communicator.receive_json_from()
+        while response.get('type') == 'status_update':
+            response = await communicator.receive_json_from()
+        self.assertEqual(response.get('type'), 'error')
+        self.assertEqual(response.get('message'), 'Too many messages, slow down')
+
+        await communicator.disconnect()
+
+    async def test_broadcast(self):
+        communicators = [await self.create_communicator(user) for user in (self.user, self.other_user)]
+        for communicator in communicators:
+            await communicator.connect()
+
+        notice = {'id': 0, 'username': 'system', 'online': True}
+        await broadcast(self.channel_layer, {'type': 'status_update', 'user': notice})
+        for communicator in communicators:
+            response = await communicator.receive_json_from()
+            while response.get('user') != notice:
+                response = await communicator.receive_json_from()
+            self.assertEqual(response.get('type'), 'status_update')
+            await communicator.disconnect()
+
+    @mock.patch('chat.message_store.insert_messages')
+    async def test_database_error_handling(self, mock_insert):
+        mock_insert.side_effect = Exception('Database error')
         communicator = await self.connect_and_send('chat_message', {
-            'message': 'This should trigger a database error',
+            'message': {'content': 'This should trigger a database error'},
             'recipient_id': self.other_user.id
         })
         response = await communicator.receive_json_from()
+        while response.get('type') == 'status_update':
+            response = await communicator.receive_json_from()
         self.assertEqual(response.get('type'), 'error')
         self.assertEqual(
             response.get('message'),
             'An error occurred while processing your request'
         )
+        self.assertTrue(mock_insert.called)
         await communicator.disconnect()
 
+    async def test_recipient_not_found(self):
+        communicator = await self.connect_and_send('chat_message', {
+            'message': {'content': 'Anyone there?'},
+            'recipient_id': 999999
+        })
+        response = await communicator.receive_json_from()
+        while response.get('type') == 'status_update':
+            response = await communicator.receive_json_from()
+        self.assertEqual(response.get('type'), 'chat_message')
+        self.assertFalse(response.get('success'))
+        self.assertEqual(response.get('error'), 'Recipient not found')
+        self.assertFalse(await database_sync_to_async(ChatMessage.objects.exists)())
+        await communicator.disconnect()
+
+    async def test_game_invitation_refreshes_room(self):
+        await database_sync_to_async(PongRoom.objects.create)(room_id='invite', owner=self.user, mode=PongRoom.Mode.CLASSIC)
+        room = WebsocketCommunicator(URLRouter(pong_urlpatterns), '/ws/pong_room/invite/')
+        room.scope['user'] = self.user
+        connected, _ = await room.connect()
+        self.assertTrue(connected)
+        self.assertEqual((await room.receive_json_from())['type'], 'room_update')
+
+        communicator = await self.connect_and_send('game_invitation', {
+            'recipient_id': self.other_user.id,
+            'room_id': 'invite'
+        })
+
+        # Pushed by the room's consumers, wherever the chat socket runs
+        patch = await room.receive_json_from(timeout=3)
+        self.assertEqual(patch['type'], 'room_patch')
+        invitations = next(op['value'] for op in patch['ops'] if op['path'] == '/pendingInvitations')
+        self.assertEqual([user['id'] for user in invitations], [self.other_user.id])
+        await communicator.disconnect()
+        await room.disconnect()
+
     async def test_unauthorized_access(self):        # Test accessing a protected route without authentication
         application = AuthMiddlewareStack(URLRouter([path("ws/chat/", ChatConsumer.as_asgi())]))
         communicator = WebsocketCommunicator(application, "/ws/chat/")
@@ -361,4 +515,181 @@ class ChatConsumerTestCase(TransactionTestCase):
             await database_sync_to_async(ChatMessage.objects.all().delete)()
         except Exception as e:
             print(f"Error during asyncTearDownClass: {type(e).__name__}: {str(e)}")
-            raise
\ No newline at end of file
+            raise
+
+class MessageStoreTestCase(TransactionTestCase):
+    def setUp(self):
+        self.sender = User.objects.create_user(username='sender', password='password123', email='sender@test.com')
+        self.recipient = User.objects.create_user(username='recipient', password='password123', email='recipient@test.com')
+        # Long interval: only a full batch or an explicit flush writes
+        self.store = MessageStore(interval=60, batch_size=10, id_block_size=4)
+
+    def message(self, content, recipient_id=None):
+        return ChatMessage(sender_id=self.sender.id, recipient_id=recipient_id or self.recipient.id, content=content)
+
+    async def store_messages(self, messages):
+        for message in messages:
+            await self.store.assign_id(message)
+        stored = [self.store.save(message) for message in messages]
+        await self.store.flush()
+        return await asyncio.gather(*stored, return_exceptions=True)
+
+    def test_batch_insert(self):
+        messages = [self.message(f'message {i}') for i in range(6)]
+        with mock.patch.object(ChatMessage.objects, 'bulk_create', wraps=ChatMessage.objects.bulk_create) as bulk_create:
+            results = asyncio.run(self.store_messages(messages))
+
+        self.assertEqual(results, [None] * 6)
+        self.assertEqual(bulk_create.call_count, 1)
+        stored = list(ChatMessage.objects.order_by('id').values_list('id', 'content'))
+        self.assertEqual(stored, [(message.id, message.content) for message in messages])
+
+    def test_failed_batch_retried_per_message(self):
+        messages = [self.message('first'), self.message('lost', recipient_id=999999), self.message('last')]
+        with mock.patch.object(ChatMessage.objects, 'bulk_create', wraps=ChatMessage.objects.bulk_create) as bulk_create:
+            results = asyncio.run(self.store_messages(messages))
+
+        # One batch insert, then one insert per message
+        self.assertEqual(bulk_create.call_count, 4)
+        self.assertIsNone(results[0])
+        self.assertIsInstance(results[1], IntegrityError)
+        self.assertIsNone(results[2])
+        self.assertEqual(sorted(ChatMessage.objects.values_list('content', flat=True)), ['first', 'last'])
+
+class FakeSocket:
+    def __init__(self, user, channel_name):
+        self.user = user
+        self.channel_name = channel_name
+        self.channel_layer = get_channel_layer()
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+class PresenceTrackerTestCase(TransactionTestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(username=f'user{i}', password='password123', email=f'user{i}@test.com')
+            for i in range(3)
+        ]
+        self.user = self.users[0]
+
+    async def watch(self, user):
+        """Queue of the status updates about a user"""
+        layer = get_channel_layer()
+        channel = await layer.new_channel()
+        await layer.group_add(presence_group(user.id), channel)
+        statuses = asyncio.Queue()
+
+        # A single receive for the whole test: channel layers may drop a channel whose receive is cancelled
+        async def receive():
+            while True:
+                message = await layer.receive(channel)
+                statuses.put_nowait(message['user']['online'])
+
+        self.receiver = asyncio.ensure_future(receive())
+        return statuses
+
+    async def receive_status(self, statuses, timeout=1):
+        return await asyncio.wait_for(statuses.get(), timeout)
+
+    async def assertNoStatus(self, channel, timeout=0.3):
+        with self.assertRaises(asyncio.TimeoutError):
+            await self.receive_status(channel, timeout)
+
+    async def stored_online(self, user):
+        return await database_sync_to_async(lambda: User.objects.get(pk=user.pk).online)()
+
+    def test_flap_window(self):
+        async def scenario():
+            tracker = PresenceTracker(window=0.3, interval=0.05, timeout=60)
+            watcher = await self.watch(self.user)
+            first = FakeSocket(self.user, 'first')
+            await tracker.connect(first)
+            self.assertTrue(await self.receive_status(watcher))
+            await asyncio.sleep(0.1)
+            self.assertTrue(await self.stored_online(self.user))
+
+            # A reload within the window sends nothing
+            tracker.disconnect(first)
+            second = FakeSocket(self.user, 'second')
+            await tracker.connect(second)
+            await self.assertNoStatus(watcher, timeout=0.5)
+
+            tracker.disconnect(second)
+            self.assertTrue(tracker.is_online(self.user.id))
+            self.assertFalse(await self.receive_status(watcher))
+            await asyncio.gather(*tracker._offline_tasks)
+            # Released once done
+            self.assertFalse(tracker._offline_tasks)
+            await asyncio.sleep(0.1)
+            self.assertFalse(await self.stored_online(self.user))
+
+        asyncio.run(scenario())
+        self.assertFalse(ChatPresence.objects.exists())
+
+    def test_heartbeat_expiry(self):
+        async def scenario():
+            tracker = PresenceTracker(window=0, interval=0.05, timeout=0.3)
+            watcher = await self.watch(self.user)
+            socket = FakeSocket(self.user, 'socket')
+            await tracker.connect(socket)
+            self.assertTrue(await self.receive_status(watcher))
+
+            for _ in range(4):
+                await asyncio.sleep(0.1)
+                tracker.heartbeat(socket)
+            self.assertFalse(socket.closed)
+
+            self.assertFalse(await self.receive_status(watcher))
+            self.assertTrue(socket.closed)
+            self.assertFalse(tracker.is_online(self.user.id))
+
+        asyncio.run(scenario())
+
+    def test_batched_flush(self):
+        async def scenario():
+            tracker = PresenceTracker(window=0, interval=0.2, timeout=60)
+            for i, user in enumerate(self.users):
+                await tracker.connect(FakeSocket(user, f'socket{i}'))
+            await asyncio.sleep(0.3)
+
+        with mock.patch('chat.presence.write_online', wraps=write_online) as write:
+            asyncio.run(scenario())
+
+        write.assert_called_once_with({user.id: True for user in self.users})
+        self.assertEqual(User.objects.filter(online=True).count(), 3)
+
+    def test_other_worker(self):
+        async def scenario():
+            workers = [PresenceTracker(window=0.1, interval=0.05, timeout=60) for _ in range(2)]
+            watcher = await self.watch(self.user)
+            sockets = [FakeSocket(self.user, f'socket{i}') for i in range(2)]
+            await workers[0].connect(sockets[0])
+            self.assertTrue(await self.receive_status(watcher))
+            await workers[1].connect(sockets[1])
+            await self.assertNoStatus(watcher)
+
+            # Still connected to the second worker
+            workers[0].disconnect(sockets[0])
+            await self.assertNoStatus(watcher)
+            self.assertTrue(await self.stored_online(self.user))
+
+            workers[1].disconnect(sockets[1])
+            self.assertFalse(await self.receive_status(watcher))
+            await asyncio.sleep(0.1)
+            self.assertFalse(await self.stored_online(self.user))
+
+        asyncio.run(scenario())
+
+    def test_sweep_gone_worker(self):
+        gone, connected, orphaned = self.users
+        User.objects.update(online=True)
+        ChatPresence.objects.create(user=gone, worker='gone', seen_at=now() - timedelta(minutes=5))
+        ChatPresence.objects.create(user=connected, worker='connected')
+
+        swept = sweep_presence(now() - timedelta(minutes=1))
+
+        self.assertEqual(sorted(user.id for user in swept), [gone.id, orphaned.id])
+        self.assertEqual(list(User.objects.filter(online=True).values_list('id', flat=True)), [connected.id])
+        self.assertEqual(list(ChatPresence.objects.values_list('worker', flat=True)), ['connected'])
@@ -4,6 +4,8 @@ from . import views
 urlpatterns = [
     # path('', views.chat_view, name='chat'),
     path('history/<int:recipient_id>/', views.message_history, name='message_history'),
+    path('inbox/', views.inbox, name='inbox'),
+    path('search/', views.search_messages, name='search_messages'),
     path('block/<int:user_id>/', views.block_user, name='block_user'),
     path('unblock/<int:user_id>/', views.unblock_user, name='unblock_user'),
     path('users/', views.get_users, name='get_users'),
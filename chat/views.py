@@ -1,18 +1,29 @@
 from django.shortcuts import render
-from .models import ChatMessage, BlockedUser
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from .archive import archived_after, archived_before, find_archived
+from .models import ChatMessage, BlockedUser, Conversation, SEARCH_CONFIG, conversation_key
 from django.contrib.auth import get_user_model
+from django.conf import settings
 from django.db import models
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank
+from django.db.models import Exists, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Replace
 from django.http import JsonResponse
 from rest_framework.decorators import api_view, permission_classes
 from authentication.decorators import IsAuthenticatedWithCookie
 from django.core.serializers.json import DjangoJSONEncoder
-from django.forms.models import model_to_dict
 import logging
 from pong.pong_functions import total_games_played, total_wins, total_losses, winrate
 
 User = get_user_model()
 logger = logging.getLogger(__name__)
 
+HISTORY_PAGE_SIZE = getattr(settings, 'CHAT_HISTORY_PAGE_SIZE', 50)
+HISTORY_MAX_PAGE_SIZE = getattr(settings, 'CHAT_HISTORY_MAX_PAGE_SIZE', 200)
+INBOX_SIZE = getattr(settings, 'CHAT_INBOX_SIZE', 50)
+SEARCH_PAGE_SIZE = getattr(settings, 'CHAT_SEARCH_PAGE_SIZE', 20)
+
 # @api_view(['GET'])
 # @permission_classes([IsAuthenticatedWithCookie])
 # def chat_view(request):
@@ -26,28 +37,164 @@ logger = logging.getLogger(__name__)
 @api_view(['GET'])
 @permission_classes([IsAuthenticatedWithCookie])
 def message_history(request, recipient_id):
-    messages = ChatMessage.objects.filter(
-        (models.Q(sender=request.user) & models.Q(recipient_id=recipient_id)) |
-        (models.Q(sender_id=recipient_id) & models.Q(recipient=request.user))
-    ).order_by('timestamp')
-
-    message_list = []
-    for message in messages:
-        message_dict = model_to_dict(message, fields=['id', 'content', 'timestamp'])
-        message_dict['sender_id'] = str(message.sender.id)
-        message_dict['recipient_id'] = str(message.recipient.id)
-        message_dict['timestamp'] = int(message.timestamp.timestamp() * 1000)
-        message_dict['type'] = 'text'
-        message_list.append(message_dict)
+    """
+    One page of the conversation with a user, oldest message first.
+
+    Returns the latest messages, or the ones right before or after the
+    message whose id is given as `before` or `after`. `limit` defaults to
+    CHAT_HISTORY_PAGE_SIZE and is capped at CHAT_HISTORY_MAX_PAGE_SIZE.
+    Pages continue into the archive past the messages still in the table.
+    """
+    try:
+        limit = max(1, min(int(request.GET.get('limit', HISTORY_PAGE_SIZE)), HISTORY_MAX_PAGE_SIZE))
+        before = int(request.GET['before']) if request.GET.get('before') else None
+        after = int(request.GET['after']) if request.GET.get('after') else None
+    except ValueError:
+        return JsonResponse({'error': 'Invalid pagination parameters'}, status=400)
+
+    key = conversation_key(request.user.id, recipient_id)
+    messages = ChatMessage.objects.filter(conversation=key)
+    forward = before is None and after is not None
+    cursor_id = after if forward else before
+    if cursor_id is not None:
+        # Keyset on (timestamp, id), the cursor's timestamp is read in the same query
+        cursor = Subquery(ChatMessage.objects.filter(pk=cursor_id, conversation=key).values('timestamp'))
+        if forward:
+            messages = messages.filter(models.Q(timestamp__gt=cursor) | models.Q(timestamp=cursor, id__gt=cursor_id))
+        else:
+            messages = messages.filter(models.Q(timestamp__lt=cursor) | models.Q(timestamp=cursor, id__lt=cursor_id))
+    messages = messages.order_by('timestamp', 'id') if forward else messages.order_by('-timestamp', '-id')
+
+    rows = list(messages.values('id', 'sender_id', 'recipient_id', 'content', 'timestamp')[:limit])
+    if len(rows) < limit:
+        rows = page_archive(key, rows, limit, cursor_id, forward)
+    if not forward:
+        rows.reverse()
+
+    message_list = [{
+        'id': row['id'],
+        'content': row['content'],
+        'timestamp': int(row['timestamp'].timestamp() * 1000),
+        'sender_id': str(row['sender_id']),
+        'recipient_id': str(row['recipient_id']),
+        'type': 'text',
+    } for row in rows]
 
     return JsonResponse(message_list, safe=False, encoder=DjangoJSONEncoder)
 
+def page_archive(key, rows, limit, cursor_id, forward):
+    """Completes a page of history rows, in query order, with archived messages"""
+    if rows:
+        if forward:
+            # Everything after a message of the table is in the table
+            return rows
+        return rows + archived_before(key, (rows[-1]['timestamp'], rows[-1]['id']), limit - len(rows))
+    if cursor_id is None:
+        return archived_before(key, None, limit)
+    position = ChatMessage.objects.filter(pk=cursor_id, conversation=key).values_list('timestamp', 'id').first()
+    if position is not None:
+        return rows if forward else archived_before(key, position, limit)
+    position = find_archived(key, cursor_id)
+    if position is None:
+        return rows
+    if not forward:
+        return archived_before(key, position, limit)
+    rows = archived_after(key, position, limit)
+    # The table holds what comes after the archive
+    newer = ChatMessage.objects.filter(conversation=key).order_by('timestamp', 'id')
+    return rows + list(newer.values('id', 'sender_id', 'recipient_id', 'content', 'timestamp')[:limit - len(rows)])
+
+def escape_html(expression):
+    """HTML-escapes text in the database, so that highlights can be the only markup"""
+    for char, entity in (('&', '&amp;'), ('<', '&lt;'), ('>', '&gt;'), ('"', '&quot;'), ("'", '&#x27;')):
+        expression = Replace(expression, Value(char), Value(entity))
+    return expression
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticatedWithCookie])
+def search_messages(request):
+    """
+    Messages of the user's conversations matching `q`, best match first.
+
+    `q` takes web search syntax: "quoted phrases", -excluded words and or.
+    `with` restricts the search to the conversation with one user. Pages of
+    `limit` results, CHAT_SEARCH_PAGE_SIZE by default and at most
+    CHAT_HISTORY_MAX_PAGE_SIZE, start at `offset`. Each result carries an
+    HTML-escaped `headline` with the matches wrapped in <mark>.
+    """
+    text = request.GET.get('q', '').strip()
+    if not text:
+        return JsonResponse({'error': 'Missing search query'}, status=400)
+    try:
+        limit = max(1, min(int(request.GET.get('limit', SEARCH_PAGE_SIZE)), HISTORY_MAX_PAGE_SIZE))
+        offset = max(0, int(request.GET.get('offset', 0)))
+        other_id = int(request.GET['with']) if request.GET.get('with') else None
+    except ValueError:
+        return JsonResponse({'error': 'Invalid search parameters'}, status=400)
+
+    query = SearchQuery(text, config=SEARCH_CONFIG, search_type='websearch')
+    if other_id is not None:
+        messages = ChatMessage.objects.filter(conversation=conversation_key(request.user.id, other_id))
+    else:
+        messages = ChatMessage.objects.filter(Q(sender_id=request.user.id) | Q(recipient_id=request.user.id))
+    rows = list(
+        messages.filter(search=query)
+        .annotate(
+            rank=SearchRank(F('search'), query),
+            headline=SearchHeadline(
+                escape_html(F('content')), query, config=SEARCH_CONFIG,
+                start_sel='<mark>', stop_sel='</mark>'
+            ),
+        )
+        .order_by('-rank', '-timestamp', '-id')
+        .values('id', 'sender_id', 'recipient_id', 'timestamp', 'headline')[offset:offset + limit]
+    )
+
+    return JsonResponse([{
+        'id': row['id'],
+        'headline': row['headline'],
+        'timestamp': int(row['timestamp'].timestamp() * 1000),
+        'sender_id': str(row['sender_id']),
+        'recipient_id': str(row['recipient_id']),
+    } for row in rows], safe=False)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticatedWithCookie])
+def inbox(request):
+    """The user's CHAT_INBOX_SIZE most recent conversations, with their last message and unread count"""
+    blocked = BlockedUser.objects.filter(
+        Q(user_id=request.user.id, blocked_user_id=OuterRef('other_id')) |
+        Q(user_id=OuterRef('other_id'), blocked_user_id=request.user.id)
+    )
+    conversations = (
+        Conversation.objects.filter(user=request.user)
+        .select_related('other')
+        .annotate(blocked=Exists(blocked))
+        .order_by('-last_timestamp')[:INBOX_SIZE]
+    )
+    return JsonResponse([{
+        'user': {**conversation.other.chat_user, 'blocked': conversation.blocked},
+        'last_message': {
+            'id': conversation.last_message_id,
+            'sender_id': conversation.last_sender_id,
+            'content': conversation.preview,
+            'timestamp': int(conversation.last_timestamp.timestamp() * 1000),
+        },
+        'unread': conversation.unread,
+    } for conversation in conversations], safe=False)
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticatedWithCookie])
 def get_blocked_users(request):
     blocked_users = BlockedUser.objects.filter(user=request.user).values_list('blocked_user_id', flat=True)
     return JsonResponse(list(blocked_users), safe=False)
 
+def notify_block_change(user_id, other_id):
+    """Makes the chat sockets of both users reload their block lists"""
+    channel_layer = get_channel_layer()
+    for recipient_id in (user_id, other_id):
+        async_to_sync(channel_layer.group_send)(f"chat_{recipient_id}", {'type': 'block_list_changed'})
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticatedWithCookie])
 def block_user(request, user_id):
@@ -58,6 +205,7 @@ def block_user(request, user_id):
     )
     if not created:
         return JsonResponse({'success': False, 'error': 'User already blocked'})
+    notify_block_change(request.user.id, user_id)
     return JsonResponse({'success': True})
 
 @api_view(['DELETE'])
@@ -66,6 +214,7 @@ def unblock_user(request, user_id):
     if not BlockedUser.objects.filter(user=request.user, blocked_user_id=user_id).exists():
         return JsonResponse({'success': False, 'error': 'User not blocked'})
     BlockedUser.objects.filter(user=request.user, blocked_user_id=user_id).delete()
+    notify_block_change(request.user.id, user_id)
     return JsonResponse({'success': True})
 
 @api_view(['GET'])
@@ -0,0 +1,134 @@
+from typing import List, Optional, Sequence
+from django.db import transaction
+from django.utils import timezone
+from authentication.models import User
+from .models import Match, PongGame, PongRoom, Tournament
+
+# Single elimination brackets stored as Match rows. Round 1 holds size/2
+# matches and every later round half as many; the winner of the match at
+# (round, position) plays the match at (round + 1, position // 2).
+
+def bracket_size(player_count: int) -> int:
+    """Smallest power of two holding every player, at least 2"""
+    size = 2
+    while size < player_count:
+        size *= 2
+    return size
+
+def _slot(size: int, round_number: int, position: int) -> int:
+    """Index of a match in the round by round list of a bracket"""
+    return size - (size >> (round_number - 1)) + position
+
+def create_bracket(tournament: Tournament, players: Sequence[User]) -> None:
+    """
+    Lays out the whole bracket of a tournament and opens its first round.
+
+    The bracket is padded to a power of two: seeds i and i + size/2 meet in
+    the first round, so the byes are spread over the bracket and won right
+    away. Any previous bracket of the tournament is replaced. Raises
+    `ValueError` for fewer than 2 players, who would have no match to play.
+    """
+    if len(players) < 2:
+        raise ValueError(f"A tournament needs at least 2 players, got {len(players)}")
+    size = bracket_size(len(players))
+    half = size // 2
+    round_count = size.bit_length() - 1
+    now = timezone.now()
+
+    matches = [
+        Match(tournament=tournament, round_number=round_number, position=position)
+        for round_number in range(1, round_count + 1)
+        for position in range(size >> round_number)
+    ]
+    byes = 0
+    for position in range(half):
+        match = matches[position]
+        match.player1 = players[position]
+        match.player2 = players[position + half] if position + half < len(players) else None
+        if match.player2 is None:
+            byes += 1
+            match.winner = match.player1
+            match.completed_at = now
+            advance = matches[_slot(size, 2, position // 2)]
+            setattr(advance, 'player1' if position % 2 == 0 else 'player2', match.player1)
+
+    tournament.matches.all().delete()
+    Match.objects.bulk_create(matches)
+    tournament.eliminated.clear()
+    tournament.status = Tournament.Status.ONGOING
+    tournament.current_round = 1
+    tournament.round_count = round_count
+    tournament.pending_matches = half - byes
+    tournament.winner = None
+    tournament.end_date = None
+    tournament.save(update_fields=['status', 'current_round', 'round_count', 'pending_matches', 'winner', 'end_date'])
+
+def schedule_round(tournament: Tournament, room: PongRoom) -> List[PongGame]:
+    """
+    Creates the games of the tournament's open round.
+
+    Moves on to the next round first if the current one is complete. Returns
+    no games while a round is still being played.
+    """
+    if tournament.pending_matches == 0 and tournament.current_round < tournament.round_count:
+        tournament.current_round += 1
+        tournament.pending_matches = 1 << (tournament.round_count - tournament.current_round)
+        tournament.save(update_fields=['current_round', 'pending_matches'])
+
+    matches = list(
+        tournament.matches
+        .filter(round_number=tournament.current_round, pong_game__isnull=True, winner__isnull=True,
+                player1__isnull=False, player2__isnull=False)
+        .select_related('player1', 'player2')
+        .order_by('position')
+    )
+    games = PongGame.objects.bulk_create([
+        PongGame(room=room, player1=match.player1, player2=match.player2, status=PongGame.Status.ONGOING)
+        for match in matches
+    ])
+    now = timezone.now()
+    for match, game in zip(matches, games):
+        match.pong_game = game
+        match.scheduled_at = now
+    Match.objects.bulk_update(matches, ['pong_game', 'scheduled_at'])
+    return games
+
+def record_result(game_id: int, winner_id: Optional[int]) -> Optional[Tournament]:
+    """
+    Records the winner of a tournament game and advances them in the bracket.
+
+    Counts down the open matches of the round; the final's result finishes
+    the tournament. Returns the updated tournament, or None if the game is
+    not an open tournament match.
+    """
+    if winner_id is None:
+        return None
+    with transaction.atomic():
+        match = Match.objects.filter(pong_game_id=game_id).first()
+        if match is None:
+            return None
+        # Games of a round finish concurrently: serialize them on the tournament row
+        tournament = Tournament.objects.select_for_update().get(pk=match.tournament_id)
+        if Match.objects.filter(pk=match.pk, winner__isnull=True).update(winner_id=winner_id, completed_at=timezone.now()) == 0:
+            return None
+
+        loser_id = match.player2_id if winner_id == match.player1_id else match.player1_id
+        if loser_id is not None:
+            tournament.eliminated.add(loser_id)
+
+        fields = ['pending_matches']
+        tournament.pending_matches = max(0, tournament.pending_matches - 1)
+        if match.round_number < tournament.round_count:
+            slot = 'player1_id' if match.position % 2 == 0 else 'player2_id'
+            Match.objects.filter(
+                tournament_id=tournament.id,
+                round_number=match.round_number + 1,
+                position=match.position // 2
+            ).update(**{slot: winner_id})
+        elif tournament.pending_matches == 0:
+            tournament.status = Tournament.Status.FINISHED
+            tournament.winner_id = winner_id
+            tournament.end_date = timezone.now()
+            fields += ['status', 'winner', 'end_date']
+        tournament.save(update_fields=fields)
+        return tournament
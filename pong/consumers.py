@@ -1,4 +1,5 @@
 from .game_consumer import PongGameConsumer
 from .room_consumer import PongRoomConsumer
+from .spectator_consumer import PongSpectatorConsumer
 
-__all__ = ['PongGameConsumer', 'PongRoomConsumer'] 
\ No newline at end of file
+__all__ = ['PongGameConsumer', 'PongRoomConsumer', 'PongSpectatorConsumer'] 
\ No newline at end of file
@@ -0,0 +1,589 @@
+import asyncio, json, logging, time, traceback
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Set, Tuple
+from django.conf import settings
+from channels.db import database_sync_to_async
+from .models import PongGame, PongRoom
+from .bracket import record_result
+from .score_store import score_store
+from .replay import replay_recorder
+from .latency import CLOCK_SYNC_INTERVAL, ClockEstimator, clock_ms, latency_stats
+from .lag_compensation import LAG_COMPENSATION_WINDOW, input_issued_at, paddle_speed, rewind_guest_input
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_BUFFER_SIZE = getattr(settings, 'PONG_SNAPSHOT_BUFFER_SIZE', 32)
+RECONNECT_GRACE = getattr(settings, 'PONG_RECONNECT_GRACE', 10.0)
+SPECTATOR_RATE = getattr(settings, 'PONG_SPECTATOR_RATE', 10.0)
+MAX_SPECTATORS = getattr(settings, 'PONG_MAX_SPECTATORS', 200)
+
+# Share of a spectator tick the fan-out may use before frames get skipped
+SPECTATOR_TICK_BUDGET = 0.5
+SPECTATOR_MAX_STRIDE = 8
+
+# Close code sent by clients that leave a game on purpose
+NORMAL_CLOSURE = 1000
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+class GameActor:
+    """
+    In-memory owner of one game on this worker.
+
+    The actor loads the game once, then keeps its status, players, scores and
+    readiness in memory. Every message coming from the game's sockets is
+    processed sequentially through a queue, which gives mutual exclusion
+    between the players of a game without any database or channel layer
+    round-trip.
+    """
+
+    def __init__(self, game_id: str):
+        self.game_id = game_id
+        self.game: Optional[PongGame] = None
+        self.status: Optional[str] = None
+        self.scores = {'left': 0, 'right': 0}
+        self.connections: Dict[str, Any] = {}
+        self.ready: Set[int] = set()
+        self.channel_layer = None
+        # Most recent host snapshots and guest inputs, as (server time ms, payload)
+        self.snapshots: Deque[Tuple[int, Dict[str, Any]]] = deque(maxlen=SNAPSHOT_BUFFER_SIZE)
+        self.snapshot_seq = 0
+        # Snapshot count at the last rewind, to rewind at most once per host snapshot
+        self.rewound_seq = -1
+        self.inputs: Deque[Tuple[int, Dict[str, Any]]] = deque(maxlen=SNAPSHOT_BUFFER_SIZE)
+        # Players whose socket dropped, waiting for them to come back
+        self.reconnecting: Dict[int, asyncio.TimerHandle] = {}
+        self.spectators: Dict[str, Any] = {}
+        self._feed_task: Optional[asyncio.Task] = None
+        # Clock and RTT estimates of each player's link, by user id
+        self.links: Dict[int, ClockEstimator] = {}
+        self._clock_task: Optional[asyncio.Task] = None
+        self.closed = False
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def submit(self, handler: Callable[..., Awaitable[Any]], *args) -> asyncio.Future:
+        """Queues a handler call and returns a future resolved with its result"""
+        if self.closed:
+            return get_actor(self.game_id).submit(handler, *args)
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((handler, args, future))
+        return future
+
+    async def _run(self) -> None:
+        while True:
+            handler, args, future = await self._queue.get()
+            try:
+                result = await handler(self, *args)
+                if not future.done():
+                    future.set_result(result)
+            except Exception as e:
+                logger.error(f"[Game {self.game_id}] Actor handler {handler.__name__} failed - error: {str(e)}, traceback: {traceback.format_exc()}")
+                if not future.done():
+                    future.set_exception(e)
+            if not self.connections and not self.reconnecting and not self.spectators and self._queue.empty():
+                self._close()
+                return
+
+    def _close(self) -> None:
+        self.closed = True
+        if _actors.get(self.game_id) is self:
+            del _actors[self.game_id]
+        logger.debug(f"[Game {self.game_id}] Game actor stopped")
+
+    def add_snapshot(self, state: Dict[str, Any]) -> None:
+        self.snapshots.append((now_ms(), state))
+        self.snapshot_seq += 1
+
+    def ensure_spectator_feed(self) -> None:
+        if self._feed_task is None or self._feed_task.done():
+            self._feed_task = asyncio.get_running_loop().create_task(self._feed_spectators())
+
+    async def _feed_spectators(self) -> None:
+        """
+        Sends the latest snapshot to spectators at `PONG_SPECTATOR_RATE`.
+
+        Each snapshot is serialized once per tick and the same text is sent to
+        every spectator. When the fan-out uses more than its share of a tick,
+        frames are skipped so spectators cannot slow the match down.
+        """
+        interval = 1 / SPECTATOR_RATE
+        stride, tick, sent_seq = 1, 0, None
+        while self.spectators:
+            await asyncio.sleep(interval)
+            tick += 1
+            if tick % stride:
+                continue
+
+            finished = self.status != PongGame.Status.ONGOING
+            if not finished and sent_seq == self.snapshot_seq:
+                continue
+            sent_seq = self.snapshot_seq
+            payload = json.dumps({
+                'type': 'game_complete' if finished else 'physics_update',
+                'state': self.latest_snapshot,
+                'scores': self.scores
+            })
+
+            started = time.monotonic()
+            await asyncio.gather(*(
+                self._send_to_spectator(channel_name, consumer, payload)
+                for channel_name, consumer in list(self.spectators.items())
+            ))
+            if finished:
+                return
+
+            elapsed = time.monotonic() - started
+            if elapsed > interval * SPECTATOR_TICK_BUDGET and stride < SPECTATOR_MAX_STRIDE:
+                stride *= 2
+                logger.warning(f"[Game {self.game_id}] Spectator fan-out too slow, sending one frame every {stride} ticks - spectators: {len(self.spectators)}, elapsed_ms: {int(elapsed * 1000)}")
+            elif stride > 1 and elapsed < interval * SPECTATOR_TICK_BUDGET / 4:
+                stride //= 2
+
+    async def _send_to_spectator(self, channel_name: str, consumer, payload: str) -> None:
+        try:
+            await consumer.send(text_data=payload)
+        except Exception as e:
+            logger.warning(f"[Game {self.game_id}] Dropping spectator after send failure: {str(e)}", extra={
+                'user_id': getattr(consumer.user, 'id', None)
+            })
+            self.spectators.pop(channel_name, None)
+
+    def ensure_clock_sync(self) -> None:
+        if self._clock_task is None or self._clock_task.done():
+            self._clock_task = asyncio.get_running_loop().create_task(self._sync_clocks())
+
+    async def _sync_clocks(self) -> None:
+        """Pings every player every `PONG_CLOCK_SYNC_INTERVAL` seconds, with their current estimates"""
+        while True:
+            await asyncio.sleep(CLOCK_SYNC_INTERVAL)
+            if not self.connections:
+                return
+            for consumer in list(self.connections.values()):
+                link = self.links.get(consumer.user.id)
+                try:
+                    await consumer.send(text_data=json.dumps({
+                        'type': 'clock_ping',
+                        't0': clock_ms(),
+                        **(link.serialize() if link else {})
+                    }))
+                except Exception as e:
+                    logger.debug(f"[Game {self.game_id}] Could not send clock ping: {str(e)}", extra={
+                        'user_id': consumer.user.id
+                    })
+
+    def record_clock_sample(self, user_id: int, data: Dict[str, Any], received_at: float) -> None:
+        """Folds a `clock_pong` reply into the estimates of the player's link"""
+        try:
+            t0, t1, t2 = float(data['t0']), float(data['t1']), float(data['t2'])
+        except (KeyError, TypeError, ValueError):
+            return
+        link = self.links.setdefault(user_id, ClockEstimator())
+        rtt = link.add_sample(t0, t1, t2, received_at)
+        if rtt is not None:
+            latency_stats.observe(rtt, link)
+
+    def latency_state(self) -> Dict[str, Any]:
+        return {str(user_id): link.serialize() for user_id, link in list(self.links.items())}
+
+    @property
+    def latest_snapshot(self) -> Optional[Dict[str, Any]]:
+        return self.snapshots[-1][1] if self.snapshots else None
+
+    @property
+    def latest_input(self) -> Optional[Dict[str, Any]]:
+        return self.inputs[-1][1] if self.inputs else None
+
+    def refresh_ready(self) -> None:
+        self.ready = {consumer.user.id for consumer in self.connections.values()}
+
+    @property
+    def is_ai_game(self) -> bool:
+        return self.game.player2_is_ai
+
+    @property
+    def is_local_game(self) -> bool:
+        return self.game.player2_is_guest
+
+    @property
+    def relays_inputs(self) -> bool:
+        """Whether both players are remote and inputs must be relayed"""
+        return not self.game.player2_is_ai and not self.game.player2_is_guest
+
+    def role_of(self, user) -> Optional[str]:
+        if user == self.game.player1:
+            return 'host'
+        if user == self.game.player2 or self.game.player2_is_ai or self.game.player2_is_guest:
+            return 'guest'
+        return None
+
+    def get_state(self) -> Dict[str, Any]:
+        """Returns current game state including AI player handling"""
+        return {
+            'player1': {
+                'id': self.game.player1.id,
+                'username': self.game.player1.username,
+                'is_connected': self.game.player1.id in self.ready,
+                'is_host': True
+            },
+            'player2': {
+                'id': self.game.player2.id if self.game.player2 else None,
+                'username': (self.game.player2.username if self.game.player2 else
+                             'AI' if self.game.player2_is_ai else
+                             'Guest'),
+                'is_connected': not self.game.player2_is_ai or not self.game.player2_is_guest,
+                'is_ai': self.game.player2_is_ai,
+                'is_guest': self.game.player2_is_guest,
+                'is_host': False
+            },
+            'scores': dict(self.scores),
+            'status': self.status,
+            'is_ai_game': self.game.player2_is_ai,
+            'is_local_game': self.game.player2_is_guest
+        }
+
+    @database_sync_to_async
+    def _load_game(self) -> Optional[PongGame]:
+        try:
+            return PongGame.objects.select_related('player1', 'player2', 'room').get(id=self.game_id)
+        except PongGame.DoesNotExist:
+            return None
+
+    async def ensure_loaded(self) -> bool:
+        if self.game is None:
+            self.game = await self._load_game()
+            if self.game is None:
+                return False
+            self.status = self.game.status
+            self.scores = {'left': self.game.player1_score, 'right': self.game.player2_score}
+            score_store.track(self.game)
+        return True
+
+# Handlers, executed one at a time by the actor of the game
+
+async def join(actor: GameActor, consumer) -> Dict[str, Any]:
+    """
+    Validates and registers a player connection.
+
+    Returns a dict with either an `error` close code or the player role.
+    """
+    if not await actor.ensure_loaded():
+        logger.error(f"Game not found: game_id={actor.game_id}", extra={
+            'user_id': consumer.user.id
+        })
+        return {'error': 4004}
+
+    role = actor.role_of(consumer.user)
+    if role is None:
+        logger.error(f"[Game {actor.game_id}] User not authorized for game - player1_id: {actor.game.player1.id}, player2_id: {getattr(actor.game.player2, 'id', None)}, is_ai: {actor.game.player2_is_ai}, is_local: {actor.game.player2_is_guest}", extra={
+            'user_id': consumer.user.id
+        })
+        return {'error': 4003}
+
+    if actor.status != PongGame.Status.ONGOING:
+        logger.error(f"[Game {actor.game_id}] Game is not in ongoing state - status: {actor.status}", extra={
+            'user_id': consumer.user.id
+        })
+        return {'error': 4005}
+
+    actor.channel_layer = consumer.channel_layer
+    actor.connections[consumer.channel_name] = consumer
+    actor.refresh_ready()
+    actor.links[consumer.user.id] = ClockEstimator()
+    actor.ensure_clock_sync()
+
+    handle = actor.reconnecting.pop(consumer.user.id, None)
+    if handle is not None:
+        handle.cancel()
+        logger.info(f"[Game {actor.game_id}] Player reconnected within grace window", extra={
+            'user_id': consumer.user.id
+        })
+        await actor.channel_layer.group_send(
+            f'pong_game_{actor.game_id}',
+            {
+                'type': 'player_reconnected',
+                'user_id': consumer.user.id,
+                'is_host': role == 'host'
+            }
+        )
+    return {'is_host': role == 'host', 'is_guest': role == 'guest', 'resumed': handle is not None}
+
+async def leave(actor: GameActor, consumer, close_code: Optional[int] = None) -> None:
+    """
+    Unregisters a connection.
+
+    A player leaving on purpose forfeits the game right away. A dropped
+    socket holds the game open for `PONG_RECONNECT_GRACE` seconds so the
+    player can resume it.
+    """
+    if actor.connections.pop(consumer.channel_name, None) is None:
+        return
+    actor.refresh_ready()
+    if consumer.user.id in actor.ready:
+        return
+
+    if actor.status != PongGame.Status.ONGOING or close_code == NORMAL_CLOSURE or RECONNECT_GRACE <= 0:
+        await _forfeit(actor, consumer.user.id, consumer.is_host)
+        return
+
+    logger.info(f"[Game {actor.game_id}] Player connection lost, holding game for {RECONNECT_GRACE}s - close_code: {close_code}", extra={
+        'user_id': consumer.user.id
+    })
+    user_id, is_host = consumer.user.id, consumer.is_host
+    actor.reconnecting[user_id] = asyncio.get_running_loop().call_later(
+        RECONNECT_GRACE, actor.submit, _expire_grace, user_id, is_host
+    )
+    await actor.channel_layer.group_send(
+        f'pong_game_{actor.game_id}',
+        {
+            'type': 'player_reconnecting',
+            'user_id': user_id,
+            'is_host': is_host,
+            'grace_ms': int(RECONNECT_GRACE * 1000)
+        }
+    )
+
+async def _expire_grace(actor: GameActor, user_id: int, is_host: bool) -> None:
+    if actor.reconnecting.pop(user_id, None) is None or user_id in actor.ready:
+        return
+    logger.info(f"[Game {actor.game_id}] Player did not reconnect in time", extra={
+        'user_id': user_id
+    })
+    await _forfeit(actor, user_id, is_host)
+
+async def _forfeit(actor: GameActor, user_id: int, is_host: bool) -> None:
+    await actor.channel_layer.group_send(
+        f'pong_game_{actor.game_id}',
+        {
+            'type': 'player_disconnected',
+            'user_id': user_id,
+            'is_host': is_host
+        }
+    )
+    if actor.status != PongGame.Status.ONGOING:
+        return
+    actor.status = PongGame.Status.FINISHED
+    for handle in actor.reconnecting.values():
+        handle.cancel()
+    actor.reconnecting.clear()
+    await score_store.forfeit(
+        actor.game.id,
+        'player1_score' if is_host else 'player2_score',
+        actor.game.room_id
+    )
+    await replay_recorder.finish(actor.game.id)
+    game = actor.game
+    winner_id = game.player2_id if is_host else game.player1_id
+    await _record_bracket_result(actor, winner_id)
+    # Stored scores: -1 for the player who forfeited
+    player1_score = -1 if is_host else actor.scores['left']
+    player2_score = actor.scores['right'] if is_host else -1
+    await _announce_result(actor, winner_id, user_id, f"{player1_score}-{player2_score}")
+
+async def watch(actor: GameActor, consumer) -> Dict[str, Any]:
+    """
+    Registers a spectator connection.
+
+    Returns a dict with an `error` close code if the game cannot be watched.
+    """
+    if not await actor.ensure_loaded():
+        return {'error': 4004}
+    if actor.status != PongGame.Status.ONGOING:
+        return {'error': 4005}
+    if len(actor.spectators) >= MAX_SPECTATORS:
+        logger.warning(f"[Game {actor.game_id}] Spectator limit reached - spectators: {len(actor.spectators)}", extra={
+            'user_id': consumer.user.id
+        })
+        return {'error': 4009}
+    actor.spectators[consumer.channel_name] = consumer
+    actor.ensure_spectator_feed()
+    return {}
+
+async def unwatch(actor: GameActor, consumer) -> None:
+    actor.spectators.pop(consumer.channel_name, None)
+
+async def handle_message(actor: GameActor, consumer, data: Dict[str, Any]) -> None:
+    """Dispatches a message received on one of the game's sockets"""
+    handler = MESSAGE_HANDLERS.get(data.get('type'))
+    if handler is None:
+        logger.warning(f"Received unknown message type: {data.get('type')}", extra={
+            'user_id': consumer.user.id
+        })
+        return
+    await handler(actor, consumer, data)
+
+async def _on_player_ready(actor: GameActor, consumer, data: Dict[str, Any]) -> None:
+    await consumer.channel_layer.group_send(
+        consumer.game_group_name,
+        {
+            'type': 'player_ready',
+            'user_id': data.get('user_id'),
+            'is_host': consumer.is_host,
+            'is_ai_opponent': actor.is_ai_game,
+            'is_guest_opponent': actor.is_local_game
+        }
+    )
+
+async def _on_physics_update(actor: GameActor, consumer, data: Dict[str, Any]) -> None:
+    # Only relays physics updates from host to client (host is authoritative)
+    if consumer.is_host and actor.relays_inputs:
+        actor.add_snapshot(data.get('state'))
+        replay_recorder.record_snapshot(actor.game.id, data.get('state'), actor.scores)
+        await consumer.channel_layer.group_send(
+            consumer.game_group_name,
+            {
+                'type': 'relay_physics_update',
+                'state': data.get('state'),
+                'from_user': consumer.user.id
+            }
+        )
+
+async def _on_paddle_input(actor: GameActor, consumer, data: Dict[str, Any]) -> None:
+    # Only relay from guest to host (client input to server)
+    if not consumer.is_host and actor.relays_inputs:
+        received_at = clock_ms()
+        issued_at = input_issued_at(data.get('t'), received_at, actor.links.get(consumer.user.id))
+        host_link = actor.links.get(actor.game.player1.id)
+        host_delay = host_link.rtt / 2 if host_link is not None and host_link.rtt is not None else 0
+        lag_ms = min(received_at - issued_at + host_delay, LAG_COMPENSATION_WINDOW)
+
+        actor.inputs.append((now_ms(), {
+            'type': data['type'],
+            'direction': data.get('direction', 0),
+            'intensity': data.get('intensity', 1.0)
+        }))
+        replay_recorder.record_input(actor.game.id, data.get('direction', 0), data.get('intensity', 1.0))
+        await consumer.channel_layer.group_send(
+            consumer.game_group_name,
+            {
+                'type': 'relay_paddle_input',
+                'input_type': data['type'],
+                'direction': data.get('direction', 0),
+                'intensity': data.get('intensity', 1.0),
+                'lag_ms': round(lag_ms),
+                'from_user': consumer.user.id
+            }
+        )
+        await _compensate_input(actor, consumer, data, issued_at, received_at)
+
+async def _compensate_input(actor: GameActor, consumer, data: Dict[str, Any], issued_at: float, received_at: float) -> None:
+    """Rewinds a late guest input and sends the host a correction if it turns a miss into a hit"""
+    if issued_at >= received_at or actor.rewound_seq == actor.snapshot_seq:
+        return
+    actor.rewound_seq = actor.snapshot_seq
+    latency_stats.rewinds += 1
+
+    direction = data.get('direction', 0) if data['type'] == 'paddle_move' else 0
+    intensity = data.get('intensity', 1.0)
+    if not isinstance(direction, (int, float)) or not isinstance(intensity, (int, float)):
+        return
+    room_settings = actor.game.room.settings if actor.game.room else None
+    correction = rewind_guest_input(actor.snapshots, issued_at, direction * intensity * paddle_speed(room_settings), received_at)
+    if correction is None:
+        return
+
+    latency_stats.corrections += 1
+    logger.debug(f"[Game {actor.game_id}] Late guest input turned a miss into a hit - rewind_ms: {int(correction['rewind_ms'])}", extra={
+        'user_id': consumer.user.id
+    })
+    await consumer.channel_layer.group_send(
+        consumer.game_group_name,
+        {
+            'type': 'relay_lag_correction',
+            'correction': correction,
+            'from_user': consumer.user.id
+        }
+    )
+
+async def _on_update_scores(actor: GameActor, consumer, data: Dict[str, Any]) -> None:
+    if actor.status != PongGame.Status.ONGOING:
+        return
+    scores = data.get('scores', {})
+    actor.scores = {'left': scores.get('left', 0), 'right': scores.get('right', 0)}
+    logger.debug(f"[Game {actor.game_id}] Updating scores - {actor.scores['left']}-{actor.scores['right']}", extra={
+        'user_id': consumer.user.id
+    })
+    score_store.record_scores(actor.game.id, actor.scores['left'], actor.scores['right'])
+
+async def _on_game_complete(actor: GameActor, consumer, data: Dict[str, Any]) -> None:
+    if not consumer.is_host:
+        logger.warning(f"Non-host player tried to complete game", extra={
+            'user_id': consumer.user.id
+        })
+        return
+    if actor.status != PongGame.Status.ONGOING:
+        return
+
+    scores = data.get('scores', {})
+    player1_score = scores.get('left', 0)
+    player2_score = scores.get('right', 0)
+    actor.scores = {'left': player1_score, 'right': player2_score}
+    actor.status = PongGame.Status.FINISHED
+
+    logger.info(f"[Game {actor.game_id}] Game finished - scores: {player1_score}-{player2_score}", extra={
+        'user_id': consumer.user.id
+    })
+
+    # Persist final result
+    await score_store.finish(actor.game.id, player1_score, player2_score, actor.game.room_id)
+    await replay_recorder.finish(actor.game.id)
+
+    # Notify room about game completion and trigger room state update
+    game = actor.game
+    await _record_bracket_result(actor, game.player1_id if player1_score > player2_score else game.player2_id)
+    await _announce_result(
+        actor,
+        game.player1.id if player1_score > player2_score else game.player2.id if game.player2 else None,
+        game.player1.id if player1_score < player2_score else game.player2.id if game.player2 else None,
+        f"{player1_score}-{player2_score}"
+    )
+
+async def _announce_result(actor: GameActor, winner_id: Optional[int], loser_id: Optional[int], final_score: str) -> None:
+    """Tells the room a game is over, so it can go back to the lobby or start the next round"""
+    room = actor.game.room
+    if room is None:
+        return
+    await actor.channel_layer.group_send(
+        f'pong_room_{room.room_id}',
+        {
+            'type': 'game_finished',
+            'winner_id': winner_id,
+            'loser_id': loser_id,
+            'final_score': final_score
+        }
+    )
+
+async def _record_bracket_result(actor: GameActor, winner_id: Optional[int]) -> None:
+    """Advances the winner of a tournament game, before the room hears about the result"""
+    room = actor.game.room
+    if room is None or room.mode != PongRoom.Mode.TOURNAMENT:
+        return
+    try:
+        await database_sync_to_async(record_result)(actor.game.id, winner_id)
+    except Exception as e:
+        logger.error(f"[Game {actor.game_id}] Error recording tournament result - error: {str(e)}, traceback: {traceback.format_exc()}")
+
+MESSAGE_HANDLERS = {
+    'player_ready': _on_player_ready,
+    'physics_update': _on_physics_update,
+    'paddle_move': _on_paddle_input,
+    'paddle_stop': _on_paddle_input,
+    'update_scores': _on_update_scores,
+    'game_complete': _on_game_complete,
+}
+
+# One actor per game on this worker
+_actors: Dict[str, GameActor] = {}
+
+def get_actor(game_id: str) -> GameActor:
+    """Returns the actor of a game, starting it if needed"""
+    actor = _actors.get(game_id)
+    if actor is None or actor.closed or actor._task.get_loop() is not asyncio.get_running_loop():
+        actor = _actors[game_id] = GameActor(game_id)
+    return actor
+
+def find_actor(game_id: str) -> Optional[GameActor]:
+    """Returns the running actor of a game on this worker, without starting one"""
+    actor = _actors.get(str(game_id))
+    return actor if actor is not None and not actor.closed else None
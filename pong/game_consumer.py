@@ -1,24 +1,17 @@
 import json, traceback, logging
 from django.core.exceptions import ObjectDoesNotExist
-from django.utils import timezone
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
-from contextlib import asynccontextmanager
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from .models import PongGame
+from transcendence.rate_limit import RateLimiter
+from . import game_actor
+from .game_actor import get_actor
+from .latency import clock_ms
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
 
-@asynccontextmanager
-async def channel_layer_lock(channel_layer, lock_name, timeout=10):
-    """Provides distributed locking using Django Channels layer"""
-    lock_group = f"lock_{lock_name}"
-    try:
-        await channel_layer.group_add(lock_group, "lock_holder")
-        yield
-    finally:
-        await channel_layer.group_discard(lock_group, "lock_holder")
+RATE_LIMITS = getattr(settings, 'PONG_GAME_RATE_LIMITS', {})
 
 class PongGameConsumer(AsyncWebsocketConsumer):
     """
@@ -48,6 +41,7 @@ class PongGameConsumer(AsyncWebsocketConsumer):
             self.user = self.scope.get("user")
             self.game_id = self.scope['url_route']['kwargs']['game_id']
             self.game_group_name = f'pong_game_{self.game_id}'
+            self.limiter = RateLimiter('game', RATE_LIMITS)
 
             logger.info(f'[Game {self.game_id}] Game WebSocket connection attempt - connection_state: {self.connection_state}', extra={
                 'user_id': getattr(self.user, 'id', None)
@@ -64,67 +58,51 @@ class PongGameConsumer(AsyncWebsocketConsumer):
             self.connection_state = 'validating'
 
             try:
-                # 2. Get and validate game
-                self.game = await self.get_game()
-                if not self.game:
-                    logger.error(f"Game not found: game_id={self.game_id}", extra={
-                        'user_id': self.user.id
-                    })
-                    await self.close(code=4004)
-                    return
-
-                # 3. Determine and validate role (host/guest)
-                self.is_host = self.user == self.game.player1
-                self.is_guest = self.user == self.game.player2 or self.game.player2_is_ai or self.game.player2_is_guest
-
-                if not self.is_host and not self.is_guest:
-                    logger.error(f"[Game {self.game_id}] User not authorized for game - player1_id: {self.game.player1.id}, player2_id: {getattr(self.game.player2, 'id', None)}, is_ai: {self.game.player2_is_ai}, is_local: {self.game.player2_is_guest}", extra={
-                        'user_id': self.user.id
-                    })
-                    await self.close(code=4003)
-                    return
-
-                # 4. Check game status
-                if self.game.status != 'ongoing':
-                    logger.error(f"[Game {self.game_id}] Game is not in ongoing state - status: {self.game.status}", extra={
-                        'user_id': self.user.id
-                    })
-                    await self.close(code=4005)
+                # 2-4. Validate game, role and status through the game actor
+                self.actor = get_actor(self.game_id)
+                joined = await self.actor.submit(game_actor.join, self)
+                if 'error' in joined:
+                    await self.close(code=joined['error'])
                     return
 
+                self.game = self.actor.game
+                self.is_host = joined['is_host']
+                self.is_guest = joined['is_guest']
                 self.connection_state = 'validated'
 
-                # 5. Add to game group and accept connection using a lock
-                # TODO: Lock encore utile si gamestate sync par webrtc ?
-                async with channel_layer_lock(self.channel_layer, f"game_{self.game_id}_connect"):
-                    await self.channel_layer.group_add(self.game_group_name, self.channel_name)
-                    await self.accept()
-                    
-                    self.connection_state = 'connected'
-                    
-                    # 6. Send initial game state
-                    game_state = await self.get_game_state()
-                    await self.send(text_data=json.dumps({
-                        'type': 'game_state',
-                        'state': game_state,
-                        'is_host': self.is_host,
-                        'connection_state': self.connection_state,
-                        'is_ai_game': self.game.player2_is_ai,
-                        'is_local_game': self.game.player2_is_guest
-                    }))
-                    
-                    # 7. Notify other players about connection
-                    await self.notify_player_ready({
-                        'user_id': self.user.id,
-                        'username': self.user.username,
-                        'is_host': self.is_host,
-                        'is_ai_opponent': self.game.player2_is_ai,
-                        'is_guest_opponent': self.game.player2_is_guest
-                    })
+                # 5. Add to game group and accept connection
+                await self.channel_layer.group_add(self.game_group_name, self.channel_name)
+                await self.accept()
+                
+                self.connection_state = 'connected'
+                
+                # 6. Send initial game state, with the latest snapshot when resuming
+                game_state = self.actor.get_state()
+                await self.send(text_data=json.dumps({
+                    'type': 'game_state',
+                    'state': game_state,
+                    'is_host': self.is_host,
+                    'connection_state': self.connection_state,
+                    'is_ai_game': self.game.player2_is_ai,
+                    'is_local_game': self.game.player2_is_guest,
+                    'snapshot': self.actor.latest_snapshot,
+                    'reconnect_grace_ms': int(game_actor.RECONNECT_GRACE * 1000)
+                }))
+                if joined['resumed']:
+                    await self.send_resume_state()
+                
+                # 7. Notify other players about connection
+                await self.notify_player_ready({
+                    'user_id': self.user.id,
+                    'username': self.user.username,
+                    'is_host': self.is_host,
+                    'is_ai_opponent': self.game.player2_is_ai,
+                    'is_guest_opponent': self.game.player2_is_guest
+                })
 
-                    logger.info(f"[Game {self.game_id}] WebSocket connection accepted - is_host: {self.is_host}, connection_state: {self.connection_state}", extra={
-                        'user_id': self.user.id
-                    })
+                logger.info(f"[Game {self.game_id}] WebSocket connection accepted - is_host: {self.is_host}, connection_state: {self.connection_state}", extra={
+                    'user_id': self.user.id
+                })
 
             except ObjectDoesNotExist as e:
                 logger.error(f"Game or related object not found - game_id: {self.game_id}, connection_state: {self.connection_state}, error: {str(e)}", extra={
@@ -147,107 +125,29 @@ class PongGameConsumer(AsyncWebsocketConsumer):
         """
         Handles incoming WebSocket messages.
         
+        Messages are processed in order by the game actor.
         Message types:
         - player_ready: Player connection notification
+        - physics_update: Physics state updates (host only)
+        - paddle_move / paddle_stop: Paddle inputs (guest only)
+        - update_scores: Live score updates
         - game_complete: Game completion (host only)
-        - physics_update: Physics state updates
+        - clock_pong: Reply to a clock_ping, for RTT and clock offset estimates
         """
+        if not self.limiter.allow():
+            self.reject_message()
+            return
         try:
+            received_at = clock_ms()
             data = json.loads(text_data)
-            message_type = data.get('type')
-            
-            if message_type == 'player_ready':
-                await self.channel_layer.group_send(
-                    self.game_group_name,
-                    {
-                        'type': 'player_ready',
-                        'user_id': data.get('user_id'),
-                        'is_host': self.is_host,
-                        'is_ai_opponent': getattr(self.game, 'player2_is_ai', False),
-                        'is_guest_opponent': getattr(self.game, 'player2_is_guest', False)
-                    }
-                )
+            if not self.limiter.allow(data.get('type')):
+                self.reject_message()
                 return
-
-            # Physics update messages - relay to other player
-            elif message_type == 'physics_update':
-                # Only relays physics updates from host to client (host is authoritative)
-                if self.is_host and not self.game.player2_is_ai and not self.game.player2_is_guest:
-                    await self.channel_layer.group_send(
-                        self.game_group_name,
-                        {
-                            'type': 'relay_physics_update',
-                            'state': data.get('state'),
-                            'from_user': self.user.id
-                        }
-                    )
-                return
-            
-            # Paddle input messages
-            elif message_type in ['paddle_move', 'paddle_stop'] and not self.game.player2_is_ai and not self.game.player2_is_guest:
-                # Only relay from guest to host (client input to server)
-                if not self.is_host:
-                    await self.channel_layer.group_send(
-                        self.game_group_name,
-                        {
-                            'type': 'relay_paddle_input',
-                            'input_type': message_type,
-                            'direction': data.get('direction', 0),
-                            'intensity': data.get('intensity', 1.0),
-                            'from_user': self.user.id
-                        }
-                    )
+            if data.get('type') == 'clock_pong':
+                # Handled outside the actor queue so queueing delay does not count as RTT
+                self.actor.record_clock_sample(self.user.id, data, received_at)
                 return
-
-            elif message_type == 'update_scores':
-                scores = data.get('scores', {})
-                player1_score = scores.get('left', 0)
-                player2_score = scores.get('right', 0)
-                logger.debug(f"[Game {self.game_id}] Updating scores - {player1_score}-{player2_score}", extra={
-                    'user_id': self.user.id
-                })
-                await self.update_game_state(player1_score, player2_score, 'ongoing')
-
-            elif message_type == 'game_complete':
-                if not self.is_host:
-                    logger.warning(f"Non-host player tried to complete game", extra={
-                        'user_id': self.user.id
-                    })
-                    return
-
-                scores = data.get('scores', {})
-                player1_score = scores.get('left', 0)
-                player2_score = scores.get('right', 0)
-
-                logger.info(f"[Game {self.game_id}] Game finished - scores: {player1_score}-{player2_score}", extra={
-                    'user_id': self.user.id
-                })
-                
-                # Update game state
-                await self.update_game_state(
-                    player1_score,
-                    player2_score,
-                    'finished'
-                )
-
-                # Notify room about game completion and trigger room state update
-                if self.game.room:
-                    room_group_name = f'pong_room_{self.game.room.room_id}'
-                    # Send room state update first
-                    # Then send game finished notification
-                    await self.channel_layer.group_send(
-                        room_group_name,
-                        {
-                            'type': 'game_finished',
-                            'winner_id': self.game.player1.id if player1_score > player2_score else self.game.player2.id if self.game.player2 else None,
-							'loser': self.game.player1 if player1_score < player2_score else self.game.player2 if self.game.player2 else None,
-                            'final_score': f"{player1_score}-{player2_score}"
-                        }
-                    )
-            else:
-                logger.warning(f"Received unknown message type: {message_type}", extra={
-                    'user_id': self.user.id
-                })
+            await self.actor.submit(game_actor.handle_message, self, data)
 
         except json.JSONDecodeError:
             logger.error(f'Invalid game JSON data: {text_data}', extra={
@@ -256,7 +156,14 @@ class PongGameConsumer(AsyncWebsocketConsumer):
         except Exception as e:
             logger.error(f'Game error: {str(e)}, data: {text_data}', extra={
                 'user_id': self.user.id
-            })        
+            })
+
+    def reject_message(self):
+        # Game clients do not expect errors, dropped inputs are only logged
+        if self.limiter.notify():
+            logger.warning(f'[Game {self.game_id}] Dropping messages over the rate limit', extra={
+                'user_id': self.user.id
+            })
 
     async def relay_physics_update(self, event):
         """Relays physics update from host to guest players (WebSocket transport mode)"""
@@ -285,13 +192,22 @@ class PongGameConsumer(AsyncWebsocketConsumer):
                 await self.send(text_data=json.dumps({
                     'type': event['input_type'],
                     'direction': event['direction'],
-                    'intensity': event['intensity']
+                    'intensity': event['intensity'],
+                    'lag_ms': event.get('lag_ms', 0)
                 }))
             except Exception as e:
                 logger.warning(f"[Game {self.game_id}] Could not relay paddle input: {str(e)}", extra={
                     'user_id': getattr(self.user, 'id', None)
                 })
 
+    async def relay_lag_correction(self, event):
+        """Sends the host the outcome of a rewound guest input"""
+        if self.is_host and event['from_user'] != self.user.id:
+            await self.send(text_data=json.dumps({
+                'type': 'lag_correction',
+                **event['correction']
+            }))
+
     async def disconnect(self, close_code):
         """Handles cleanup on connection close"""
         logger.info(f"[Game {self.game_id}] Game disconnection - close_code: {close_code}", extra={
@@ -306,76 +222,26 @@ class PongGameConsumer(AsyncWebsocketConsumer):
                 )
                 
                 if hasattr(self, 'game') and hasattr(self, 'user') and not self.user.is_anonymous:
-                    await self.channel_layer.group_send(
-                        self.game_group_name,
-                        {
-                            'type': 'player_disconnected',
-                            'user_id': self.user.id,
-                            'is_host': getattr(self, 'is_host', False)
-                        }
-                    )
-                    
-                    # Ne mettre à jour que si le jeu est toujours en cours
-                    current_status = await self.get_current_game_status()
-                    if current_status == 'ongoing':
-                        await self.update_game_on_disconnect()
+                    # Notifies the other player and forfeits the game, right away
+                    # or once the reconnect grace window expires
+                    await self.actor.submit(game_actor.leave, self, close_code)
 
             except Exception as e:
                 logger.error(f"[Game {self.game_id}] Error during disconnect cleanup - error: {str(e)}, traceback: {traceback.format_exc()}", extra={
                     'user_id': self.user.id
                 })
 
-    @database_sync_to_async
-    def get_game(self):
-        """Retrieves game instance with related players"""
-        try:
-            return PongGame.objects.select_related('player1', 'player2').get(id=self.game_id)
-        except PongGame.DoesNotExist:
-            return None
-
-    @database_sync_to_async
-    def get_game_state(self):
-        """Returns current game state including AI player handling"""
-        return {
-            'player1': {
-                'id': self.game.player1.id,
-                'username': self.game.player1.username,
-                'is_connected': True,
-                'is_host': True
-            },
-            'player2': {
-                'id': self.game.player2.id if self.game.player2 else None,
-                'username': (self.game.player2.username if self.game.player2 else
-                             'AI' if self.game.player2_is_ai else
-                             'Guest'),
-                'is_connected': not self.game.player2_is_ai or not self.game.player2_is_guest,
-                'is_ai': self.game.player2_is_ai,
-                'is_guest': self.game.player2_is_guest,
-                'is_host': False
-            },
-            'scores': {
-                'left': self.game.player1_score,
-                'right': self.game.player2_score
-            },
-            'status': self.game.status,
-            'is_ai_game': self.game.player2_is_ai,
-            'is_local_game': self.game.player2_is_guest
-        }
-    
-    @database_sync_to_async
-    def update_game_state(self, player1_score, player2_score, status):
-        """Updates game scores and status"""
-        if self.game:
-            self.game.player1_score = player1_score
-            self.game.player2_score = player2_score
-            self.game.status = status
-            if status == 'finished':
-                self.game.finished_at = timezone.now()
-                # Update room state to LOBBY when game finishes
-                if self.game.room:
-                    self.game.room.state = 'LOBBY'
-                    self.game.room.save()
-            self.game.save()
+    async def send_resume_state(self):
+        """Sends the latest buffered state to a player resuming the game"""
+        snapshot = self.actor.latest_snapshot
+        if snapshot is not None and not self.is_host:
+            await self.send(text_data=json.dumps({
+                'type': 'physics_update',
+                'state': snapshot
+            }))
+        last_input = self.actor.latest_input
+        if last_input is not None and self.is_host:
+            await self.send(text_data=json.dumps(last_input))
 
     async def notify_player_ready(self, event):
         """Notifies clients about player connection status"""
@@ -393,28 +259,6 @@ class PongGameConsumer(AsyncWebsocketConsumer):
                 'user_id': getattr(self.user, 'id', None)
             })
 
-    @database_sync_to_async
-    def get_current_game_status(self):
-        """Récupère le statut actuel du jeu depuis la base de données"""
-        return PongGame.objects.get(id=self.game_id).status
-
-    @database_sync_to_async
-    def update_game_on_disconnect(self):
-        """Handles game state updates on player disconnection"""
-        self.game.refresh_from_db()  # Actualise l'état depuis la base
-        if self.game.status == 'ongoing':
-            self.game.status = 'finished'
-            min_score = -1
-            if self.is_host:
-                self.game.player1_score = min_score
-            else:
-                self.game.player2_score = min_score
-            self.game.finished_at = timezone.now()
-            self.game.save()
-            if self.game.room:
-                self.game.room.state = 'LOBBY'
-                self.game.room.save()
-
     async def player_disconnected(self, event):
         """Broadcasts player disconnection to remaining clients"""
         try:
@@ -428,6 +272,27 @@ class PongGameConsumer(AsyncWebsocketConsumer):
                 'user_id': getattr(self.user, 'id', None)
             })
 
+    async def player_reconnecting(self, event):
+        """Tells remaining clients that a player dropped and may come back"""
+        if event['user_id'] == self.user.id:
+            return
+        await self.send(text_data=json.dumps({
+            'type': 'player_reconnecting',
+            'user_id': event['user_id'],
+            'is_host': event.get('is_host', False),
+            'grace_ms': event.get('grace_ms')
+        }))
+
+    async def player_reconnected(self, event):
+        """Tells remaining clients that a dropped player resumed the game"""
+        if event['user_id'] == self.user.id:
+            return
+        await self.send(text_data=json.dumps({
+            'type': 'player_reconnected',
+            'user_id': event['user_id'],
+            'is_host': event.get('is_host', False)
+        }))
+
     async def player_ready(self, event):
         """Handles player_ready messages sent through the channel layer"""
         try:
@@ -0,0 +1,110 @@
+import math
+from itertools import islice
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from django.conf import settings
+from .latency import ClockEstimator
+
+LAG_COMPENSATION_WINDOW = getattr(settings, 'PONG_LAG_COMPENSATION_WINDOW', 200.0)
+MAX_REWIND_STEPS = getattr(settings, 'PONG_MAX_REWIND_STEPS', 16)
+
+# Mirrors transcendence/frontend/pong/core/GameRules.js
+CANVAS_HEIGHT = 525
+BASE_PADDLE_SPEED = 50
+DEFAULT_PADDLE_SPEED = 5
+MAX_BOUNCE_ANGLE = math.pi / 4
+
+def paddle_speed(room_settings: Optional[Dict[str, Any]]) -> float:
+    """Paddle speed in px/s for the settings of a room"""
+    try:
+        level = float((room_settings or {}).get('paddleSpeed', DEFAULT_PADDLE_SPEED))
+    except (TypeError, ValueError):
+        level = DEFAULT_PADDLE_SPEED
+    return BASE_PADDLE_SPEED * level
+
+def input_issued_at(sent_at: Any, received_at: float, link: Optional[ClockEstimator]) -> float:
+    """
+    Estimates when an input was issued, on the server clock.
+
+    Uses the client timestamp when there is one, falls back to half the RTT
+    of the link, and never goes back further than the compensation window.
+    """
+    issued_at = None
+    if isinstance(sent_at, (int, float)):
+        issued_at = float(sent_at)
+    elif link is not None and link.rtt is not None:
+        issued_at = received_at - link.rtt / 2
+    if issued_at is None or issued_at > received_at:
+        return received_at
+    return max(issued_at, received_at - LAG_COMPENSATION_WINDOW)
+
+def _clamp_paddle(y: float, height: float) -> float:
+    return max(height / 2, min(CANVAS_HEIGHT - height / 2, y))
+
+def _number(value: Any, default: float = 0.0) -> float:
+    return float(value) if isinstance(value, (int, float)) else default
+
+def rewind_guest_input(history: Sequence[Tuple[int, Dict[str, Any]]], issued_at: float, dy: float, now: float) -> Optional[Dict[str, Any]]:
+    """
+    Replays a late guest input against the recent host snapshots.
+
+    The right paddle is moved from `issued_at` with the new velocity `dy`.
+    If the ball crossed the paddle plane after that point and the recorded
+    paddle missed it while the rewound one would have hit it, returns a
+    correction holding the ball bounced off the paddle at the crossing time.
+    At most `MAX_REWIND_STEPS` snapshots are replayed.
+    """
+    base_index = None
+    for index, (t, _) in enumerate(history):
+        if t > issued_at:
+            break
+        base_index = index
+    if base_index is None:
+        return None
+    steps: List[Tuple[int, Dict[str, Any]]] = list(islice(history, base_index, base_index + MAX_REWIND_STEPS + 1))
+    if len(steps) < 2:
+        return None
+
+    base_time, base_state = steps[0]
+    base_paddle = base_state.get('rightPaddle') or {}
+    height = _number(base_paddle.get('height'), 50.0)
+    start_y = _number(base_paddle.get('y')) + _number(base_paddle.get('dy')) * (issued_at - base_time) / 1000
+
+    def paddle_y_at(t: float) -> float:
+        return _clamp_paddle(start_y + dy * (t - issued_at) / 1000, height)
+
+    for (t0, before), (t1, after) in zip(steps, steps[1:]):
+        ball0, ball1 = before.get('ball') or {}, after.get('ball') or {}
+        paddle = after.get('rightPaddle') or {}
+        if before.get('scores') != after.get('scores'):
+            return None
+        if _number(ball0.get('dx')) <= 0 or _number(ball1.get('dx')) <= 0 or t1 <= t0:
+            continue
+        radius = _number(ball0.get('radius'), 5.0)
+        plane = _number(paddle.get('x')) - _number(paddle.get('width'), 10.0) / 2
+        x0, x1 = _number(ball0.get('x')) + radius, _number(ball1.get('x')) + radius
+        if not (x0 < plane <= x1):
+            continue
+
+        # Ball crossed the paddle plane between the two snapshots without bouncing
+        ratio = (plane - x0) / (x1 - x0)
+        crossed_at = t0 + ratio * (t1 - t0)
+        ball_y = _number(ball0.get('y')) + ratio * (_number(ball1.get('y')) - _number(ball0.get('y')))
+        rewound_y = paddle_y_at(max(crossed_at, issued_at))
+        if abs(ball_y - rewound_y) > height / 2 + radius:
+            return None
+
+        speed = math.hypot(_number(ball0.get('dx')), _number(ball0.get('dy')))
+        angle = (ball_y - rewound_y) / height * MAX_BOUNCE_ANGLE
+        return {
+            'at': crossed_at,
+            'ball': {
+                'x': plane - radius,
+                'y': ball_y,
+                'dx': -speed * math.cos(angle),
+                'dy': speed * math.sin(angle)
+            },
+            'paddle_y': paddle_y_at(now),
+            'scores': before.get('scores'),
+            'rewind_ms': now - issued_at
+        }
+    return None
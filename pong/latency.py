@@ -0,0 +1,106 @@
+import bisect, time
+from typing import Any, Dict, List, Optional
+from django.conf import settings
+
+CLOCK_SYNC_INTERVAL = getattr(settings, 'PONG_CLOCK_SYNC_INTERVAL', 2.0)
+
+# Weight of a new sample in the smoothed estimates (as for TCP's SRTT)
+SMOOTHING = 0.125
+JITTER_SMOOTHING = 0.25
+
+# Upper bounds, in ms, of the histogram buckets; the last bucket is unbounded
+HISTOGRAM_BOUNDS = (5, 10, 20, 50, 100, 200, 500, 1000)
+
+def clock_ms() -> float:
+    return time.time() * 1000
+
+class ClockEstimator:
+    """
+    NTP-style estimate of the round-trip time and clock offset of one link.
+
+    A sample is made of the server send time `t0`, the client receive and
+    send times `t1` and `t2`, and the server receive time `t3`. The offset
+    is the client clock minus the server clock.
+    """
+
+    def __init__(self):
+        self.rtt: Optional[float] = None
+        self.offset: Optional[float] = None
+        self.jitter = 0.0
+        self.samples = 0
+
+    def add_sample(self, t0: float, t1: float, t2: float, t3: float) -> Optional[float]:
+        """Folds one exchange into the estimates and returns its RTT, or None if invalid"""
+        rtt = (t3 - t0) - (t2 - t1)
+        if rtt < 0 or t2 < t1:
+            return None
+        offset = ((t1 - t0) + (t2 - t3)) / 2
+        if self.rtt is None:
+            self.rtt, self.offset, self.jitter = rtt, offset, rtt / 2
+        else:
+            self.jitter += JITTER_SMOOTHING * (abs(rtt - self.rtt) - self.jitter)
+            self.rtt += SMOOTHING * (rtt - self.rtt)
+            self.offset += SMOOTHING * (offset - self.offset)
+        self.samples += 1
+        return rtt
+
+    @property
+    def interpolation_delay(self) -> Optional[float]:
+        """Suggested buffering delay for remote state: one way trip plus twice the jitter"""
+        if self.rtt is None:
+            return None
+        return self.rtt / 2 + 2 * self.jitter
+
+    def serialize(self) -> Dict[str, Any]:
+        def rounded(value):
+            return round(value, 1) if value is not None else None
+        return {
+            'rtt_ms': rounded(self.rtt),
+            'offset_ms': rounded(self.offset),
+            'jitter_ms': rounded(self.jitter),
+            'interpolation_delay_ms': rounded(self.interpolation_delay),
+            'samples': self.samples
+        }
+
+class Histogram:
+    def __init__(self, bounds=HISTOGRAM_BOUNDS):
+        self.bounds = list(bounds)
+        self.counts: List[int] = [0] * (len(self.bounds) + 1)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += 1
+        self.sum += value
+
+    def serialize(self) -> Dict[str, Any]:
+        labels = [f'le_{bound}' for bound in self.bounds] + ['inf']
+        return {
+            'buckets': dict(zip(labels, self.counts)),
+            'count': self.total,
+            'mean': round(self.sum / self.total, 1) if self.total else None
+        }
+
+class LatencyStats:
+    """Aggregate RTT and jitter histograms and lag compensation counters of this worker"""
+
+    def __init__(self):
+        self.rtt = Histogram()
+        self.jitter = Histogram()
+        self.rewinds = 0
+        self.corrections = 0
+
+    def observe(self, rtt: float, estimator: ClockEstimator) -> None:
+        self.rtt.observe(rtt)
+        self.jitter.observe(estimator.jitter)
+
+    def serialize(self) -> Dict[str, Any]:
+        return {
+            'rtt_ms': self.rtt.serialize(),
+            'jitter_ms': self.jitter.serialize(),
+            'rewinds': self.rewinds,
+            'corrections': self.corrections
+        }
+
+latency_stats = LatencyStats()
@@ -0,0 +1,122 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q, QuerySet
+from django.utils import timezone
+from .bracket import record_result
+from .models import Match, PongGame, PongRoom
+
+logger = logging.getLogger(__name__)
+
+ROOM_IDLE_TIMEOUT = getattr(settings, 'PONG_ROOM_IDLE_TIMEOUT', 600.0)
+ROOM_MAX_IDLE = getattr(settings, 'PONG_ROOM_MAX_IDLE', 86400.0)
+GAME_STALE_TIMEOUT = getattr(settings, 'PONG_GAME_STALE_TIMEOUT', 3600.0)
+BATCH_SIZE = getattr(settings, 'PONG_MAINTENANCE_BATCH_SIZE', 500)
+
+PlayerThrough = PongRoom.players.through
+InvitationThrough = PongRoom.pending_invitations.through
+
+def _batches(queryset: QuerySet, batch_size: int) -> Iterator[List[int]]:
+    """
+    Yields the primary keys of a queryset one batch at a time.
+
+    The queryset is evaluated again for every batch, so each batch must be
+    processed out of it before the next one is read.
+    """
+    while True:
+        ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if ids:
+            yield ids
+        if len(ids) < batch_size:
+            return
+
+def _timeout_winner(game: Dict[str, int]) -> Optional[int]:
+    """Player ahead when a game timed out; the first player on a tie, so a bracket never stalls"""
+    if game['player2_id'] is not None and game['player2_score'] > game['player1_score']:
+        return game['player2_id']
+    return game['player1_id']
+
+def finalize_stale_games(now: datetime, batch_size: int = BATCH_SIZE) -> int:
+    """
+    Finishes ongoing games without activity for `PONG_GAME_STALE_TIMEOUT` seconds.
+
+    Activity is the last score flushed by the score store, or the start of
+    the game before the first point: a long match keeps going as long as
+    points are scored, while one whose actor is gone stops flushing. Their
+    last flushed scores are kept. Rooms left without an ongoing game go back
+    to the lobby, and tournament matches are won by the player ahead, in the
+    transaction finishing the games.
+    """
+    stale = PongGame.objects.filter(
+        status=PongGame.Status.ONGOING,
+        updated_at__lt=now - timedelta(seconds=GAME_STALE_TIMEOUT)
+    )
+    finalized = 0
+    for ids in _batches(stale, batch_size):
+        with transaction.atomic():
+            games = list(
+                stale.filter(pk__in=ids).select_for_update()
+                .values('id', 'room_id', 'player1_id', 'player2_id', 'player1_score', 'player2_score')
+            )
+            PongGame.objects.filter(pk__in=[game['id'] for game in games]).update(
+                status=PongGame.Status.FINISHED,
+                finished_at=now
+            )
+            PongRoom.objects.filter(
+                ~Exists(PongGame.objects.filter(room_id=OuterRef('pk'), status=PongGame.Status.ONGOING)),
+                pk__in={game['room_id'] for game in games if game['room_id']},
+                state=PongRoom.State.PLAYING
+            ).update(state=PongRoom.State.LOBBY)
+
+            # In the same transaction, so a game is never finished with its match still open
+            open_matches = set(
+                Match.objects.filter(pong_game_id__in=ids, winner__isnull=True).values_list('pong_game_id', flat=True)
+            )
+            for game in games:
+                if game['id'] in open_matches:
+                    record_result(game['id'], _timeout_winner(game))
+        finalized += len(games)
+    return finalized
+
+def expire_idle_rooms(now: datetime, batch_size: int = BATCH_SIZE) -> int:
+    """
+    Deletes rooms without an ongoing game that nobody used for a while.
+
+    Empty rooms go after `PONG_ROOM_IDLE_TIMEOUT` seconds, rooms still holding
+    players (left behind by a crashed worker) after `PONG_ROOM_MAX_IDLE`.
+    Their games and tournaments are kept.
+    """
+    idle = PongRoom.objects.filter(
+        ~Exists(PongGame.objects.filter(room_id=OuterRef('pk'), status=PongGame.Status.ONGOING)),
+        Q(~Exists(PlayerThrough.objects.filter(pongroom_id=OuterRef('pk'))), last_active_at__lt=now - timedelta(seconds=ROOM_IDLE_TIMEOUT)) |
+        Q(last_active_at__lt=now - timedelta(seconds=ROOM_MAX_IDLE))
+    )
+    expired = 0
+    for ids in _batches(idle, batch_size):
+        # The conditions are checked again so a room joined in between is kept
+        _, deleted = idle.filter(pk__in=ids).delete()
+        expired += deleted.get(PongRoom._meta.label, 0)
+    return expired
+
+def purge_orphaned_invitations(batch_size: int = BATCH_SIZE) -> int:
+    """Deletes pending invitations of users who already are players or the owner of the room"""
+    orphaned = InvitationThrough.objects.filter(
+        Exists(PlayerThrough.objects.filter(pongroom_id=OuterRef('pongroom_id'), user_id=OuterRef('user_id'))) |
+        Exists(PongRoom.objects.filter(pk=OuterRef('pongroom_id'), owner_id=OuterRef('user_id')))
+    )
+    purged = 0
+    for ids in _batches(orphaned, batch_size):
+        purged += InvitationThrough.objects.filter(pk__in=ids).delete()[0]
+    return purged
+
+def run_maintenance(now: Optional[datetime] = None) -> Dict[str, int]:
+    """Runs every maintenance task once and returns how many rows each one handled"""
+    now = now or timezone.now()
+    return {
+        # Games first: finishing them can leave their rooms idle
+        'stale_games': finalize_stale_games(now),
+        'idle_rooms': expire_idle_rooms(now),
+        'orphaned_invitations': purge_orphaned_invitations(),
+    }
@@ -0,0 +1,36 @@
+import logging, time, traceback
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from pong.maintenance import run_maintenance
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Finishes stale games, expires idle rooms and purges orphaned invitations, periodically or once'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run a single pass and exit')
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=getattr(settings, 'PONG_MAINTENANCE_INTERVAL', 60.0),
+            help='Seconds between two passes'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            try:
+                counts = run_maintenance()
+                if any(counts.values()):
+                    logger.info(f"Pong maintenance pass - {', '.join(f'{name}: {count}' for name, count in counts.items())}")
+                if options['once']:
+                    self.stdout.write(' '.join(f'{name}={count}' for name, count in counts.items()))
+            except Exception as e:
+                logger.error(f"Pong maintenance pass failed - error: {str(e)}, traceback: {traceback.format_exc()}")
+                if options['once']:
+                    raise
+            if options['once']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:55
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pong', '0010_match_player1_match_player2_match_position_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pongroom',
+            name='last_active_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='ponggame',
+            name='room',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='games', to='pong.pongroom'),
+        ),
+        migrations.AlterField(
+            model_name='tournament',
+            name='pong_room',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='tournament', to='pong.pongroom'),
+        ),
+        migrations.AddIndex(
+            model_name='ponggame',
+            index=models.Index(fields=['status', 'created_at'], name='ponggame_status_created'),
+        ),
+    ]
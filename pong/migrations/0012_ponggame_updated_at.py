@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:30
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pong', '0011_pongroom_last_active_at_alter_ponggame_room_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='ponggame',
+            name='ponggame_status_created',
+        ),
+        migrations.AddField(
+            model_name='ponggame',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='ponggame',
+            index=models.Index(fields=['status', 'updated_at'], name='ponggame_status_updated'),
+        ),
+    ]
@@ -1,13 +1,15 @@
 from django.db import models
 from authentication.models import User
 from django.conf import settings
+from django.utils import timezone
 
 class PongGame(models.Model):
     class Status(models.TextChoices):
         ONGOING = 'ongoing'
         FINISHED = 'finished'
 
-    room = models.ForeignKey('PongRoom', related_name='games', on_delete=models.CASCADE, null=True, blank=True)
+    # Games outlive their room, which pong.maintenance deletes once idle
+    room = models.ForeignKey('PongRoom', related_name='games', on_delete=models.SET_NULL, null=True, blank=True)
     player1 = models.ForeignKey(User, related_name='player1_games', on_delete=models.CASCADE, null=True, blank=True)
     player2 = models.ForeignKey(User, related_name='player2_games', on_delete=models.CASCADE, null=True, blank=True)
     player2_is_ai = models.BooleanField(default=False)
@@ -16,8 +18,15 @@ class PongGame(models.Model):
     player2_score = models.IntegerField(default=0)
     status = models.CharField(max_length=10, choices=Status.choices, default=Status.ONGOING)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Last score written while the game was ongoing, set by pong.score_store
+    updated_at = models.DateTimeField(default=timezone.now)
     finished_at = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'updated_at'], name='ponggame_status_updated'),
+        ]
+
     def __str__(self):
         return f"PONGGAME[{self.id}]: {self.status}"
 
@@ -50,6 +59,8 @@ class PongRoom(models.Model):
     mode = models.CharField(max_length=20, choices=Mode.choices, default=Mode.AI)
     state = models.CharField(max_length=20, choices=State.choices, default=State.LOBBY)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Last game start or player departure, read by pong.maintenance to expire idle rooms
+    last_active_at = models.DateTimeField(default=timezone.now, db_index=True)
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='owned_pong_rooms', null=True)
     settings = models.JSONField(default=dict)
 
@@ -150,10 +161,15 @@ class Tournament(models.Model):
 	name = models.CharField(max_length=100)
 	eliminated = models.ManyToManyField(User, related_name='eliminated_tournaments', blank=True)
 	status = models.CharField(max_length=10, choices=Status.choices, default=Status.UPCOMING)
-	pong_room = models.OneToOneField(PongRoom, on_delete=models.CASCADE, related_name='tournament')
+	pong_room = models.OneToOneField(PongRoom, on_delete=models.SET_NULL, related_name='tournament', null=True, blank=True)
 	pong_games = models.ManyToManyField(PongGame, related_name='tournaments')
 	start_date = models.DateTimeField(auto_now_add=True)
 	end_date = models.DateTimeField(null=True, blank=True)
+	# Bracket progress, maintained by pong.bracket
+	current_round = models.PositiveSmallIntegerField(default=0)
+	round_count = models.PositiveSmallIntegerField(default=0)
+	pending_matches = models.PositiveSmallIntegerField(default=0)
+	winner = models.ForeignKey(User, related_name='won_tournaments', on_delete=models.SET_NULL, null=True, blank=True)
 
 	def __str__(self):
 		return f"TOURNAMENT[{self.id}]: {self.name} - {self.status}"
@@ -166,7 +182,7 @@ class Tournament(models.Model):
 			'id': self.id,
 			'name': self.name,
 			'status': self.status,
-			'pong_room': self.pong_room.id,
+			'pong_room': self.pong_room_id,
 			'pong_games': [game.id for game in self.pong_games.all()],
 			'start_date': self.created_at.isoformat(),
 			'end_date': self.end_date.isoformat() if self.end_date else None,
@@ -174,10 +190,19 @@ class Tournament(models.Model):
 
 class Match(models.Model):
     tournament = models.ForeignKey(Tournament, related_name='matches', on_delete=models.CASCADE)
-    pong_game = models.OneToOneField(PongGame, on_delete=models.CASCADE)
+    pong_game = models.OneToOneField(PongGame, on_delete=models.CASCADE, null=True, blank=True)
     round_number = models.IntegerField()
-    scheduled_at = models.DateTimeField()
+    position = models.PositiveSmallIntegerField(default=0)
+    player1 = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE, null=True, blank=True)
+    player2 = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE, null=True, blank=True)
+    winner = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE, null=True, blank=True)
+    scheduled_at = models.DateTimeField(null=True, blank=True)
     completed_at = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['tournament', 'round_number', 'position'], name='match_bracket_slot'),
+        ]
+
     def __str__(self):
         return f"MATCH[{self.id}]: Tournament {self.tournament.id} - Round {self.round_number}"
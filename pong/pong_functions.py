@@ -26,7 +26,7 @@ def calculate_rankings(tournament: Tournament) -> List[Tuple[User, dict]]:
     Returns a list of tuples where each tuple contains a player and their stats.
     """
     rankings = {}
-    for game in Match.objects.filter(tournament=tournament):
+    for game in Match.objects.filter(tournament=tournament, pong_game__isnull=False):
         if game.completed_at:
             if game.pong_game.player1:
                 if game.pong_game.player1 not in rankings:
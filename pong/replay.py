@@ -0,0 +1,194 @@
+import asyncio, logging, os, struct, time, traceback
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Optional
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+REPLAY_ENABLED = getattr(settings, 'PONG_REPLAY_ENABLED', False)
+REPLAY_DIR = Path(getattr(settings, 'PONG_REPLAY_DIR', Path(settings.MEDIA_ROOT) / 'replays'))
+REPLAY_SNAPSHOT_RATE = getattr(settings, 'PONG_REPLAY_SNAPSHOT_RATE', 20.0)
+REPLAY_FLUSH_INTERVAL = getattr(settings, 'PONG_REPLAY_FLUSH_INTERVAL', 2.0)
+
+# File layout
+#   header:   magic, format version, game id, start time (epoch ms)
+#   record:   kind, ms since the previous record, then a kind-specific body
+#   snapshot: ball x, y (1/10 px), ball dx, dy (px/s), left and right paddle y (1/10 px), scores
+#   input:    direction (-1, 0, 1), intensity (0-255)
+MAGIC = b'PGRP'
+VERSION = 1
+HEADER = struct.Struct('<4sBIQ')
+RECORD = struct.Struct('<BH')
+SNAPSHOT = struct.Struct('<HHhhHHBB')
+INPUT = struct.Struct('<bB')
+
+KIND_SNAPSHOT = 1
+KIND_INPUT = 2
+
+POSITION_SCALE = 10
+
+def _clamp(value: float, low: int, high: int) -> int:
+    return max(low, min(high, int(round(value))))
+
+def replay_path(game_id: int) -> Path:
+    return REPLAY_DIR / f'{int(game_id)}.pgr'
+
+def encode_snapshot(state: Dict[str, Any], scores: Dict[str, int]) -> bytes:
+    """Quantizes a host physics state into a snapshot record body"""
+    ball = state.get('ball') or {}
+    left = state.get('leftPaddle') or {}
+    right = state.get('rightPaddle') or {}
+    return SNAPSHOT.pack(
+        _clamp(ball.get('x', 0) * POSITION_SCALE, 0, 0xFFFF),
+        _clamp(ball.get('y', 0) * POSITION_SCALE, 0, 0xFFFF),
+        _clamp(ball.get('dx', 0), -0x8000, 0x7FFF),
+        _clamp(ball.get('dy', 0), -0x8000, 0x7FFF),
+        _clamp(left.get('y', 0) * POSITION_SCALE, 0, 0xFFFF),
+        _clamp(right.get('y', 0) * POSITION_SCALE, 0, 0xFFFF),
+        _clamp(scores.get('left', 0), 0, 0xFF),
+        _clamp(scores.get('right', 0), 0, 0xFF),
+    )
+
+def encode_input(direction: float, intensity: float) -> bytes:
+    return INPUT.pack(_clamp(direction, -1, 1), _clamp(intensity * 255, 0, 255))
+
+def read_replay(data: bytes) -> Dict[str, Any]:
+    """Decodes a replay file into its header and a list of timed records"""
+    magic, version, game_id, started_at = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('Not a pong replay file')
+    records, offset, t = [], HEADER.size, 0
+    while offset + RECORD.size <= len(data):
+        kind, delta = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        t += delta
+        if kind == KIND_SNAPSHOT:
+            bx, by, dx, dy, ly, ry, left, right = SNAPSHOT.unpack_from(data, offset)
+            offset += SNAPSHOT.size
+            records.append({'t': t, 'type': 'snapshot', 'state': {
+                'ball': {'x': bx / POSITION_SCALE, 'y': by / POSITION_SCALE, 'dx': dx, 'dy': dy},
+                'leftPaddle': {'y': ly / POSITION_SCALE},
+                'rightPaddle': {'y': ry / POSITION_SCALE},
+            }, 'scores': {'left': left, 'right': right}})
+        elif kind == KIND_INPUT:
+            direction, intensity = INPUT.unpack_from(data, offset)
+            offset += INPUT.size
+            records.append({'t': t, 'type': 'input', 'direction': direction, 'intensity': intensity / 255})
+        else:
+            raise ValueError(f'Unknown replay record kind {kind}')
+    return {'game_id': game_id, 'started_at': started_at, 'records': records}
+
+async def iter_file(path: Path, start: int, length: int, chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+    """
+    Yields `length` bytes of a file from `start`, one chunk at a time.
+
+    Reads happen in a worker thread, so a response streams under ASGI
+    instead of being read into memory before it is sent.
+    """
+    f = await sync_to_async(open, thread_sensitive=False)(path, 'rb')
+    try:
+        f.seek(start)
+        while length > 0:
+            chunk = await sync_to_async(f.read, thread_sensitive=False)(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+class ReplayRecorder:
+    """
+    Write-behind recorder of game replays.
+
+    Snapshots and inputs are encoded into a per-game in-memory buffer on the
+    relay path and appended to the game's replay file every
+    `PONG_REPLAY_FLUSH_INTERVAL` seconds from a background task. Snapshots are
+    sampled down to `PONG_REPLAY_SNAPSHOT_RATE` per second.
+    """
+
+    def __init__(self, enabled: bool, snapshot_rate: float, interval: float):
+        self.enabled = enabled
+        self.snapshot_interval_ms = 1000 / snapshot_rate if snapshot_rate > 0 else 0
+        self.interval = interval
+        self._buffers: Dict[int, bytearray] = {}
+        self._last_record: Dict[int, int] = {}
+        self._last_snapshot: Dict[int, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def record_snapshot(self, game_id: int, state: Optional[Dict[str, Any]], scores: Dict[str, int]) -> None:
+        if not self.enabled or not isinstance(state, dict):
+            return
+        now = self._now()
+        last = self._last_snapshot.get(game_id)
+        if last is not None and now - last < self.snapshot_interval_ms:
+            return
+        self._last_snapshot[game_id] = now
+        self._append(game_id, KIND_SNAPSHOT, encode_snapshot(state, scores), now)
+
+    def record_input(self, game_id: int, direction: float, intensity: float) -> None:
+        if not self.enabled:
+            return
+        self._append(game_id, KIND_INPUT, encode_input(direction, intensity), self._now())
+
+    async def finish(self, game_id: int) -> None:
+        """Writes what is left of a game's replay and releases its buffer"""
+        if game_id not in self._buffers:
+            return
+        await self.flush(game_id)
+        self._buffers.pop(game_id, None)
+        self._last_record.pop(game_id, None)
+        self._last_snapshot.pop(game_id, None)
+
+    async def flush(self, game_id: Optional[int] = None) -> None:
+        """Appends buffered records of one game, or of all games if no id is given"""
+        game_ids = [game_id] if game_id is not None else list(self._buffers)
+        batch = {}
+        for gid in game_ids:
+            buffer = self._buffers.get(gid)
+            if buffer:
+                batch[gid] = bytes(buffer)
+                buffer.clear()
+        if not batch:
+            return
+        try:
+            await sync_to_async(self._write, thread_sensitive=False)(batch)
+        except Exception as e:
+            logger.error(f"Error writing game replays - games: {list(batch)}, error: {str(e)}, traceback: {traceback.format_exc()}")
+
+    def _append(self, game_id: int, kind: int, body: bytes, now: int) -> None:
+        buffer = self._buffers.get(game_id)
+        if buffer is None:
+            buffer = self._buffers[game_id] = bytearray()
+            self._last_record[game_id] = now
+            if not replay_path(game_id).exists():
+                buffer += HEADER.pack(MAGIC, VERSION, int(game_id), now)
+        delta = min(now - self._last_record[game_id], 0xFFFF)
+        self._last_record[game_id] = now
+        buffer += RECORD.pack(kind, delta)
+        buffer += body
+        self._ensure_flusher()
+
+    def _ensure_flusher(self) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self) -> None:
+        while any(self._buffers.values()):
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    @staticmethod
+    def _now() -> int:
+        return int(time.time() * 1000)
+
+    @staticmethod
+    def _write(batch: Dict[int, bytes]) -> None:
+        os.makedirs(REPLAY_DIR, exist_ok=True)
+        for game_id, data in batch.items():
+            with open(replay_path(game_id), 'ab') as f:
+                f.write(data)
+
+replay_recorder = ReplayRecorder(REPLAY_ENABLED, REPLAY_SNAPSHOT_RATE, REPLAY_FLUSH_INTERVAL)
@@ -0,0 +1,208 @@
+import asyncio, json, time
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+from django.conf import settings
+from channels.db import database_sync_to_async
+from .models import PongRoom
+
+ROOM_CACHE_TTL = getattr(settings, 'PONG_ROOM_CACHE_TTL', 5.0)
+
+# Reloads of a room whose snapshot was invalidated while it was being read
+MAX_LOAD_ATTEMPTS = 3
+
+def load_room_state(room_id: str) -> Optional[Dict[str, Any]]:
+    """Serializes a room with its owner, players and invitations fetched up front"""
+    room = (
+        PongRoom.objects
+        .select_related('owner')
+        .prefetch_related('players', 'pending_invitations')
+        .filter(room_id=room_id)
+        .first()
+    )
+    return room.serialize() if room is not None else None
+
+def _escape(key: str) -> str:
+    return str(key).replace('~', '~0').replace('/', '~1')
+
+def diff_state(old: Dict[str, Any], new: Dict[str, Any], path: str = '') -> List[Dict[str, Any]]:
+    """
+    JSON-Patch operations turning `old` into `new`.
+
+    Objects are compared key by key; lists and scalars are replaced as a
+    whole, which keeps the patch simple for the short player lists of a room.
+    """
+    ops = []
+    for key in old:
+        if key not in new:
+            ops.append({'op': 'remove', 'path': f'{path}/{_escape(key)}'})
+    for key, value in new.items():
+        target = f'{path}/{_escape(key)}'
+        if key not in old:
+            ops.append({'op': 'add', 'path': target, 'value': value})
+        elif isinstance(value, dict) and isinstance(old[key], dict):
+            ops.extend(diff_state(old[key], value, target))
+        elif old[key] != value:
+            ops.append({'op': 'replace', 'path': target, 'value': value})
+    return ops
+
+class RoomSnapshot:
+    """Serialized and versioned state of a room, shared by every consumer of the room on this worker"""
+
+    __slots__ = ('state', 'version', 'json', 'text', 'loaded_at')
+
+    def __init__(self, state: Dict[str, Any], version: int):
+        self.state = {**state, 'version': version}
+        self.version = version
+        self.json = json.dumps(self.state)
+        self.text = self.frame('room_update')
+        self.loaded_at = time.monotonic()
+
+    def frame(self, message_type: str) -> str:
+        """Socket frame carrying the room state, built around the already serialized JSON"""
+        return f'{{"type": {json.dumps(message_type)}, "room_state": {self.json}}}'
+
+    @property
+    def room(self) -> Dict[str, Any]:
+        """The serialized room without its version"""
+        return {k: v for k, v in self.state.items() if k != 'version'}
+
+    def patch_frame(self, previous: 'RoomSnapshot') -> str:
+        """Socket frame patching `previous` into this snapshot"""
+        return json.dumps({
+            'type': 'room_patch',
+            'base': previous.version,
+            'version': self.version,
+            'ops': diff_state(previous.room, self.room)
+        })
+
+class RoomMembers:
+    """
+    Owner, players and invited users of a room as last seen by this worker.
+
+    Shared by the room's consumers for permission checks. Refreshed from
+    every snapshot the cache loads and patched right away by the local
+    mutation paths; sets are replaced, never mutated in place, so the sync
+    side of a consumer can read them safely.
+    """
+
+    __slots__ = ('owner_id', 'players', 'invited')
+
+    def __init__(self):
+        self.owner_id: Optional[int] = None
+        self.players: FrozenSet[int] = frozenset()
+        self.invited: FrozenSet[int] = frozenset()
+
+    def update(self, state: Dict[str, Any]) -> None:
+        owner = state.get('owner')
+        self.owner_id = owner['id'] if owner else None
+        self.players = frozenset(player['id'] for player in state.get('players', []))
+        self.invited = frozenset(user['id'] for user in state.get('pendingInvitations', []))
+
+    def is_owner(self, user_id: int) -> bool:
+        return self.owner_id is not None and self.owner_id == user_id
+
+    def add_player(self, user_id: int) -> None:
+        self.players = self.players | {user_id}
+        self.invited = self.invited - {user_id}
+
+    def remove_player(self, user_id: int) -> None:
+        self.players = self.players - {user_id}
+
+    def remove_invitation(self, user_id: int) -> None:
+        self.invited = self.invited - {user_id}
+
+class RoomStateCache:
+    """
+    Per-worker cache of versioned room snapshots.
+
+    A room is loaded with one prefetching query set and serialized once, and
+    concurrent requests for the same room share the load. Every load that
+    finds a different state bumps the room's version, which starts from the
+    wall clock in ms so it keeps increasing across restarts. Mutation paths
+    call `invalidate()` after writing; entries also expire after
+    `PONG_ROOM_CACHE_TTL` seconds to bound staleness from writes made on
+    other workers. A room and its `RoomMembers` are tracked while consumers
+    are attached to it.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries: Dict[str, RoomSnapshot] = {}
+        self._latest: Dict[str, RoomSnapshot] = {}
+        self._published: Dict[str, RoomSnapshot] = {}
+        self._generations: Dict[str, int] = {}
+        self._refs: Dict[str, int] = {}
+        self._members: Dict[str, RoomMembers] = {}
+        self._loading: Dict[str, Tuple[int, asyncio.Task]] = {}
+
+    def attach(self, room_id: str) -> RoomMembers:
+        """Holds a room for a consumer and returns the room's shared membership"""
+        self._refs[room_id] = self._refs.get(room_id, 0) + 1
+        return self._members.setdefault(room_id, RoomMembers())
+
+    def detach(self, room_id: str) -> None:
+        """Releases a consumer's hold on a room, forgetting the room after the last one"""
+        refs = self._refs.get(room_id, 0) - 1
+        if refs > 0:
+            self._refs[room_id] = refs
+            return
+        for store in (self._refs, self._members, self._entries, self._latest, self._published, self._generations):
+            store.pop(room_id, None)
+
+    async def get(self, room_id: str, fresh: bool = False) -> Optional[RoomSnapshot]:
+        """Returns the snapshot of a room, loading it if missing, expired or `fresh` is set"""
+        if not fresh:
+            entry = self._entries.get(room_id)
+            if entry is not None and time.monotonic() - entry.loaded_at < self.ttl:
+                return entry
+        generation = self._generations.get(room_id, 0)
+        pending = self._loading.get(room_id)
+        if pending is None or pending[0] != generation:
+            pending = self._loading[room_id] = (generation, asyncio.ensure_future(self._load(room_id)))
+        return await asyncio.shield(pending[1])
+
+    async def publish(self, room_id: str) -> Tuple[Optional[RoomSnapshot], Optional[RoomSnapshot]]:
+        """Reloads a room for a broadcast and returns its snapshot with the previously broadcast one"""
+        snapshot = await self.get(room_id, fresh=True)
+        previous = self._published.get(room_id)
+        if snapshot is not None and room_id in self._refs:
+            self._published[room_id] = snapshot
+        return snapshot, previous
+
+    def invalidate(self, room_id: str) -> None:
+        """Drops a room's snapshot; safe to call from the sync side of a consumer"""
+        self._entries.pop(room_id, None)
+        if room_id in self._refs or room_id in self._loading:
+            # Loads started before this point must read the room again
+            self._generations[room_id] = self._generations.get(room_id, 0) + 1
+
+    async def _load(self, room_id: str) -> Optional[RoomSnapshot]:
+        try:
+            for _ in range(MAX_LOAD_ATTEMPTS):
+                generation = self._generations.get(room_id, 0)
+                state = await database_sync_to_async(load_room_state)(room_id)
+                if generation == self._generations.get(room_id, 0):
+                    break
+            if state is None:
+                self._entries.pop(room_id, None)
+                return None
+            return self._store(room_id, state)
+        finally:
+            pending = self._loading.get(room_id)
+            if pending is not None and pending[1] is asyncio.current_task():
+                del self._loading[room_id]
+
+    def _store(self, room_id: str, state: Dict[str, Any]) -> RoomSnapshot:
+        latest = self._latest.get(room_id)
+        if latest is not None and latest.room == state:
+            latest.loaded_at = time.monotonic()
+            snapshot = latest
+        else:
+            version = latest.version + 1 if latest is not None else int(time.time() * 1000)
+            snapshot = RoomSnapshot(state, version)
+        if room_id in self._refs:
+            self._latest[room_id] = snapshot
+            self._entries[room_id] = snapshot
+            self._members[room_id].update(state)
+        return snapshot
+
+room_cache = RoomStateCache(ROOM_CACHE_TTL)
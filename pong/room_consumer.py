@@ -1,16 +1,23 @@
-import json, traceback, logging
+import asyncio, json, traceback, logging
 from django.core.exceptions import ObjectDoesNotExist
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from asgiref.sync import async_to_sync
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from transcendence.rate_limit import RateLimiter
 from .models import PongRoom, PongGame, Tournament
+from .room_cache import room_cache
+from . import bracket
+from django.db import transaction
 from django.utils import timezone
 from chat.models import ChatMessage
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
 
+RATE_LIMITS = getattr(settings, 'PONG_ROOM_RATE_LIMITS', {})
+
 class PongRoomConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         try:
@@ -18,6 +25,7 @@ class PongRoomConsumer(AsyncWebsocketConsumer):
             self.room_id = self.scope['url_route']['kwargs']['room_id']
             self.room_group_name = f'pong_room_{self.room_id}'
             self._kicked = False
+            self.limiter = RateLimiter('room', RATE_LIMITS)
 
             logger.info(f'Room WebSocket connection attempt - room_id: {self.room_id}, authenticated: {getattr(self.user, "is_authenticated", False)}, scope_details: {{"type": self.scope.get("type"), "path": self.scope.get("path"), "headers": dict(self.scope.get("headers", []))}}', extra={
                 'user_id': getattr(self.user, 'id', None)
@@ -42,6 +50,10 @@ class PongRoomConsumer(AsyncWebsocketConsumer):
 
             # First accept the connection
             await self.accept()
+            self.members = room_cache.attach(self.room_id)
+            self._attached = True
+            # Loads the room's membership, shared with the other consumers of the room
+            await room_cache.get(self.room_id)
 
             # Add user to room group
             await self.channel_layer.group_add(
@@ -103,6 +115,9 @@ class PongRoomConsumer(AsyncWebsocketConsumer):
         try:
             if hasattr(self, 'room'):
                 await self.remove_user_from_room()
+            if getattr(self, '_attached', False):
+                self._attached = False
+                room_cache.detach(self.room_id)
             if hasattr(self, 'room_group_name') and hasattr(self, 'channel_name'):
                 await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
 
@@ -122,11 +137,18 @@ class PongRoomConsumer(AsyncWebsocketConsumer):
                 logger.info(f"Ignoring message from kicked player - room_id: {self.room_id}, user_id: {getattr(self.user, 'id', None)}")
                 return
             
+            if not self.limiter.allow():
+                await self.reject_message(None)
+                return
+
             responses = []
             response = None
             data = json.loads(text_data)
             message_id = data.get('id')
             action = data.get('action')
+            if not self.limiter.allow(action):
+                await self.reject_message(message_id)
+                return
             logger.info(f"Message received - room_id: {self.room_id}, action: {action}, message_id: {message_id}, data: {data}", extra={
                 'user_id': self.user.id
             })
@@ -141,30 +163,19 @@ class PongRoomConsumer(AsyncWebsocketConsumer):
                 logger.info(f"Updating property: {property} with value: {value}")
                 
                 if property == 'settings' or property in ['maxScore', 'ballSpeed', 'paddleSpeed', 'aiDifficulty', 'paddleSize']:
-                    if not await self.is_room_owner():
+                    if not self.is_room_owner():
                         response = {'id': message_id, 'status': 'error', 'error': {'code': 4002, 'message': 'Only room owner can change settings'}}
                     else:
                         setting = data.get('setting') or property
                         setting_value = value
                         success = await self.update_room_settings(setting, setting_value)
                         if success:
-                            room_state = await self.get_room_state()
-                            await self.channel_layer.group_send(
-                                self.room_group_name,
-                                {
-                                    'type': 'settings_update',
-                                    'data': {
-                                        'setting': setting,
-                                        'value': setting_value,
-                                        'room_state': room_state
-                                    }
-                                }
-                            )
+                            await self.update_room()
                             response = {'id': message_id, 'status': 'success', 'message': 'Settings updated', 'data': {'setting': setting, 'value': setting_value}}
                         else:
                             response = {'id': message_id, 'status': 'error', 'error': {'code': 4011, 'message': 'Failed to update settings'}}
                 elif property == 'mode':
-                    if not await self.is_room_owner():
+                    if not self.is_room_owner():
                         response = {'id': message_id, 'status': 'error', 'error': {'code': 4002, 'message': 'Only room owner can change mode'}}
                     else:
                         if value not in dict(PongRoom.Mode.choices):
@@ -172,8 +183,8 @@ class PongRoomConsumer(AsyncWebsocketConsumer):
                         else:
                             success = await self.update_room_property('mode', value)
                             if success:
-                                room_state = await self.get_room_state()
-                                await self.channel_layer.group_send(self.room_group_name, {'type': 'mode_change', 'data': {'mode': value, 'room_state': room_state}})
+                                await self.channel_layer.group_send(self.room_group_name, {'type': 'mode_change', 'text': json.dumps({'type': 'mode_change', 'data': {'mode': value}})})
+                                await self.update_room()
                                 response = {'id': message_id, 'status': 'success', 'message': 'Mode updated'}
                             else:
                                 response = {'id': message_id, 'status': 'error', 'error': {'code': 4010, 'message': 'Failed to update mode'}}
@@ -224,7 +235,7 @@ class PongRoomConsumer(AsyncWebsocketConsumer):
                     response = {'id': message_id, 'status': 'error', 'message': 'Failed to kick player'}
             elif action == 'change_mode':
                 mode = data.get('mode')
-                if not await self.is_room_owner():
+                if not self.is_room_owner():
                     response = {'id': message_id, 'status': 'error', 'error': {'code': 4002, 'message': 'Only room owner can change mode'}}
                 else:
                     if mode not in dict(PongRoom.Mode.choices):
@@ -232,14 +243,16 @@ class PongRoomConsumer(AsyncWebsocketConsumer):
                     else:
                         success = await self.update_room_property('mode', mode)
                         if success:
-                            room_state = await self.get_room_state()
-                            await self.channel_layer.group_send(self.room_group_name, {'type': 'mode_change', 'data': {'mode': mode, 'room_state': room_state}})
+                            await self.channel_layer.group_send(self.room_group_name, {'type': 'mode_change', 'text': json.dumps({'type': 'mode_change', 'data': {'mode': mode}})})
+                            await self.update_room()
                             response = {'id': message_id, 'status': 'success', 'message': 'Mode updated'}
                         else:
                             response = {'id': message_id, 'status': 'error', 'error': {'code': 4010, 'message': 'Failed to update mode'}}
             elif action == 'start_game':
-                if not await self.is_room_owner():
+                if not self.is_room_owner():
                     response = {'id': message_id, 'status': 'error', 'error': {'code': 4002, 'message': 'Only room owner can start game'}}
+                elif self.room.mode == 'TOURNAMENT' and len(self.members.players) < 2:
+                    response = {'id': message_id, 'status': 'error', 'message': 'A tournament needs at least 2 players'}
                 else:
                     games = await self.create_game()
                     if not games:
@@ -277,6 +290,12 @@ class PongRoomConsumer(AsyncWebsocketConsumer):
                 'user_id': self.user.id
             })
 
+    async def reject_message(self, message_id):
+        if self.limiter.notify():
+            await self.send(text_data=json.dumps({
+                'id': message_id, 'status': 'error', 'error': {'code': 4029, 'message': 'Too many messages, slow down'}
+            }))
+
     @database_sync_to_async
     def get_room(self):
         try:
@@ -293,18 +312,22 @@ class PongRoomConsumer(AsyncWebsocketConsumer):
                 })
                 return False, "Room not found", 4004
 
+            is_owner = self.is_room_owner()
+
             # If user is the owner, always allow them in
-            if self.user == self.room.owner:
-                if self.user not in self.room.players.all():
+            if is_owner:
+                if self.user.id not in self.members.players:
                     self.room.players.add(self.user)
+                    self.members.add_player(self.user.id)
+                    room_cache.invalidate(self.room_id)
                 return True, "Owner added to room", None
 
             # For non-owners, check if they can join
-            if self.user not in self.room.players.all():
-                current_players = self.room.players.count()
+            if self.user.id not in self.members.players:
+                current_players = len(self.members.players)
                 max_players = self.room.max_players
 
-                logger.info(f"Room join attempt - room_id: {self.room_id}, current_players: {current_players}, max_players: {max_players}, mode: {self.room.mode}, is_owner: {self.user == self.room.owner}", extra={
+                logger.info(f"Room join attempt - room_id: {self.room_id}, current_players: {current_players}, max_players: {max_players}, mode: {self.room.mode}, is_owner: {is_owner}", extra={
                     'user_id': self.user.id
                 })
 
@@ -316,14 +339,14 @@ class PongRoomConsumer(AsyncWebsocketConsumer):
                     return False, "Room is full", 4003
 
                 # For AI mode, only allow the owner
-                if self.room.mode == 'AI' and self.user != self.room.owner:
+                if self.room.mode == 'AI' and not is_owner:
                     logger.error(f"Cannot add user to AI room: Not the owner - room_id: {self.room_id}", extra={
                         'user_id': self.user.id
                     })
                     return False, "Cannot join AI mode room", 4005
 
                 # For LOCAL mode, only allow the owner
-                if self.room.mode == 'LOCAL' and self.user != self.room.owner:
+                if self.room.mode == 'LOCAL' and not is_owner:
                     logger.error(f"Cannot add user to LOCAL room: Not the owner - room_id: {self.room_id}", extra={
                         'user_id': self.user.id
                     })
@@ -335,9 +358,12 @@ class PongRoomConsumer(AsyncWebsocketConsumer):
                     })
                     return False, "Cannot join room: Game in progress", 4006
 
-                if self.user in self.room.pending_invitations.all():
+                # Invitations may come from another worker, so a miss is confirmed in the database
+                if self.user.id in self.members.invited or self.room.pending_invitations.filter(id=self.user.id).exists():
                     self.room.pending_invitations.remove(self.user)
                     self.room.players.add(self.user)
+                    self.members.add_player(self.user.id)
+                    room_cache.invalidate(self.room_id)
                     logger.info(f"Invited user added to room - room_id: {self.room_id}", extra={
                         'user_id': self.user.id
                     })
@@ -363,28 +389,46 @@ class PongRoomConsumer(AsyncWebsocketConsumer):
     def remove_user_from_room(self):
         if self.room:
             self.room.players.remove(self.user)
+            PongRoom.objects.filter(pk=self.room.pk).update(last_active_at=timezone.now())
+            if hasattr(self, 'members'):
+                self.members.remove_player(self.user.id)
+            room_cache.invalidate(self.room_id)
 
-    @database_sync_to_async
-    def get_room_state(self):
+    async def get_room_state(self, fresh=False):
         if self.room is None:
             return None
-        room_data = self.room.serialize()
-        return room_data
+        snapshot = await room_cache.get(self.room_id, fresh=fresh)
+        return snapshot.state if snapshot else None
 
     async def update_room(self, event=None):
-        """Broadcast room state update to all clients in the room"""
-        room_state = await self.get_room_state()
-        if room_state is None:
+        """
+        Broadcast room state changes to all clients in the room
+
+        Also handles `update_room` group events, sent after writes made outside
+        the room's consumers: every consumer of the room reloads it, and only
+        the first one to find the change broadcasts it.
+        """
+        if event is not None:
+            # The write may have landed after a load still in flight here
+            room_cache.invalidate(self.room_id)
+
+        snapshot, previous = await room_cache.publish(self.room_id)
+        if snapshot is None:
             logger.error(f"Attempt to update non-existent room: user={self.user}, room_id={self.room_id}")
             await self.close()
             return
-        
-        logger.info(f"Room state update: room_id={self.room_id}, state={room_state}")
+        if previous is not None and previous.version == snapshot.version:
+            logger.debug(f"Room unchanged, no update sent: room_id={self.room_id}, version={snapshot.version}")
+            return
+
+        # Members already hold the previous version: send them a patch, not the whole room
+        text = snapshot.patch_frame(previous) if previous is not None else snapshot.text
+        logger.info(f"Room state update: room_id={self.room_id}, version={snapshot.version}, update={text}")
         await self.channel_layer.group_send(
             self.room_group_name,
             {
                 'type': 'send_room_update',
-                'room_state': room_state
+                'text': text
             }
         )
         logger.info(f"Room update sent to group: room_id={self.room_id}")
@@ -395,135 +439,43 @@ class PongRoomConsumer(AsyncWebsocketConsumer):
             logger.info(f"Not sending room update to kicked player - room_id: {self.room_id}, user_id: {getattr(self.user, 'id', None)}")
             return
         
-        room_state = event['room_state']
-        await self.send(text_data=json.dumps({
-            'type': 'room_update',
-            'room_state': room_state
-        }))
+        await self.send(text_data=event['text'])
+
+    async def send_chat_notifications(self, notifications):
+        """Sends each recipient their chat notifications in one event, to all recipients concurrently"""
+        timestamp = int(timezone.now().timestamp() * 1000)
+        messages = {}
+        for notification in notifications:
+            messages.setdefault(notification.recipient_id, []).append({
+                'id': notification.id or 0,
+                'content': notification.content,
+                'timestamp': timestamp,
+                'type': 'system'
+            })
 
-    @database_sync_to_async
-    def create_chat_message(self, sender, recipient, content):
-        """Creates a chat message in the database"""
-        return ChatMessage.objects.create(
-            sender=sender,
-            recipient=recipient,
-            content=content
-        )
-    
-    async def send_chat_notification(self, user_id, message):
-        """Sends a chat notification to a user"""
-        message_obj = {
-            'id': 0,  # Updated by the db
-            'content': message,
-            'timestamp': int(timezone.now().timestamp() * 1000),
-            'type': 'system'
-        }
-        
-        await self.channel_layer.group_send(
-            f"chat_{user_id}",
-            {
-                'type': 'chat_message',
-                'message': message_obj,
-                'sender_id': self.user.id
-            }
-        )
+        await asyncio.gather(*(
+            self.channel_layer.group_send(
+                f"chat_{user_id}",
+                {
+                    'type': 'chat_messages',
+                    'messages': user_messages,
+                    'sender_id': self.user.id
+                }
+            ) for user_id, user_messages in messages.items()
+        ))
 
     async def create_game(self):
-        """Creates a new game for the room"""
+        """Starts a round: creates the room's games in one transaction, then announces them"""
         try:
-            tournament = await self.get_tournament()
-            
-            if self.room.mode == 'TOURNAMENT' and not tournament:
-                logger.error("Failed to create tournament")
-                await self.update_room_state('LOBBY')
-                return []
-            
-            await self.update_room_state('PLAYING')
-            
-            # Create tournament if mode is TOURNAMENT
-            if self.room.mode == 'TOURNAMENT':
-                tournament = await self.get_tournament()
-                if not tournament:
-                    logger.error("Failed to create tournament")
-                    await self.update_room_state('LOBBY')
-                    return []
-
-            games = await self.create_game_with_settings() or []
-            
+            games, tournament, notifications = await self.start_round()
             if not games:
                 logger.error("Failed to create game with settings")
-                await self.update_room_state('LOBBY')
                 return []
 
-            # Link games to tournament if exists
-            if tournament:
-                await self.add_games_to_tournament(tournament, games)
-
-            settings = self.room.settings or {}
-
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'room_info',
-                    'message': 'Round Started',
-                    'message_type': 'info',
-                    'timestamp': timezone.now().isoformat()
-                }
-            )
-            for game in games:
-                player1_message = f'Match starting against {game.player2.nick_name if game.player2 else "AI"}' if self.room.mode == "TOURNAMENT" else f'Match starting against {"Guest" if game.player2_is_guest else (game.player2.username if game.player2 else "AI")}'
-                player2_message = f'Match starting against {game.player1.nick_name}' if game.room.mode == "TOURNAMENT" else f'Match starting against {game.player1.username}'
-                if self.room.mode == "TOURNAMENT":
-                    await self.send_chat_notification(game.player1.id, '[Tournament] ' + player1_message)
-                    await self.create_chat_message(self.user, game.player1, '[Tournament] ' + player1_message)
-
-                    if game.player2 and not game.player2_is_guest:
-                        await self.send_chat_notification(game.player2.id, '[Tournament] ' + player2_message)
-                        await self.create_chat_message(self.user, game.player2, '[Tournament] ' + player2_message)
-
-                await self.channel_layer.group_send(
-                    f"user_{game.player1.id}",
-                    {
-                        'type': 'room_info',
-                        'message': player1_message,
-                        'message_type': 'info',
-                        'timestamp': timezone.now().isoformat()
-                    }
-                )
-
-                if game.player2 and not game.player2_is_ai and not game.player2_is_guest:
-                    await self.channel_layer.group_send(
-                        f"user_{game.player2.id}",
-                        {
-                            'type': 'room_info',
-                            'message': player2_message,
-                            'message_type': 'info',
-                            'timestamp': timezone.now().isoformat()
-                        }
-                    )
-
-                event_data = {
-                    'type': 'game_started',
-                    'data': {
-                        'game_id': game.id,
-                        'player1_id': game.player1.id,
-                        'is_ai_game': game.player2_is_ai,
-                        'is_local_game': game.player2_is_guest,
-                        'settings': settings,
-                        'tournament_id': tournament.id if tournament else None
-                    }
-                }
-
-                if game.player2:
-                    event_data['data']['player2_id'] = game.player2.id
-
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    event_data
-                )
-            
-                logger.info(f"Game created and broadcast: {game.id} for room {self.room.id}")
+            await self.channel_layer.group_send(self.room_group_name, self.round_started_event(games, tournament))
+            await self.send_chat_notifications(notifications)
 
+            logger.info(f"Games created and broadcast: {[game.id for game in games]} for room {self.room.id}")
             return games
 
         except Exception as e:
@@ -531,6 +483,57 @@ class PongRoomConsumer(AsyncWebsocketConsumer):
             await self.update_room_state('LOBBY')
             return []
 
+    def match_messages(self, game):
+        """Announcements for both players of a game"""
+        if self.room.mode == "TOURNAMENT":
+            player1_message = f'Match starting against {game.player2.nick_name if game.player2 else "AI"}'
+            player2_message = f'Match starting against {game.player1.nick_name}'
+        else:
+            player1_message = f'Match starting against {"Guest" if game.player2_is_guest else (game.player2.username if game.player2 else "AI")}'
+            player2_message = f'Match starting against {game.player1.username}'
+        return player1_message, player2_message
+
+    def round_started_event(self, games, tournament):
+        """Single room event announcing a round, with every frame serialized once"""
+        timestamp = timezone.now().isoformat()
+        settings = self.room.settings or {}
+
+        def info(message):
+            return json.dumps({'type': 'room_info', 'message': message, 'message_type': 'info', 'timestamp': timestamp})
+
+        frames = [info('Round Started')]
+        messages = {}
+        for game in games:
+            player1_message, player2_message = self.match_messages(game)
+            messages[str(game.player1.id)] = info(player1_message)
+            if game.player2 and not game.player2_is_ai and not game.player2_is_guest:
+                messages[str(game.player2.id)] = info(player2_message)
+
+            game_data = {
+                'type': 'game_started',
+                'game_id': game.id,
+                'player1_id': game.player1.id,
+                'is_ai_game': game.player2_is_ai,
+                'is_local_game': game.player2_is_guest,
+                'settings': settings,
+                'tournament_id': tournament.id if tournament else None
+            }
+            if game.player2:
+                game_data['player2_id'] = game.player2.id
+            frames.append(json.dumps(game_data))
+
+        return {'type': 'round_started', 'frames': frames, 'messages': messages}
+
+    async def round_started(self, event):
+        """Sends a round's announcement, this player's match info and the started games"""
+        frames = event['frames']
+        message = event['messages'].get(str(self.user.id))
+        await self.send(text_data=frames[0])
+        if message:
+            await self.send(text_data=message)
+        for frame in frames[1:]:
+            await self.send(text_data=frame)
+
     @database_sync_to_async
     def validate_game_creation(self):
         """Validates if a game can be created"""
@@ -565,47 +568,61 @@ class PongRoomConsumer(AsyncWebsocketConsumer):
         """Updates room state in the database"""
         self.room.state = state
         self.room.save()
+        room_cache.invalidate(self.room_id)
 
     @database_sync_to_async
-    def create_game_with_settings(self):
-        """Crée un nouveau jeu avec les paramètres actuels"""
-        try:
-            games = []
-            
-            tournament = getattr(self.room, 'tournament', None)
-            eliminated_players = list(tournament.eliminated.all()) if tournament else []
-            
-            player_pairs = self.pair_players(
-                list(self.room.players.all()), 
-                eliminated_players
-            )
-            
-            if not player_pairs:
-                logger.error("Aucun joueur actif pour créer des matchs")
-                return []
-            
-            if len(player_pairs[0]) == 1 and len(player_pairs) == 1 and self.room.mode == 'TOURNAMENT':
-                self.room.tournament.eliminated.clear()
-                return []
+    def start_round(self):
+        """Creates a round's games, their tournament links and chat notifications in one transaction"""
+        with transaction.atomic():
+            tournament = None
+            if self.room.mode == 'TOURNAMENT':
+                tournament, _ = Tournament.objects.select_for_update().get_or_create(
+                    pong_room=self.room,
+                    defaults={'name': f"Tournament {self.room.room_id}"}
+                )
+                self.room.tournament = tournament
+                if tournament.round_count == 0 or tournament.status == Tournament.Status.FINISHED:
+                    bracket.create_bracket(tournament, list(self.room.players.all()))
+                games = bracket.schedule_round(tournament, self.room)
+                if not games:
+                    logger.error(f"No tournament match ready - room_id: {self.room_id}, round: {tournament.current_round}")
+                    return [], tournament, []
+                logger.info(f"Tournament round {tournament.current_round}/{tournament.round_count} started : {[[g.player1_id, g.player2_id] for g in games]}")
+            else:
+                player_pairs = self.pair_players(list(self.room.players.all()), [])
+                if not player_pairs:
+                    logger.error("Aucun joueur actif pour créer des matchs")
+                    return [], tournament, []
 
-            logger.info(f"Generated Pairs : {[[p.id for p in pair if p] for pair in player_pairs]}")
-            
-            for pair in player_pairs:
-                if len(pair) >= 1:
-                    games.append(PongGame.objects.create(
+                logger.info(f"Generated Pairs : {[[p.id for p in pair if p] for pair in player_pairs]}")
+
+                games = PongGame.objects.bulk_create([
+                    PongGame(
                         room=self.room,
                         player1=pair[0],
                         player2=pair[1] if len(pair) > 1 else None,
                         player2_is_ai=self.room.mode == 'AI',
                         player2_is_guest=self.room.mode == 'LOCAL',
                         status='ongoing'
-                    ))
-                    logger.info(f"Jeu créé : {games[-1].id}")
-            
-            return games
-        except Exception as e:
-            logger.error(f"Erreur création jeu : {str(e)}")
-            return []
+                    ) for pair in player_pairs
+                ])
+            PongRoom.objects.filter(pk=self.room.pk).update(state='PLAYING', last_active_at=timezone.now())
+            self.room.state = 'PLAYING'
+
+            notifications = []
+            if tournament:
+                Through = Tournament.pong_games.through
+                Through.objects.bulk_create([Through(tournament_id=tournament.id, ponggame_id=game.id) for game in games])
+
+                for game in games:
+                    player1_message, player2_message = self.match_messages(game)
+                    notifications.append(ChatMessage(sender=self.user, recipient=game.player1, content='[Tournament] ' + player1_message))
+                    if game.player2 and not game.player2_is_guest:
+                        notifications.append(ChatMessage(sender=self.user, recipient=game.player2, content='[Tournament] ' + player2_message))
+                ChatMessage.objects.bulk_create(notifications)
+
+        room_cache.invalidate(self.room_id)
+        return games, tournament, notifications
 
     async def game_started(self, event):
         """Handle game started event and send to client"""
@@ -646,6 +663,7 @@ class PongRoomConsumer(AsyncWebsocketConsumer):
                 elif property == 'owner':
                     user = User.objects.get(id=value['id'])
                     self.room.owner = user
+                    self.members.owner_id = user.id
                 elif property == 'players':
                     player_ids = [player['id'] for player in value]
                     self.room.players.set(User.objects.filter(id__in=player_ids))
@@ -657,44 +675,7 @@ class PongRoomConsumer(AsyncWebsocketConsumer):
                     old_mode = self.room.mode
                     self.room.mode = value
                     self.room.save()  # Save immediately to update max_players
-                    
-                    # Get default settings for the new mode
-                    settings = {
-                        'ballSpeed': 4,
-                        'paddleSpeed': 4,
-                        'maxScore': 11,
-                    } if value == 'AI' else {
-                        'ballSpeed': 5,
-                        'paddleSpeed': 5,
-                        'maxScore': 11,
-                    }
-                    
-                    # Get updated room state
-                    room_state = {
-                        'id': self.room.room_id,
-                        'mode': value,
-                        'maxPlayers': self.room.max_players,  # Include updated max_players
-                        'availableSlots': self.room.max_players - self.room.players.count()
-                    }
-                    
-                    # Broadcast mode change with settings and room state
-                    async_to_sync(self.channel_layer.group_send)(
-                        self.room_group_name,
-                        {
-                            'type': 'mode_change',
-                            'mode': value,
-                            'settings': settings,
-                            'room_state': room_state
-                        }
-                    )
-                    
-                    # Also trigger a full room update
-                    async_to_sync(self.channel_layer.group_send)(
-                        self.room_group_name,
-                        {
-                            'type': 'update_room',
-                        }
-                    )
+                    room_cache.invalidate(self.room_id)
                     
                     logger.info(f"Mode changed from {old_mode} to {value}, new max_players: {self.room.max_players}")
                     return True
@@ -703,18 +684,11 @@ class PongRoomConsumer(AsyncWebsocketConsumer):
                     return False
                 
                 self.room.save()
+                room_cache.invalidate(self.room_id)
                 
                 new_value = getattr(self.room, property, None)
                 logger.info(f"Property '{property}' updated: {old_value} -> {new_value}")
                 
-                # Trigger room update
-                async_to_sync(self.channel_layer.group_send)(
-                    self.room_group_name,
-                    {
-                        'type': 'update_room',
-                    }
-                )
-                
                 return True
             except ObjectDoesNotExist:
                 logger.error(f"Object not found while updating property {property}")
@@ -727,6 +701,9 @@ class PongRoomConsumer(AsyncWebsocketConsumer):
     async def settings_update(self, event):
         """Handle settings update event and broadcast to room"""
         logger.info(f"Broadcasting settings update: {event}")
+        if 'text' in event:
+            await self.send(text_data=event['text'])
+            return
         await self.send(text_data=json.dumps({
             'type': 'settings_update',
             'data': event.get('data', {})
@@ -735,6 +712,9 @@ class PongRoomConsumer(AsyncWebsocketConsumer):
     async def mode_change(self, event):
         """Handle mode change event and broadcast to room"""
         logger.info(f"Broadcasting mode change: {event}")
+        if 'text' in event:
+            await self.send(text_data=event['text'])
+            return
         
         # Create a consistent data structure regardless of input format
         mode_data = {
@@ -757,50 +737,23 @@ class PongRoomConsumer(AsyncWebsocketConsumer):
         """
         Handle settings update event
         """
-        room_state = await self.get_room_state()
-        await self.send(text_data=json.dumps({
-            'type': 'settings_change',
-            'room_state': room_state
-        }))
+        snapshot = await room_cache.get(self.room_id)
+        if snapshot is not None:
+            await self.send(text_data=snapshot.frame('settings_change'))
 
     @database_sync_to_async
-    def all_game_finished(self):
-        if self.room.mode != "TOURNAMENT":
-            return True
-        
-        tournament = self.room.tournament
-        return all(
-            game.status == PongGame.Status.FINISHED 
-            for game in tournament.pong_games.all()
-        )
-
-    @database_sync_to_async
-    def clean_tournament(self):
-        tournament = self.room.tournament
-        for game in tournament.pong_games.filter(status='finished'):
-            tournament.pong_games.remove(game)
-            logger.info(f"Jeu {game.id} retiré du tournoi {tournament.id}")
-        tournament.save()
-
-    @database_sync_to_async
-    def tournament_finished(self):
-        logger.info(f"{self.room.players.all()}, {self.room.tournament.eliminated.all()}")
-        if len(self.room.players.all()) == len(self.room.tournament.eliminated.all()) + 1:
-            winner = next(player for player in self.room.players.all() if player not in self.room.tournament.eliminated.all())
-            self.room.tournament.eliminated.clear()
-            logger.info(f"{winner.nick_name} win the tournament")
-            return winner
-
-        return None
+    def tournament_progress(self):
+        """Open matches of the current round and winner of the room's tournament, read from its counters"""
+        return Tournament.objects.filter(pong_room_id=self.room.id).values(
+            'pending_matches', 'status', 'winner__nick_name'
+        ).first()
 
     async def game_finished(self, event):
         """
         Handle game finished event and update room state
         """
         try:
-            if self.room.mode == "TOURNAMENT":
-                await self.add_eliminated_player(event['loser']) 
-            if not await self.is_room_owner():
+            if not self.is_room_owner():
                 await self.send(text_data=json.dumps({
                     'type': 'game_finished',
                     'winner_id': event['winner_id'],
@@ -809,18 +762,21 @@ class PongRoomConsumer(AsyncWebsocketConsumer):
                 return                
            
 
-            if self.room.state != 'LOBBY' and await self.all_game_finished():
+            # Results were recorded in the bracket by the game before this event was sent
+            progress = await self.tournament_progress() if self.room.mode == "TOURNAMENT" else None
+            if self.room.state != 'LOBBY' and (progress is None or progress['pending_matches'] == 0):
 
                 await self.update_room_property('state', 'LOBBY')
                 
                 if self.room.mode == "TOURNAMENT":
-                    winner = await self.tournament_finished()
+                    winner = progress['winner__nick_name'] if progress and progress['status'] == Tournament.Status.FINISHED else None
                     if winner:
+                        logger.info(f"{winner} win the tournament")
                         await self.channel_layer.group_send(
                         self.room_group_name,
                         {
                             'type': 'room_info',
-                            'message': f'{winner.nick_name} win the tournament',
+                            'message': f'{winner} win the tournament',
                             'message_type': 'info',
                             'timestamp': timezone.now().isoformat()
                         })
@@ -856,15 +812,14 @@ class PongRoomConsumer(AsyncWebsocketConsumer):
                 'user_id': getattr(self.user, 'id', None)
             }) 
 
-    @database_sync_to_async
     def is_room_owner(self):
-        return self.user == self.room.owner
+        return self.members.is_owner(self.user.id)
 
     @database_sync_to_async
     def kick_player(self, player_id):
         """Kick a player from the room"""
         try:
-            if not self.user == self.room.owner:
+            if not self.is_room_owner():
                 logger.error(f"Cannot kick player: Not the owner - room_id: {self.room_id}, player_id: {player_id}", extra={
                     'user_id': self.user.id
                 })
@@ -885,15 +840,15 @@ class PongRoomConsumer(AsyncWebsocketConsumer):
                 return False
                 
             # Room owner can't kick themselves
-            if player.id == self.room.owner.id:
+            if self.members.is_owner(player.id):
                 logger.error(f"Cannot kick player: Cannot kick room owner - room_id: {self.room_id}, player_id: {player_id}", extra={
                     'user_id': self.user.id
                 })
                 return False
                 
             # Remove player from room
-            if player in self.room.players.all():
-                self.channel_layer.group_send(
+            if player.id in self.members.players:
+                async_to_sync(self.channel_layer.group_send)(
                     self.room_group_name,
                     {
                         'type': 'handle_player_kicked',
@@ -902,6 +857,8 @@ class PongRoomConsumer(AsyncWebsocketConsumer):
                 )
                                 
                 self.room.players.remove(player)
+                self.members.remove_player(player.id)
+                room_cache.invalidate(self.room_id)
                 
                 logger.info(f"Player kicked from room - room_id: {self.room_id}, player_id: {player_id}", extra={
                     'user_id': self.user.id
@@ -923,7 +880,7 @@ class PongRoomConsumer(AsyncWebsocketConsumer):
     def cancel_invitation(self, invitation_id):
         """Cancel a pending invitation to the room"""
         try:
-            if not self.user == self.room.owner:
+            if not self.is_room_owner():
                 logger.error(f"Cannot cancel invitation: Not the owner - room_id: {self.room_id}, invitation_id: {invitation_id}", extra={
                     'user_id': self.user.id
                 })
@@ -944,8 +901,10 @@ class PongRoomConsumer(AsyncWebsocketConsumer):
                 return False
                 
             # Remove from pending invitations
-            if invited_user in self.room.pending_invitations.all():
+            if self.room.pending_invitations.filter(id=invited_user.id).exists():
                 self.room.pending_invitations.remove(invited_user)
+                self.members.remove_invitation(invited_user.id)
+                room_cache.invalidate(self.room_id)
                 
                 logger.info(f"Invitation canceled - room_id: {self.room_id}, invitation_id: {invitation_id}", extra={
                     'user_id': self.user.id
@@ -980,6 +939,7 @@ class PongRoomConsumer(AsyncWebsocketConsumer):
             current_settings[setting] = value
             self.room.settings = current_settings
             self.room.save()
+            room_cache.invalidate(self.room_id)
             
             #  logger.info(f"Settings updated - room: {self.room_id}, setting: {setting}, value: {value}")
             return True
@@ -1008,34 +968,6 @@ class PongRoomConsumer(AsyncWebsocketConsumer):
         logger.info(f"Player pairs generated: {[[p.id for p in pair] for pair in pairs]}")
         return pairs
 
-    @database_sync_to_async
-    def get_tournament(self):
-        """Create or get existing tournament linked to the room"""
-        try:
-            if hasattr(self.room, 'tournament') and self.room.tournament:
-                return self.room.tournament
-            
-            tournament = Tournament.objects.create(
-                name=f"Tournament {self.room.room_id}",
-                pong_room=self.room,
-                status='ONGOING'
-            )
-            self.room.tournament = tournament
-            self.room.save()
-            return tournament
-        except Exception as e:
-            logger.error(f"Error creating tournament: {str(e)}")
-            return None
-
-    @database_sync_to_async
-    def add_games_to_tournament(self, tournament, games):
-        """Add games to tournament's pong_games"""
-        try:
-            tournament.pong_games.add(*games)
-            tournament.save()
-        except Exception as e:
-            logger.error(f"Error adding games to tournament: {str(e)}")
-
     async def room_info(self, event):
         """Envoie les messages d'information de la salle à tous les clients"""
         await self.send(text_data=json.dumps({
@@ -1045,11 +977,6 @@ class PongRoomConsumer(AsyncWebsocketConsumer):
             'timestamp': event.get('timestamp')
         }))
 
-    @database_sync_to_async
-    def add_eliminated_player(self, player):
-        """Ajoute un joueur éliminé au tournoi de manière thread-safe"""
-        self.room.tournament.eliminated.add(player)
-
     async def handle_player_kicked(self, event):
         """Handle player kicked event - only the kicked player will close their connection"""
         player_id = event.get('player_id')
@@ -1059,6 +986,8 @@ class PongRoomConsumer(AsyncWebsocketConsumer):
                 logger.info(f"Processing kick for player - room_id: {self.room_id}, player_id: {player_id}")
                 self._kicked = True
                 await database_sync_to_async(self.room.players.remove)(self.user)
+                self.members.remove_player(self.user.id)
+                room_cache.invalidate(self.room_id)
                 
                 await self.send(text_data=json.dumps({
                     'type': 'error',
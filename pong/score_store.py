@@ -0,0 +1,124 @@
+import asyncio, logging, traceback
+from typing import Any, Dict, Optional
+from django.conf import settings
+from django.utils import timezone
+from channels.db import database_sync_to_async
+from .models import PongGame, PongRoom
+
+logger = logging.getLogger(__name__)
+
+class ScoreStore:
+    """
+    Write-behind store for live game scores.
+
+    Scores reported during a game are kept in memory and flushed to the
+    database every `PONG_SCORE_FLUSH_INTERVAL` seconds, so a crash loses at
+    most one interval of score updates. Final results are written
+    immediately. Every write is an `update()` limited to the changed fields,
+    and live score writes also touch `updated_at`, which tells maintenance
+    the game is still being played.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._pending: Dict[int, Dict[str, Any]] = {}
+        self._persisted: Dict[int, Dict[str, Any]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def track(self, game: PongGame) -> None:
+        """Registers the values currently stored in the database for a game"""
+        self._persisted.setdefault(game.id, {
+            'player1_score': game.player1_score,
+            'player2_score': game.player2_score,
+        })
+
+    def record_scores(self, game_id: int, player1_score: int, player2_score: int) -> None:
+        """Buffers a score update, keeping only the fields that changed"""
+        persisted = self._persisted.setdefault(game_id, {})
+        pending = self._pending.setdefault(game_id, {})
+        for field, value in (('player1_score', player1_score), ('player2_score', player2_score)):
+            if persisted.get(field) != value:
+                pending[field] = value
+            else:
+                pending.pop(field, None)
+        if not pending:
+            del self._pending[game_id]
+            return
+        self._ensure_flusher()
+
+    async def flush(self, game_id: Optional[int] = None) -> None:
+        """Writes pending updates for one game, or for all games if no id is given"""
+        if game_id is None:
+            batch, self._pending = self._pending, {}
+        elif game_id in self._pending:
+            batch = {game_id: self._pending.pop(game_id)}
+        else:
+            return
+        if not batch:
+            return
+        try:
+            await self._write(batch)
+            for gid, fields in batch.items():
+                self._persisted.setdefault(gid, {}).update(fields)
+        except Exception as e:
+            # Put the batch back unless newer values arrived meanwhile
+            for gid, fields in batch.items():
+                self._pending[gid] = {**fields, **self._pending.get(gid, {})}
+            logger.error(f"Error flushing game scores - games: {list(batch)}, error: {str(e)}, traceback: {traceback.format_exc()}")
+
+    async def finish(self, game_id: int, player1_score: int, player2_score: int, room_id: Optional[int] = None) -> None:
+        """Persists the final result of a game and puts its room back in the lobby"""
+        self._pending.pop(game_id, None)
+        await self._finalize(game_id, {
+            'player1_score': player1_score,
+            'player2_score': player2_score,
+            'status': PongGame.Status.FINISHED,
+            'finished_at': timezone.now(),
+        }, room_id)
+        self.forget(game_id)
+
+    async def forfeit(self, game_id: int, forfeit_field: str, room_id: Optional[int] = None) -> bool:
+        """
+        Ends an ongoing game with a forfeit score for the given player.
+
+        Returns False if the game was already finished.
+        """
+        await self.flush(game_id)
+        updated = await self._finalize(game_id, {
+            forfeit_field: -1,
+            'status': PongGame.Status.FINISHED,
+            'finished_at': timezone.now(),
+        }, room_id, only_ongoing=True)
+        self.forget(game_id)
+        return updated
+
+    def forget(self, game_id: int) -> None:
+        self._pending.pop(game_id, None)
+        self._persisted.pop(game_id, None)
+
+    def _ensure_flusher(self) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self) -> None:
+        while self._pending:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    @database_sync_to_async
+    def _write(self, batch: Dict[int, Dict[str, Any]]) -> None:
+        for game_id, fields in batch.items():
+            PongGame.objects.filter(id=game_id, status=PongGame.Status.ONGOING).update(**fields, updated_at=timezone.now())
+
+    @database_sync_to_async
+    def _finalize(self, game_id: int, fields: Dict[str, Any], room_id: Optional[int], only_ongoing: bool = False) -> bool:
+        games = PongGame.objects.filter(id=game_id)
+        if only_ongoing:
+            games = games.filter(status=PongGame.Status.ONGOING)
+        updated = games.update(**fields) > 0
+        if updated and room_id:
+            PongRoom.objects.filter(id=room_id).update(state=PongRoom.State.LOBBY)
+        return updated
+
+score_store = ScoreStore(getattr(settings, 'PONG_SCORE_FLUSH_INTERVAL', 1.0))
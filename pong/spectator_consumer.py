@@ -0,0 +1,58 @@
+import json, traceback, logging
+from channels.generic.websocket import AsyncWebsocketConsumer
+from . import game_actor
+from .game_actor import get_actor
+
+logger = logging.getLogger(__name__)
+
+class PongSpectatorConsumer(AsyncWebsocketConsumer):
+    """
+    WebSocket consumer for watching a Pong game.
+
+    Spectators are registered on the game actor, which pushes snapshots to
+    them at a reduced rate. Messages sent by spectators are ignored.
+    """
+
+    async def connect(self):
+        try:
+            self.user = self.scope.get("user")
+            self.game_id = self.scope['url_route']['kwargs']['game_id']
+
+            if not self.user or self.user.is_anonymous:
+                logger.warning(f"[Game {self.game_id}] Unauthorized spectator connection attempt", extra={
+                    'user_id': None
+                })
+                await self.close(code=4001)
+                return
+
+            self.actor = get_actor(self.game_id)
+            watched = await self.actor.submit(game_actor.watch, self)
+            if 'error' in watched:
+                await self.close(code=watched['error'])
+                return
+
+            await self.accept()
+            await self.send(text_data=json.dumps({
+                'type': 'game_state',
+                'state': self.actor.get_state(),
+                'snapshot': self.actor.latest_snapshot,
+                'is_spectator': True,
+                'spectator_rate': game_actor.SPECTATOR_RATE
+            }))
+
+            logger.info(f"[Game {self.game_id}] Spectator connected - spectators: {len(self.actor.spectators)}", extra={
+                'user_id': self.user.id
+            })
+
+        except Exception as e:
+            logger.error(f"[Game {getattr(self, 'game_id', None)}] Error during spectator connection - error_type: {type(e).__name__}, error_message: {str(e)}, traceback: {traceback.format_exc()}", extra={
+                'user_id': getattr(self.user, 'id', None)
+            })
+            await self.close(code=4002)
+
+    async def disconnect(self, close_code):
+        if hasattr(self, 'actor'):
+            await self.actor.submit(game_actor.unwatch, self)
+
+    async def receive(self, text_data):
+        pass
@@ -0,0 +1,864 @@
+import asyncio, copy, json, tempfile, time
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+from authentication.models import User
+from chat.models import ChatMessage
+from . import bracket, game_actor, game_consumer, lag_compensation, replay, room_consumer
+from .game_actor import NORMAL_CLOSURE, get_actor
+from .lag_compensation import LAG_COMPENSATION_WINDOW, input_issued_at, rewind_guest_input
+from .latency import ClockEstimator
+from .maintenance import expire_idle_rooms, finalize_stale_games, purge_orphaned_invitations
+from .models import Match, PongGame, PongRoom, Tournament
+from .room_cache import RoomMembers, RoomSnapshot, RoomStateCache, diff_state, load_room_state
+from .room_consumer import PongRoomConsumer
+from .routing import websocket_urlpatterns
+from .score_store import ScoreStore
+from transcendence.rate_limit import rate_limit_stats
+from .views import parse_range
+
+class TournamentForfeitTestCase(TransactionTestCase):
+    def setUp(self):
+        self.players = [
+            User.objects.create_user(username=f'player{i}', password='password123', email=f'player{i}@test.com')
+            for i in range(4)
+        ]
+        self.room = PongRoom.objects.create(
+            room_id='forfeit', owner=self.players[0], mode=PongRoom.Mode.TOURNAMENT, state=PongRoom.State.PLAYING
+        )
+        self.room.players.add(*self.players)
+        self.tournament = Tournament.objects.create(name='Forfeit', pong_room=self.room)
+        bracket.create_bracket(self.tournament, self.players)
+        # Seeds i and i + 2 meet in the first round
+        self.games = bracket.schedule_round(self.tournament, self.room)
+
+    async def connect(self, path, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def receive_until(self, communicator, message_type):
+        while True:
+            message = await communicator.receive_json_from(timeout=3)
+            if message.get('type') == message_type:
+                return message
+
+    async def test_forfeit_schedules_next_round(self):
+        owner, second, third, fourth = self.players
+        await database_sync_to_async(bracket.record_result)(self.games[0].id, owner.id)
+
+        room = await self.connect(f'/ws/pong_room/{self.room.room_id}/', owner)
+        host = await self.connect(f'/ws/pong_game/{self.games[1].id}/', second)
+        guest = await self.connect(f'/ws/pong_game/{self.games[1].id}/', fourth)
+
+        # The guest leaves on purpose and forfeits
+        await guest.disconnect(code=NORMAL_CLOSURE)
+        finished = await self.receive_until(room, 'game_finished')
+        self.assertEqual(finished['winner_id'], second.id)
+
+        self.assertEqual(await database_sync_to_async(lambda: PongRoom.objects.get(pk=self.room.pk).state)(), PongRoom.State.LOBBY)
+        tournament = await database_sync_to_async(Tournament.objects.get)(pk=self.tournament.pk)
+        self.assertEqual(tournament.pending_matches, 0)
+
+        await room.send_json_to({'id': 1, 'action': 'start_game'})
+        started = await self.receive_until(room, 'game_started')
+        self.assertEqual((started['player1_id'], started['player2_id']), (owner.id, second.id))
+        final = await database_sync_to_async(Match.objects.get)(tournament=self.tournament, round_number=2)
+        self.assertEqual(final.pong_game_id, started['game_id'])
+
+        await host.disconnect()
+        await room.disconnect()
+
+class BracketTestCase(TestCase):
+    def setUp(self):
+        self.players = [
+            User.objects.create_user(username=f'player{i}', password='password123', email=f'player{i}@test.com')
+            for i in range(3)
+        ]
+        room = PongRoom.objects.create(room_id='bracket', owner=self.players[0], mode=PongRoom.Mode.TOURNAMENT)
+        self.tournament = Tournament.objects.create(name='Bracket', pong_room=room)
+
+    def test_needs_two_players(self):
+        for players in ([], self.players[:1]):
+            with self.assertRaises(ValueError):
+                bracket.create_bracket(self.tournament, players)
+        self.assertFalse(self.tournament.matches.exists())
+
+    def test_bye(self):
+        bracket.create_bracket(self.tournament, self.players)
+
+        self.tournament.refresh_from_db()
+        self.assertEqual((self.tournament.round_count, self.tournament.pending_matches), (2, 1))
+        # Seed 1 has no opponent and waits in the final
+        final = self.tournament.matches.get(round_number=2)
+        self.assertEqual((final.player1_id, final.player2_id), (None, self.players[1].id))
+
+class MaintenanceTestCase(TestCase):
+    def setUp(self):
+        self.players = [
+            User.objects.create_user(username=f'player{i}', password='password123', email=f'player{i}@test.com')
+            for i in range(3)
+        ]
+        # Far enough ahead for every game and room created here to be stale or idle
+        self.later = timezone.now() + timedelta(days=2)
+
+    def tournament_game(self):
+        room = PongRoom.objects.create(room_id='stale', owner=self.players[0], mode=PongRoom.Mode.TOURNAMENT, state=PongRoom.State.PLAYING)
+        tournament = Tournament.objects.create(name='Stale', pong_room=room)
+        bracket.create_bracket(tournament, self.players[:2])
+        game, = bracket.schedule_round(tournament, room)
+        PongGame.objects.filter(pk=game.pk).update(player1_score=1, player2_score=3)
+        return room, tournament, game
+
+    def test_finalize_stale_games(self):
+        room, tournament, game = self.tournament_game()
+        recent = PongGame.objects.create(player1=self.players[2], player2_is_ai=True)
+
+        self.assertEqual(finalize_stale_games(timezone.now()), 0)
+        self.assertEqual(finalize_stale_games(self.later), 2)
+
+        game.refresh_from_db()
+        self.assertEqual(game.status, PongGame.Status.FINISHED)
+        self.assertEqual((game.player1_score, game.player2_score), (1, 3))
+        room.refresh_from_db()
+        self.assertEqual(room.state, PongRoom.State.LOBBY)
+        tournament.refresh_from_db()
+        self.assertEqual(tournament.status, Tournament.Status.FINISHED)
+        self.assertEqual(tournament.winner_id, self.players[1].id)
+        self.assertEqual(Match.objects.get(pong_game=game).winner_id, self.players[1].id)
+        recent.refresh_from_db()
+        self.assertEqual(recent.finished_at, self.later)
+
+    def test_finalize_stale_games_keeps_game_open_on_bracket_error(self):
+        _, tournament, game = self.tournament_game()
+
+        with mock.patch('pong.maintenance.record_result', side_effect=Exception('Bracket error')):
+            with self.assertRaises(Exception):
+                finalize_stale_games(self.later)
+
+        # Rolled back with the result, so the next pass picks the game up again
+        game.refresh_from_db()
+        self.assertEqual(game.status, PongGame.Status.ONGOING)
+        self.assertEqual(finalize_stale_games(self.later), 1)
+        tournament.refresh_from_db()
+        self.assertEqual(tournament.winner_id, self.players[1].id)
+
+    def test_expire_idle_rooms(self):
+        empty = PongRoom.objects.create(room_id='empty', owner=self.players[0])
+        occupied = PongRoom.objects.create(room_id='occupied', owner=self.players[0])
+        occupied.players.add(self.players[0])
+        playing = PongRoom.objects.create(room_id='playing', owner=self.players[1])
+        PongGame.objects.create(room=playing, player1=self.players[1], player2_is_ai=True)
+
+        self.assertEqual(expire_idle_rooms(timezone.now()), 0)
+        # Empty rooms go first, rooms with players left in them only after a day
+        self.assertEqual(expire_idle_rooms(timezone.now() + timedelta(hours=1)), 1)
+        self.assertFalse(PongRoom.objects.filter(pk=empty.pk).exists())
+        self.assertEqual(expire_idle_rooms(self.later), 1)
+        self.assertEqual(list(PongRoom.objects.values_list('room_id', flat=True)), ['playing'])
+
+    def test_purge_orphaned_invitations(self):
+        room = PongRoom.objects.create(room_id='invites', owner=self.players[0])
+        room.players.add(self.players[1])
+        room.pending_invitations.add(*self.players)
+
+        self.assertEqual(purge_orphaned_invitations(), 2)
+        self.assertEqual(list(room.pending_invitations.values_list('id', flat=True)), [self.players[2].id])
+
+class ScoreStoreTestCase(TransactionTestCase):
+    def setUp(self):
+        self.player = User.objects.create_user(username='scorer', password='password123', email='scorer@test.com')
+        self.game = PongGame.objects.create(player1=self.player, player2_is_ai=True)
+        self.store = ScoreStore(interval=60)
+
+    def test_scoring_game_not_stale(self):
+        started = timezone.now() - timedelta(hours=2)
+        PongGame.objects.filter(pk=self.game.pk).update(created_at=started, updated_at=started)
+
+        async def score():
+            self.store.record_scores(self.game.id, 3, 0)
+            await self.store.flush()
+        asyncio.run(score())
+
+        # A long match still scoring is kept, the same match abandoned is finished
+        self.assertEqual(finalize_stale_games(timezone.now()), 0)
+        self.game.refresh_from_db()
+        self.assertEqual((self.game.status, self.game.player1_score), (PongGame.Status.ONGOING, 3))
+        self.assertEqual(finalize_stale_games(timezone.now() + timedelta(hours=2)), 1)
+
+    def test_coalesced_flush(self):
+        async def play():
+            self.store.track(self.game)
+            with mock.patch.object(self.store, '_write', mock.AsyncMock(wraps=self.store._write)) as write:
+                for scores in ((1, 0), (2, 0), (2, 1), (2, 0)):
+                    self.store.record_scores(self.game.id, *scores)
+                # Set elsewhere: only fields this store changed are written
+                await database_sync_to_async(PongGame.objects.filter(pk=self.game.pk).update)(player2_score=5)
+                await self.store.flush()
+                # Nothing left to write
+                self.store.record_scores(self.game.id, 2, 0)
+                await self.store.flush()
+            return write.await_args_list
+        writes = asyncio.run(play())
+
+        self.assertEqual([call.args[0] for call in writes], [{self.game.id: {'player1_score': 2}}])
+        self.game.refresh_from_db()
+        self.assertEqual((self.game.player1_score, self.game.player2_score), (2, 5))
+
+    def test_finished_game_not_overwritten(self):
+        async def play():
+            self.store.record_scores(self.game.id, 4, 1)
+            await self.store.finish(self.game.id, 5, 3)
+            forfeited = await self.store.forfeit(self.game.id, 'player1_score')
+            # A flush arriving after the end is dropped too
+            self.store.record_scores(self.game.id, 9, 9)
+            await self.store.flush()
+            return forfeited
+        self.assertFalse(asyncio.run(play()))
+
+        self.game.refresh_from_db()
+        self.assertEqual((self.game.status, self.game.player1_score, self.game.player2_score), (PongGame.Status.FINISHED, 5, 3))
+
+    def test_forfeit(self):
+        async def play():
+            self.store.record_scores(self.game.id, 2, 1)
+            return await self.store.forfeit(self.game.id, 'player2_score')
+        self.assertTrue(asyncio.run(play()))
+
+        # Pending scores are flushed before the forfeit
+        self.game.refresh_from_db()
+        self.assertEqual((self.game.status, self.game.player1_score, self.game.player2_score), (PongGame.Status.FINISHED, 2, -1))
+
+class ReplayTestCase(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='viewer', password='password123', email='viewer@test.com')
+        self.game = PongGame.objects.create(player1=self.user, player2_is_ai=True)
+        self.replay_dir = tempfile.TemporaryDirectory()
+        patcher = mock.patch.object(replay, 'REPLAY_DIR', Path(self.replay_dir.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.replay_dir.cleanup)
+
+    def test_parse_range(self):
+        self.assertEqual(parse_range('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(parse_range('bytes=900-', 1000), (900, 999))
+        self.assertEqual(parse_range('bytes=-100', 1000), (900, 999))
+        self.assertEqual(parse_range('bytes=-5000', 1000), (0, 999))
+        self.assertEqual(parse_range('bytes=500-5000', 1000), (500, 999))
+        for header in ('bytes=1000-', 'bytes=5-2', 'bytes=0-1,5-9', 'items=0-1', 'bytes=a-b'):
+            self.assertIsNone(parse_range(header, 1000), header)
+
+    async def record(self):
+        recorder = replay.ReplayRecorder(enabled=True, snapshot_rate=0, interval=60)
+        state = {'ball': {'x': 400.5, 'y': 300, 'dx': -250, 'dy': 125}, 'leftPaddle': {'y': 250}, 'rightPaddle': {'y': 310.2}}
+        recorder.record_snapshot(self.game.id, state, {'left': 2, 'right': 1})
+        recorder.record_input(self.game.id, -1, 0.5)
+        await recorder.finish(self.game.id)
+        return replay.replay_path(self.game.id).read_bytes()
+
+    def test_replay_format(self):
+        data = asyncio.run(self.record())
+        self.assertEqual(len(data), replay.HEADER.size + 2 * replay.RECORD.size + replay.SNAPSHOT.size + replay.INPUT.size)
+
+        decoded = replay.read_replay(data)
+        self.assertEqual(decoded['game_id'], self.game.id)
+        snapshot, move = decoded['records']
+        self.assertEqual(snapshot['state'], {
+            'ball': {'x': 400.5, 'y': 300, 'dx': -250, 'dy': 125},
+            'leftPaddle': {'y': 250},
+            'rightPaddle': {'y': 310.2},
+        })
+        self.assertEqual(snapshot['scores'], {'left': 2, 'right': 1})
+        self.assertEqual((move['type'], move['direction'], round(move['intensity'], 2)), ('input', -1, 0.5))
+        with self.assertRaises(ValueError):
+            replay.read_replay(b'XXXX' + data[4:])
+
+    async def test_game_replay(self):
+        data = await self.record()
+        url = f'/pong/game/{self.game.id}/replay/'
+        self.async_client.cookies['access_token'] = str(AccessToken.for_user(self.user))
+
+        async def get(**headers):
+            response = await self.async_client.get(url, headers=headers)
+            body = b''.join([chunk async for chunk in response.streaming_content]) if response.streaming else response.content
+            return response, body
+
+        response, body = await get()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        self.assertEqual(body, data)
+
+        response, body = await get(Range='bytes=4-9')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 4-9/{len(data)}')
+        self.assertEqual(body, data[4:10])
+
+        response, body = await get(Range='bytes=-3')
+        self.assertEqual(body, data[-3:])
+
+        response, _ = await get(Range=f'bytes={len(data)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(data)}')
+
+REMOVED = object()
+
+def apply_room_patch(state, ops):
+    """applyRoomPatch of RoomConnectionManager.js, merged into the state like the UPDATE_ROOM action"""
+    changes = {}
+    for op in ops:
+        keys = [key.replace('~1', '/').replace('~0', '~') for key in op['path'].split('/')[1:]]
+        last = keys.pop()
+        if not keys:
+            changes[last] = REMOVED if op['op'] == 'remove' else op['value']
+            continue
+        top, *rest = keys
+        if top not in changes:
+            changes[top] = copy.deepcopy(state.get(top) or {})
+        target = changes[top]
+        for key in rest:
+            if not isinstance(target.get(key), dict):
+                target[key] = {}
+            target = target[key]
+        if op['op'] == 'remove':
+            target.pop(last, None)
+        else:
+            target[last] = op['value']
+    merged = {**state, **changes}
+    return {key: value for key, value in merged.items() if value is not REMOVED}
+
+class RoomClient:
+    """Follows a room the way RoomConnectionManager.js does"""
+
+    def __init__(self, communicator):
+        self.communicator = communicator
+        self.state = None
+        self.version = None
+        self.requests = 0
+        self.resyncs = 0
+
+    async def receive(self):
+        message = await self.communicator.receive_json_from(timeout=3)
+        if message.get('type') == 'room_update' or 'room_state' in message:
+            self.state = message['room_state']
+            self.version = self.state['version']
+        elif message.get('type') == 'room_patch':
+            if self.version is None or message['version'] <= self.version:
+                pass
+            elif message['base'] != self.version:
+                # Version gap: fetch the whole room
+                self.resyncs += 1
+                await self.request('get_state')
+            else:
+                self.state = {**apply_room_patch(self.state, message['ops']), 'version': message['version']}
+                self.version = message['version']
+        return message
+
+    async def receive_until(self, message_type):
+        while True:
+            message = await self.receive()
+            if message.get('type') == message_type:
+                return message
+
+    async def request(self, action, **data):
+        self.requests += 1
+        message_id = self.requests
+        await self.communicator.send_json_to({'id': message_id, 'action': action, **data})
+        while True:
+            message = await self.receive()
+            if message.get('id') == message_id and 'status' in message:
+                return message
+
+class RoomCacheTestCase(TransactionTestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='password123', email='owner@test.com')
+        self.guest = User.objects.create_user(username='guest', password='password123', email='guest@test.com')
+        self.room = PongRoom.objects.create(room_id='cached', owner=self.owner, settings={'maxScore': 5})
+        self.room.players.add(self.owner)
+        self.cache = RoomStateCache(ttl=60)
+        self.cache.attach(self.room.room_id)
+
+    def test_diff_state_round_trip(self):
+        old = {
+            'mode': 'CLASSIC',
+            'owner': {'id': 1, 'username': 'owner'},
+            'players': [{'id': 1, 'username': 'owner'}],
+            'settings': {'maxScore': 5, 'ballSpeed': 3, 'nested': {'a': 1}},
+            'canStartGame': False,
+            'a/b': 1,
+            'c~d': {'x': 1},
+        }
+        new = {
+            'mode': 'TOURNAMENT',
+            'owner': None,
+            'players': [{'id': 1, 'username': 'owner'}, {'id': 2, 'username': 'guest'}],
+            'settings': {'maxScore': 7, 'paddleSize': 4, 'nested': {'a': 1, 'b': 2}},
+            'canStartGame': True,
+            'c~d': {'x': 2},
+            'createdAt': '2024-01-01T00:00:00',
+        }
+        for before, after in ((old, new), (new, old), (old, old), ({}, new), (new, {})):
+            ops = diff_state(before, after)
+            self.assertEqual(apply_room_patch(before, ops), after)
+        self.assertEqual(diff_state(old, old), [])
+        self.assertIn({'op': 'replace', 'path': '/settings/maxScore', 'value': 7}, diff_state(old, new))
+        self.assertIn({'op': 'remove', 'path': '/a~1b'}, diff_state(old, new))
+        self.assertIn({'op': 'replace', 'path': '/c~0d/x', 'value': 2}, diff_state(old, new))
+
+    def test_snapshot_frames(self):
+        first = RoomSnapshot({'mode': 'CLASSIC', 'settings': {'maxScore': 5}}, 10)
+        second = RoomSnapshot({'mode': 'CLASSIC', 'settings': {'maxScore': 7}}, 11)
+
+        self.assertEqual(json.loads(first.text), {'type': 'room_update', 'room_state': {**first.room, 'version': 10}})
+        patch = json.loads(second.patch_frame(first))
+        self.assertEqual((patch['type'], patch['base'], patch['version']), ('room_patch', 10, 11))
+        self.assertEqual(apply_room_patch(first.room, patch['ops']), second.room)
+
+    async def test_versions(self):
+        room_id = self.room.room_id
+        first = await self.cache.get(room_id)
+        # Starts from the wall clock in ms
+        self.assertAlmostEqual(first.version, time.time() * 1000, delta=60000)
+        self.assertEqual(first.state['version'], first.version)
+        self.assertIs(await self.cache.get(room_id), first)
+        # Reloading an unchanged room keeps its version
+        self.assertEqual((await self.cache.get(room_id, fresh=True)).version, first.version)
+
+        await database_sync_to_async(PongRoom.objects.filter(room_id=room_id).update)(settings={'maxScore': 7})
+        self.cache.invalidate(room_id)
+        second = await self.cache.get(room_id)
+        self.assertEqual(second.version, first.version + 1)
+        self.assertEqual(second.state['settings'], {'maxScore': 7})
+
+        self.assertEqual(await self.cache.publish(room_id), (second, None))
+        self.assertEqual(await self.cache.publish(room_id), (second, second))
+
+    async def test_concurrent_loads_shared(self):
+        with mock.patch('pong.room_cache.load_room_state', wraps=load_room_state) as load:
+            snapshots = await asyncio.gather(*(self.cache.get(self.room.room_id, fresh=True) for _ in range(3)))
+
+        self.assertEqual(load.call_count, 1)
+        self.assertTrue(all(snapshot is snapshots[0] for snapshot in snapshots))
+
+    async def test_invalidate_during_load(self):
+        room_id = self.room.room_id
+
+        def load_then_write(room_id):
+            state = load_room_state(room_id)
+            if load.call_count == 1:
+                # Written and invalidated by a mutation while the room was being read
+                PongRoom.objects.filter(room_id=room_id).update(settings={'maxScore': 9})
+                self.cache.invalidate(room_id)
+            return state
+
+        with mock.patch('pong.room_cache.load_room_state', side_effect=load_then_write) as load:
+            snapshot = await self.cache.get(room_id)
+
+        self.assertEqual(load.call_count, 2)
+        self.assertEqual(snapshot.state['settings'], {'maxScore': 9})
+
+    async def test_members(self):
+        await database_sync_to_async(self.room.pending_invitations.add)(self.guest)
+        members = self.cache.attach(self.room.room_id)
+        await self.cache.get(self.room.room_id)
+
+        self.assertTrue(members.is_owner(self.owner.id))
+        self.assertFalse(members.is_owner(self.guest.id))
+        self.assertEqual((members.players, members.invited), ({self.owner.id}, {self.guest.id}))
+        players = members.players
+        members.add_player(self.guest.id)
+        self.assertEqual((members.players, members.invited), ({self.owner.id, self.guest.id}, frozenset()))
+        # Replaced, never mutated in place
+        self.assertEqual(players, {self.owner.id})
+        members.remove_player(self.guest.id)
+        self.assertEqual(members.players, {self.owner.id})
+        self.assertFalse(RoomMembers().is_owner(self.owner.id))
+
+class RoomConsumerTestCase(TransactionTestCase):
+    def setUp(self):
+        self.owner, self.guest, self.other = [
+            User.objects.create_user(username=name, password='password123', email=f'{name}@test.com')
+            for name in ('owner', 'guest', 'other')
+        ]
+        self.room = PongRoom.objects.create(room_id='patched', owner=self.owner, mode=PongRoom.Mode.CLASSIC)
+        self.room.pending_invitations.add(self.guest)
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/pong_room/{self.room.room_id}/')
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def join(self, user):
+        client = RoomClient(await self.connect(user))
+        await client.request('get_state')
+        return client
+
+    async def test_members_patched_from_their_version(self):
+        owner = await self.join(self.owner)
+        guest = await self.join(self.guest)
+        # The guest joining reached the owner as a patch
+        self.assertEqual(len(owner.state['players']), 1)
+        await owner.receive_until('room_patch')
+        self.assertEqual([player['id'] for player in owner.state['players']], [self.owner.id, self.guest.id])
+        self.assertEqual(owner.version, guest.version)
+
+        versions = {client: client.version for client in (owner, guest)}
+        response = await owner.request('update_property', property='maxScore', value=7)
+        self.assertEqual(response['status'], 'success')
+        for client in (owner, guest):
+            patch = await client.receive_until('room_patch')
+            self.assertEqual(patch['base'], versions[client])
+            self.assertEqual(client.version, patch['version'])
+            self.assertEqual(client.state['settings']['maxScore'], 7)
+
+        applied = guest.state
+        await guest.request('get_state')
+        self.assertEqual(applied, guest.state)
+        self.assertEqual(owner.resyncs + guest.resyncs, 0)
+
+        await guest.communicator.disconnect()
+        await owner.communicator.disconnect()
+
+    async def test_version_gap_resyncs(self):
+        owner = await self.join(self.owner)
+        guest = await self.join(self.guest)
+        await owner.receive_until('room_patch')
+
+        # The guest misses a patch
+        await owner.request('update_property', property='maxScore', value=7)
+        while (await guest.communicator.receive_json_from(timeout=3)).get('type') != 'room_patch':
+            pass
+        stale = guest.version
+
+        await owner.request('update_property', property='maxScore', value=9)
+        patch = await guest.receive_until('room_patch')
+        self.assertNotEqual(patch['base'], stale)
+        # Fetched the whole room instead of applying the patch
+        self.assertEqual(guest.resyncs, 1)
+        self.assertEqual(guest.version, patch['version'])
+        self.assertEqual(guest.state['settings']['maxScore'], 9)
+        while owner.version != patch['version']:
+            await owner.receive()
+        self.assertEqual(guest.state, owner.state)
+
+        await guest.communicator.disconnect()
+        await owner.communicator.disconnect()
+
+    async def test_tournament_needs_two_players(self):
+        await database_sync_to_async(PongRoom.objects.filter(pk=self.room.pk).update)(mode=PongRoom.Mode.TOURNAMENT)
+        owner = await self.join(self.owner)
+
+        response = await owner.request('start_game')
+
+        self.assertEqual((response['status'], response['message']), ('error', 'A tournament needs at least 2 players'))
+        room = await database_sync_to_async(PongRoom.objects.get)(pk=self.room.pk)
+        self.assertEqual(room.state, PongRoom.State.LOBBY)
+        await owner.communicator.disconnect()
+
+    async def test_permissions(self):
+        owner = await self.join(self.owner)
+
+        # Not invited
+        other = await self.connect(self.other)
+        self.assertEqual((await other.receive_json_from())['code'], 4007)
+        self.assertEqual((await other.receive_output())['code'], 4007)
+
+        # Invited from another worker, after this one loaded the room
+        await database_sync_to_async(self.room.pending_invitations.set)([self.other])
+        guest = await self.join(self.other)
+        response = await guest.request('update_property', property='maxScore', value=3)
+        self.assertEqual(response['error']['code'], 4002)
+        response = await guest.request('start_game')
+        self.assertEqual(response['error']['code'], 4002)
+
+        # Full
+        await database_sync_to_async(self.room.pending_invitations.set)([self.guest])
+        late = await self.connect(self.guest)
+        self.assertEqual((await late.receive_json_from())['code'], 4003)
+
+        await guest.communicator.disconnect()
+        await owner.communicator.disconnect()
+
+    @mock.patch.object(room_consumer, 'RATE_LIMITS', {'*': (0.1, 3.0)})
+    async def test_rate_limit_before_parsing(self):
+        owner = await self.connect(self.owner)
+
+        # Malformed messages get no reply, unless dropped before being parsed
+        for _ in range(4):
+            await owner.send_to(text_data='not json')
+        rejected = await owner.receive_json_from(timeout=3)
+        while rejected.get('status') != 'error':
+            rejected = await owner.receive_json_from(timeout=3)
+        self.assertEqual((rejected['id'], rejected['error']['code']), (None, 4029))
+        await owner.disconnect()
+
+class RoundStartTestCase(TransactionTestCase):
+    def consumer(self, player_count):
+        players = [
+            User.objects.create_user(username=f'round{player_count}_{i}', password='password123', email=f'round{player_count}_{i}@test.com')
+            for i in range(player_count)
+        ]
+        room = PongRoom.objects.create(room_id=f'round{player_count}', owner=players[0], mode=PongRoom.Mode.TOURNAMENT)
+        room.players.add(*players)
+        consumer = PongRoomConsumer()
+        consumer.room, consumer.room_id, consumer.user = room, room.room_id, players[0]
+        return consumer
+
+    def test_start_round_queries(self):
+        # Bounded: the same queries for 4 players as for 8
+        consumer = self.consumer(4)
+        with self.assertNumQueries(24):
+            games, _, notifications = async_to_sync(consumer.start_round)()
+        self.assertEqual((len(games), len(notifications)), (2, 4))
+
+        consumer = self.consumer(8)
+        with self.assertNumQueries(24):
+            games, tournament, notifications = async_to_sync(consumer.start_round)()
+        self.assertEqual((len(games), len(notifications)), (4, 8))
+        self.assertEqual(tournament.pong_games.count(), 4)
+        self.assertEqual(ChatMessage.objects.filter(sender=tournament.pong_room.owner).count(), 8)
+
+    def test_notifications_grouped_per_recipient(self):
+        consumer = self.consumer(2)
+        consumer.channel_layer = mock.Mock(group_send=mock.AsyncMock())
+        first, second = consumer.room.players.order_by('id')
+        notifications = [
+            ChatMessage(id=1, sender=first, recipient=first, content='one'),
+            ChatMessage(id=2, sender=first, recipient=second, content='two'),
+            ChatMessage(id=3, sender=first, recipient=first, content='three'),
+        ]
+
+        async_to_sync(consumer.send_chat_notifications)(notifications)
+
+        events = {call.args[0]: call.args[1] for call in consumer.channel_layer.group_send.await_args_list}
+        self.assertEqual(len(consumer.channel_layer.group_send.await_args_list), 2)
+        self.assertEqual([message['content'] for message in events[f'chat_{first.id}']['messages']], ['one', 'three'])
+        self.assertEqual([message['id'] for message in events[f'chat_{second.id}']['messages']], [2])
+        self.assertEqual(events[f'chat_{second.id}']['type'], 'chat_messages')
+
+class GameActorTestCase(TransactionTestCase):
+    def setUp(self):
+        self.host, self.guest = [
+            User.objects.create_user(username=name, password='password123', email=f'{name}@test.com')
+            for name in ('host', 'guest')
+        ]
+        self.game = PongGame.objects.create(player1=self.host, player2=self.guest)
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/pong_game/{self.game.id}/')
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def receive_until(self, communicator, message_type):
+        while True:
+            message = await communicator.receive_json_from(timeout=3)
+            if message.get('type') == message_type:
+                return message
+
+    async def test_host_resumes_within_grace(self):
+        host = await self.connect(self.host)
+        guest = await self.connect(self.guest)
+        state = {'ball': {'x': 10, 'y': 20}}
+        await host.send_json_to({'type': 'physics_update', 'state': state})
+        await self.receive_until(guest, 'physics_update')
+        await guest.send_json_to({'type': 'paddle_move', 'direction': 1, 'intensity': 1.0})
+        await self.receive_until(host, 'paddle_move')
+
+        # Dropped, not closed on purpose
+        await host.disconnect(code=1006)
+        reconnecting = await self.receive_until(guest, 'player_reconnecting')
+        self.assertEqual((reconnecting['user_id'], reconnecting['is_host']), (self.host.id, True))
+
+        host = await self.connect(self.host)
+        resumed = await host.receive_json_from(timeout=3)
+        self.assertEqual((resumed['type'], resumed['snapshot']), ('game_state', state))
+        # Then the last guest input, to resume the paddle
+        self.assertEqual(await host.receive_json_from(timeout=3), {'type': 'paddle_move', 'direction': 1, 'intensity': 1.0})
+        reconnected = await self.receive_until(guest, 'player_reconnected')
+        self.assertEqual(reconnected['user_id'], self.host.id)
+        self.assertEqual(await database_sync_to_async(lambda: PongGame.objects.get(pk=self.game.pk).status)(), PongGame.Status.ONGOING)
+
+        await guest.disconnect()
+        await host.disconnect()
+
+    async def test_grace_expiry_forfeits(self):
+        host = await self.connect(self.host)
+        guest = await self.connect(self.guest)
+        await host.send_json_to({'type': 'update_scores', 'scores': {'left': 2, 'right': 1}})
+
+        with mock.patch.object(game_actor, 'RECONNECT_GRACE', 0.2):
+            await guest.disconnect(code=1006)
+            await self.receive_until(host, 'player_reconnecting')
+            disconnected = await self.receive_until(host, 'player_disconnected')
+        self.assertEqual((disconnected['user_id'], disconnected['is_host']), (self.guest.id, False))
+
+        game = await database_sync_to_async(PongGame.objects.get)(pk=self.game.pk)
+        self.assertEqual((game.status, game.player1_score, game.player2_score), (PongGame.Status.FINISHED, 2, -1))
+        await host.disconnect()
+
+    async def test_messages_processed_in_order(self):
+        actor = get_actor(str(self.game.id))
+        handled = []
+
+        async def handler(actor, index, delay):
+            await asyncio.sleep(delay)
+            if index == 1:
+                raise ValueError('failed')
+            handled.append(index)
+            return index
+
+        # Slower handlers first: each one still waits for the previous one
+        results = await asyncio.gather(
+            *(actor.submit(handler, index, 0.03 * (3 - index)) for index in range(4)),
+            return_exceptions=True
+        )
+
+        self.assertEqual(handled, [0, 2, 3])
+        self.assertIsInstance(results[1], ValueError)
+        self.assertEqual([results[0], *results[2:]], [0, 2, 3])
+
+    async def test_snapshots_relayed_in_order(self):
+        host = await self.connect(self.host)
+        guest = await self.connect(self.guest)
+
+        for frame in range(10):
+            await host.send_json_to({'type': 'physics_update', 'state': {'frame': frame}})
+
+        frames = [(await self.receive_until(guest, 'physics_update'))['state']['frame'] for _ in range(10)]
+        self.assertEqual(frames, list(range(10)))
+        await guest.disconnect()
+        await host.disconnect()
+
+    @mock.patch.object(game_consumer, 'RATE_LIMITS', {'*': (0.1, 3.0)})
+    async def test_rate_limit_before_parsing(self):
+        host = await self.connect(self.host)
+        await self.receive_until(host, 'player_ready')
+        dropped = rate_limit_stats.serialize().get('game', {}).get('*', 0)
+
+        for _ in range(5):
+            await host.send_to(text_data='not json')
+        self.assertTrue(await host.receive_nothing())
+
+        self.assertEqual(rate_limit_stats.serialize()['game']['*'], dropped + 2)
+        await host.disconnect()
+
+class SpectatorTestCase(TransactionTestCase):
+    def setUp(self):
+        self.host, self.guest, *self.watchers = [
+            User.objects.create_user(username=name, password='password123', email=f'{name}@test.com')
+            for name in ('host', 'guest', 'watcher0', 'watcher1', 'watcher2')
+        ]
+        self.game = PongGame.objects.create(player1=self.host, player2=self.guest)
+
+    async def connect(self, user, path=''):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/pong_game/{self.game.id}/{path}')
+        communicator.scope['user'] = user
+        return communicator, await communicator.connect()
+
+    @mock.patch.object(game_actor, 'MAX_SPECTATORS', 2)
+    @mock.patch.object(game_actor, 'SPECTATOR_RATE', 50.0)
+    async def test_spectators(self):
+        players = []
+        for user in (self.host, self.guest):
+            player, (connected, _) = await self.connect(user)
+            self.assertTrue(connected)
+            players.append(player)
+        spectators = []
+        for watcher in self.watchers[:2]:
+            spectator, (connected, _) = await self.connect(watcher, 'spectate/')
+            self.assertTrue(connected)
+            self.assertTrue((await spectator.receive_json_from())['is_spectator'])
+            spectators.append(spectator)
+
+        # One over the cap
+        _, (connected, code) = await self.connect(self.watchers[2], 'spectate/')
+        self.assertEqual((connected, code), (False, 4009))
+
+        await players[0].send_json_to({'type': 'physics_update', 'state': {'frame': 1}})
+        frames = [await spectator.receive_from(timeout=3) for spectator in spectators]
+        # Serialized once and sent as is to every spectator
+        self.assertEqual(frames[0], frames[1])
+        self.assertEqual(json.loads(frames[0]), {'type': 'physics_update', 'state': {'frame': 1}, 'scores': {'left': 0, 'right': 0}})
+
+        for communicator in (*spectators, *players):
+            await communicator.disconnect()
+
+class ClockEstimatorTestCase(SimpleTestCase):
+    def test_offset(self):
+        link = ClockEstimator()
+        # Client clock 500ms ahead, 40ms each way, 10ms on the client
+        self.assertEqual(link.add_sample(1000, 1540, 1550, 1090), 80)
+        self.assertEqual((link.rtt, link.offset, link.jitter), (80, 500, 40))
+
+        # Slower link: smoothed, not replaced
+        self.assertEqual(link.add_sample(2000, 2580, 2590, 2170), 160)
+        self.assertEqual((link.rtt, link.offset, link.jitter), (90, 500, 50))
+        self.assertEqual(link.interpolation_delay, 145)
+        self.assertEqual(link.samples, 2)
+
+    def test_invalid_samples_ignored(self):
+        link = ClockEstimator()
+        link.add_sample(1000, 1540, 1550, 1090)
+
+        # Answered before being asked, and sent before being received
+        self.assertIsNone(link.add_sample(2000, 2540, 2550, 1990))
+        self.assertIsNone(link.add_sample(2000, 2550, 2540, 2090))
+        self.assertEqual((link.rtt, link.offset, link.samples), (80, 500, 1))
+
+class LagCompensationTestCase(SimpleTestCase):
+    def history(self, count=8):
+        """Host snapshots every 20ms of a ball crossing the right paddle plane between 80 and 100ms"""
+        return [(t, {
+            'ball': {'x': 700 + t, 'y': 100, 'dx': 1000, 'dy': 0, 'radius': 5},
+            'rightPaddle': {'x': 800, 'y': 300, 'dy': 0, 'width': 10, 'height': 50},
+            'scores': {'left': 0, 'right': 0}
+        }) for t in range(0, 20 * count, 20)]
+
+    def test_input_issued_at(self):
+        link = ClockEstimator()
+        link.add_sample(1000, 1000, 1000, 1060)
+
+        self.assertEqual(input_issued_at(950, 1000, link), 950)
+        # Without a timestamp: half the RTT before
+        self.assertEqual(input_issued_at(None, 1000, link), 970)
+        self.assertEqual(input_issued_at('950', 1000, None), 1000)
+        # From the future
+        self.assertEqual(input_issued_at(1200, 1000, link), 1000)
+        # Never further back than the window
+        self.assertEqual(input_issued_at(0, 1000, link), 1000 - LAG_COMPENSATION_WINDOW)
+
+    def test_rewind_turns_miss_into_hit(self):
+        correction = rewind_guest_input(self.history(), 0, -2000, 120)
+
+        self.assertEqual(correction['at'], 90)
+        self.assertEqual((correction['ball']['x'], correction['ball']['y']), (790, 100))
+        self.assertLess(correction['ball']['dx'], 0)
+        # Hit above the paddle centre, sent back upwards
+        self.assertLess(correction['ball']['dy'], 0)
+        self.assertEqual(correction['paddle_y'], 60)
+        self.assertEqual(correction['rewind_ms'], 120)
+
+    def test_rewind_misses(self):
+        # Not moving, or moving away
+        self.assertIsNone(rewind_guest_input(self.history(), 0, 0, 120))
+        self.assertIsNone(rewind_guest_input(self.history(), 0, 2000, 120))
+        # Issued before the oldest snapshot
+        self.assertIsNone(rewind_guest_input(self.history()[2:], 0, -2000, 120))
+
+    def test_rewind_steps_clamped(self):
+        with mock.patch.object(lag_compensation, 'MAX_REWIND_STEPS', 4):
+            self.assertIsNone(rewind_guest_input(self.history(), 0, -2000, 120))
+        with mock.patch.object(lag_compensation, 'MAX_REWIND_STEPS', 5):
+            self.assertIsNotNone(rewind_guest_input(self.history(), 0, -2000, 120))
@@ -8,4 +8,7 @@ urlpatterns = [
     path('room/<str:room_id>/state/', views.pong_room_state, name='pong_room_state'),
     path('room/<str:room_id>/invite_friends/', views.invite_friends, name='invite_friends'),
     path('game/<str:game_id>/', views.pong_game, name='pong_game'),
+    path('game/<str:game_id>/replay/', views.game_replay, name='game_replay'),
+    path('game/<str:game_id>/latency/', views.game_latency, name='game_latency'),
+    path('latency/', views.latency_overview, name='latency_overview'),
 ]
\ No newline at end of file
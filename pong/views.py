@@ -2,13 +2,16 @@ import logging, json, uuid
 from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.shortcuts import get_object_or_404, redirect, render
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.contrib.auth import get_user_model
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
 from rest_framework.decorators import api_view, permission_classes
 from authentication.decorators import IsAuthenticatedWithCookie
 from .models import PongGame, PongRoom
+from .replay import iter_file, replay_path
+from .game_actor import find_actor
+from .latency import latency_stats
 from rest_framework.response import Response
 from django.urls import reverse
 
@@ -66,6 +69,68 @@ def pong_game(request, game_id):
         'refresh_token': refresh_token
     })
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticatedWithCookie])
+def game_latency(request, game_id):
+    """Returns the RTT and clock offset estimates of each player of a running game"""
+    actor = find_actor(game_id)
+    if actor is None:
+        return JsonResponse({'error': 'Game is not running on this server'}, status=404)
+    return JsonResponse({'game_id': game_id, 'players': actor.latency_state()})
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticatedWithCookie])
+def latency_overview(request):
+    """Returns RTT and jitter histograms over all game sockets of this server"""
+    return JsonResponse(latency_stats.serialize())
+
+def parse_range(header, size):
+    """Parse a single `bytes=` range header and return (start, end) or None if unsatisfiable"""
+    unit, _, spec = header.partition('=')
+    if unit.strip() != 'bytes' or ',' in spec:
+        return None
+    first, _, last = spec.strip().partition('-')
+    try:
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        else:
+            start = max(size - int(last), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        return None
+    return start, end
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticatedWithCookie])
+def game_replay(request, game_id):
+    """Streams the recorded replay of a game, honoring Range requests"""
+    game = get_object_or_404(PongGame, id=game_id)
+    path = replay_path(game.id)
+    if not path.exists():
+        return JsonResponse({'error': 'No replay recorded for this game'}, status=404)
+
+    size = path.stat().st_size
+    range_header = request.headers.get('Range')
+    if range_header:
+        byte_range = parse_range(range_header, size)
+        if byte_range is None:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        start, end = byte_range
+        response = StreamingHttpResponse(iter_file(path, start, end - start + 1), status=206, content_type='application/octet-stream')
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    else:
+        start, end = 0, size - 1
+        response = StreamingHttpResponse(iter_file(path, 0, size), content_type='application/octet-stream')
+    response['Content-Length'] = str(end - start + 1)
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = f'attachment; filename="game_{game.id}.pgr"'
+    return response
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticatedWithCookie])
 def pong_room_view(request, room_id):
@@ -104,11 +169,11 @@ def invite_friends(request, room_id):
         for friend in friends[:invitations_to_send]:
             room.pending_invitations.add(friend)
 
-        # Envoyer une mise à jour WebSocket
+        # The room's consumers reload it, on whichever worker they run
         channel_layer = get_channel_layer()
         async_to_sync(channel_layer.group_send)(
             f'pong_room_{room_id}',
-            {'type': 'update_players'}
+            {'type': 'update_room'}
         )
 
         return JsonResponse({"status": "invitations sent", "sent": invitations_to_send})
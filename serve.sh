@@ -0,0 +1,29 @@
+#!/bin/bash
+# Starts DAPHNE_WORKERS daphne processes on consecutive ports from DAPHNE_BASE_PORT.
+# nginx.sharded.conf pins every game and room id to one of them, so its sockets
+# and its in-process game actor live in the same worker.
+WORKERS=${DAPHNE_WORKERS:-1}
+BASE_PORT=${DAPHNE_BASE_PORT:-8000}
+
+if [ "$WORKERS" -gt 1 ] && [ "$CHANNEL_LAYER_BACKEND" != "postgres" ]; then
+    echo "DAPHNE_WORKERS > 1 requires CHANNEL_LAYER_BACKEND=postgres" >&2
+    exit 1
+fi
+
+pids=()
+for ((i = 0; i < WORKERS; i++)); do
+    args=(-b 0.0.0.0 -p $((BASE_PORT + i)))
+    # Only the first worker serves the direct SSL endpoint
+    if [ "$i" -eq 0 ]; then
+        args+=(-e ssl:443:privateKey=/certs/key.pem:certKey=/certs/cert.pem)
+    fi
+    WORKER_ID=$i daphne "${args[@]}" transcendence.asgi:application &
+    pids+=($!)
+done
+
+trap 'kill -TERM "${pids[@]}" 2>/dev/null' TERM INT
+
+# Stop everything as soon as one worker exits so the container gets restarted
+wait -n
+kill -TERM "${pids[@]}" 2>/dev/null
+wait
@@ -0,0 +1,318 @@
+import asyncio, json, logging, secrets, time, traceback, weakref
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Set
+from django.conf import settings
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+import psycopg
+from psycopg import sql
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = [
+    """CREATE UNLOGGED TABLE IF NOT EXISTS channels_group (
+        group_name varchar(100) NOT NULL,
+        channel varchar(100) NOT NULL,
+        expires_at timestamptz NOT NULL,
+        PRIMARY KEY (group_name, channel)
+    )""",
+    "CREATE INDEX IF NOT EXISTS channels_group_expires_at ON channels_group (expires_at)",
+    """CREATE UNLOGGED TABLE IF NOT EXISTS channels_message (
+        id bigserial PRIMARY KEY,
+        envelope text NOT NULL,
+        expires_at timestamptz NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS channels_message_expires_at ON channels_message (expires_at)",
+]
+
+# Arbitrary key serializing schema creation across processes
+SCHEMA_LOCK = 7261
+
+class _LoopState:
+    """Connections, listener and local queues of the layer for one event loop"""
+
+    def __init__(self):
+        # Postgres channel this loop listens on, also part of its channel names
+        self.name = f'chl_{secrets.token_hex(8)}'
+        self.pool: Optional[AsyncConnectionPool] = None
+        self.queues: Dict[str, asyncio.Queue] = {}
+        self.local: Set[str] = set()
+        self.listening = asyncio.Event()
+        self.listener: Optional[asyncio.Task] = None
+        self.ready = asyncio.Lock()
+
+class PostgresChannelLayer(BaseChannelLayer):
+    """
+    Channel layer over Postgres LISTEN/NOTIFY.
+
+    Every event loop using the layer listens on its own Postgres channel, and
+    its channel names carry that name so a message can be routed with a
+    single NOTIFY. A group send resolves the members once and sends one
+    notification per listening loop, delivering to local channels directly.
+    Envelopes over `spill_threshold` bytes go through the `channels_message`
+    table. Group membership is stored in `channels_group` and expires after
+    `group_expiry` seconds unless renewed.
+
+    Only listening loops keep a connection pool, closed with their listener.
+    Loops that never receive, like the throwaway loops of `async_to_sync`,
+    open a connection per operation and hold nothing once it is done.
+    """
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, expiry=60, group_expiry=86400, capacity=100, channel_capacity=None,
+                 pool_size=4, spill_threshold=7000, purge_interval=60, connect_timeout=10,
+                 database='default', **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity)
+        self.channel_capacity = self.compile_capacities(self.channel_capacity)
+        self.group_expiry = group_expiry
+        self.pool_size = pool_size
+        self.spill_threshold = spill_threshold
+        self.purge_interval = purge_interval
+        self.connect_timeout = connect_timeout
+        db = settings.DATABASES[database]
+        self.conninfo = make_conninfo(
+            dbname=db.get('NAME'),
+            user=db.get('USER') or None,
+            password=db.get('PASSWORD') or None,
+            host=db.get('HOST') or None,
+            port=db.get('PORT') or None,
+        )
+        self._states: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _LoopState]' = weakref.WeakKeyDictionary()
+        self._schema_ready = False
+
+    # Channels
+
+    async def new_channel(self, prefix='specific'):
+        state = await self._state(listen=True)
+        channel = f'{prefix}.{state.name}!{secrets.token_hex(6)}'
+        state.local.add(channel)
+        return channel
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_channel_name(channel)
+        await self._publish([channel], message, strict=True)
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        state = await self._state(listen=True)
+        queue = self._queue(state, channel)
+        try:
+            while True:
+                expires_at, message = await queue.get()
+                if expires_at >= time.time():
+                    return message
+        except asyncio.CancelledError:
+            # The consumer is gone, stop accepting messages for its channel
+            state.local.discard(channel)
+            state.queues.pop(channel, None)
+            raise
+
+    # Groups
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        state = await self._state()
+        async with self._connection(state) as conn:
+            await conn.execute(
+                """INSERT INTO channels_group (group_name, channel, expires_at)
+                VALUES (%s, %s, now() + make_interval(secs => %s))
+                ON CONFLICT (group_name, channel) DO UPDATE SET expires_at = EXCLUDED.expires_at""",
+                (group, channel, self.group_expiry)
+            )
+
+    async def group_discard(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        state = await self._state()
+        async with self._connection(state) as conn:
+            await conn.execute(
+                'DELETE FROM channels_group WHERE group_name = %s AND channel = %s',
+                (group, channel)
+            )
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_group_name(group)
+        state = await self._state()
+        async with self._connection(state) as conn:
+            cursor = await conn.execute(
+                'SELECT channel FROM channels_group WHERE group_name = %s AND expires_at > now()',
+                (group,)
+            )
+            channels = [row[0] for row in await cursor.fetchall()]
+            if channels:
+                await self._publish(channels, message, conn=conn)
+
+    async def flush(self):
+        state = await self._state()
+        async with self._connection(state) as conn:
+            await conn.execute('TRUNCATE channels_group, channels_message')
+        for loop_state in list(self._states.values()):
+            loop_state.queues.clear()
+
+    async def close(self):
+        state = self._states.pop(asyncio.get_running_loop(), None)
+        if state is None:
+            return
+        if state.listener is not None:
+            state.listener.cancel()
+        if state.pool is not None:
+            await state.pool.close()
+
+    # Delivery
+
+    async def _publish(self, channels: List[str], message: Dict[str, Any], strict: bool = False,
+                       conn: Optional[psycopg.AsyncConnection] = None) -> None:
+        """
+        Serializes a message once and sends it to every listening loop owning one of the channels.
+
+        Notifications go through `conn` when given, otherwise through a connection of the loop.
+        """
+        state = await self._state()
+        body = json.dumps(message, separators=(',', ':'))
+        targets: Dict[str, List[str]] = {}
+        for channel in channels:
+            targets.setdefault(self._owner(channel), []).append(channel)
+
+        local = targets.pop(state.name, None)
+        if local:
+            self._deliver(state, local, body, strict)
+        if not targets:
+            return
+
+        if conn is None:
+            async with self._connection(state) as conn:
+                await self._notify(conn, targets, body)
+        else:
+            await self._notify(conn, targets, body)
+
+    async def _notify(self, conn: psycopg.AsyncConnection, targets: Dict[str, List[str]], body: str) -> None:
+        for owner, owned in targets.items():
+            envelope = ' '.join(owned) + '\n' + body
+            if len(envelope.encode()) > self.spill_threshold:
+                cursor = await conn.execute(
+                    """INSERT INTO channels_message (envelope, expires_at)
+                    VALUES (%s, now() + make_interval(secs => %s)) RETURNING id""",
+                    (envelope, self.expiry)
+                )
+                envelope = f'@{(await cursor.fetchone())[0]}'
+            await conn.execute('SELECT pg_notify(%s, %s)', (owner, envelope))
+
+    def _deliver(self, state: _LoopState, channels: List[str], body: str, strict: bool = False) -> None:
+        expires_at = time.time() + self.expiry
+        for channel in channels:
+            if channel not in state.local:
+                continue
+            try:
+                self._queue(state, channel).put_nowait((expires_at, json.loads(body)))
+            except asyncio.QueueFull:
+                if strict:
+                    raise ChannelFull(channel)
+                logger.warning(f"Channel layer dropped a message for a full channel - channel: {channel}")
+
+    @staticmethod
+    def _owner(channel: str) -> str:
+        if '!' not in channel:
+            raise ValueError(f'PostgresChannelLayer only routes process-specific channels, got {channel}')
+        return channel[:channel.index('!')].rsplit('.', 1)[-1]
+
+    def _queue(self, state: _LoopState, channel: str) -> asyncio.Queue:
+        queue = state.queues.get(channel)
+        if queue is None:
+            queue = state.queues[channel] = asyncio.Queue(maxsize=self.get_capacity(channel))
+        return queue
+
+    # Connections
+
+    async def _state(self, listen: bool = False) -> _LoopState:
+        loop = asyncio.get_running_loop()
+        state = self._states.get(loop)
+        if state is None:
+            state = self._states[loop] = _LoopState()
+        if listen and state.listener is None:
+            async with state.ready:
+                if state.pool is None:
+                    pool = AsyncConnectionPool(self.conninfo, min_size=1, max_size=self.pool_size,
+                                               kwargs={'autocommit': True, 'connect_timeout': self.connect_timeout}, open=False)
+                    await pool.open()
+                    state.pool = pool
+                if state.listener is None:
+                    state.listener = loop.create_task(self._listen(state))
+        if listen:
+            try:
+                await asyncio.wait_for(state.listening.wait(), self.connect_timeout)
+            except asyncio.TimeoutError:
+                raise ConnectionError(f'Channel layer could not listen on Postgres within {self.connect_timeout}s') from None
+        return state
+
+    @asynccontextmanager
+    async def _connection(self, state: _LoopState) -> AsyncIterator[psycopg.AsyncConnection]:
+        """A pooled connection on listening loops, a connection of its own on the others"""
+        if state.pool is not None:
+            async with state.pool.connection() as conn:
+                await self._ensure_schema(conn)
+                yield conn
+            return
+        async with await psycopg.AsyncConnection.connect(self.conninfo, autocommit=True, connect_timeout=self.connect_timeout) as conn:
+            await self._ensure_schema(conn)
+            yield conn
+
+    async def _ensure_schema(self, conn: psycopg.AsyncConnection) -> None:
+        if self._schema_ready:
+            return
+        async with conn.transaction():
+            await conn.execute('SELECT pg_advisory_xact_lock(%s)', (SCHEMA_LOCK,))
+            for statement in SCHEMA:
+                await conn.execute(statement)
+        self._schema_ready = True
+
+    async def _listen(self, state: _LoopState) -> None:
+        """Receives notifications for this loop, reconnecting on failure"""
+        purge = asyncio.get_running_loop().create_task(self._purge(state))
+        try:
+            while True:
+                try:
+                    async with await psycopg.AsyncConnection.connect(self.conninfo, autocommit=True, connect_timeout=self.connect_timeout) as conn:
+                        await conn.execute(sql.SQL('LISTEN {}').format(sql.Identifier(state.name)))
+                        state.listening.set()
+                        async for notify in conn.notifies():
+                            await self._receive_envelope(state, notify.payload)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    state.listening.clear()
+                    logger.error(f"Channel layer listener failed, reconnecting - error: {str(e)}, traceback: {traceback.format_exc()}")
+                    await asyncio.sleep(1)
+        finally:
+            # Also reached when the loop shuts down with the listener still running
+            purge.cancel()
+            state.listening.clear()
+            if state.pool is not None:
+                await state.pool.close()
+
+    async def _receive_envelope(self, state: _LoopState, envelope: str) -> None:
+        if envelope.startswith('@'):
+            async with self._connection(state) as conn:
+                cursor = await conn.execute('SELECT envelope FROM channels_message WHERE id = %s', (int(envelope[1:]),))
+                row = await cursor.fetchone()
+            if row is None:
+                return
+            envelope = row[0]
+        names, _, body = envelope.partition('\n')
+        self._deliver(state, names.split(' '), body)
+
+    async def _purge(self, state: _LoopState) -> None:
+        """Deletes expired group memberships and spilled messages"""
+        while True:
+            await asyncio.sleep(self.purge_interval)
+            try:
+                async with self._connection(state) as conn:
+                    await conn.execute('DELETE FROM channels_group WHERE expires_at < now()')
+                    await conn.execute('DELETE FROM channels_message WHERE expires_at < now()')
+            except Exception as e:
+                logger.warning(f"Channel layer purge failed - error: {str(e)}")
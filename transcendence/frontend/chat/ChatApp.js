@@ -12,6 +12,11 @@ import { Modal } from 'bootstrap';
 window.bootstrap = window.bootstrap || {};
 window.bootstrap.Modal = Modal;
 
+// The server drops chat sockets silent for 75 seconds from presence
+const HEARTBEAT_INTERVAL = 25000;
+// Messages fetched per history page, older pages load when scrolling to the top
+const HISTORY_PAGE_SIZE = 50;
+
 export default class ChatApp {
 	static #instance = null;
 	// Store reference to subscription removers
@@ -47,6 +52,9 @@ export default class ChatApp {
 
 	constructor() {
 		this._connection = null;
+		this._heartbeat = null;
+		this._olderHistory = {};
+		this._loadingHistory = false;
 		this._isChatOpen = false;
 		this._lastMessageId = 0;
 		this._initializeState();
@@ -66,6 +74,7 @@ export default class ChatApp {
 		});
 
 		this.refreshUserList();
+		this.refreshInbox();
 
 		// Register computed properties and methods with JaiPasVu
 		this._setupJaiPasVu();
@@ -135,6 +144,13 @@ export default class ChatApp {
 				this.setChatModalOpen(false);
 			});
 		}
+
+		// Scroll events do not bubble, listen in the capture phase as the history is re-rendered
+		document.addEventListener('scroll', (e) => {
+			if (e.target.id !== 'message-history' || e.target.scrollTop > 0) return;
+			const selectedUser = store.getState('chat')?.selectedUser;
+			if (selectedUser) this.loadOlderMessages(selectedUser.id);
+		}, true);
 	}
 
 	_computeUnreadCount(state) {
@@ -194,6 +210,7 @@ export default class ChatApp {
 		if (!this._connection) return;
 
 		this._connection.on('message', this._handleIncomingMessage.bind(this));
+		this._connection.on('open', () => this._startHeartbeat());
 		this._connection.on('close', () => logger.info('[ChatApp] Connection closed'));
 		this._connection.on('error', (error) => logger.error('[ChatApp] Connection error:', error));
 	}
@@ -219,7 +236,9 @@ export default class ChatApp {
 					}
 				});
 
-				if (!this._isChatOpen) {
+				if (this._isChatOpen && store.getState('chat').selectedUser?.id === data.sender_id) {
+					this.markRead(data.sender_id);
+				} else {
 					store.dispatch({
 						domain: 'chat',
 						type: chatActions.INCREMENT_UNREAD,
@@ -417,6 +436,15 @@ export default class ChatApp {
 		}
 	}
 
+	_startHeartbeat() {
+		clearInterval(this._heartbeat);
+		this._heartbeat = setInterval(() => {
+			if (this._connection?.state?.canSend) {
+				this._connection.send({ type: 'heartbeat' });
+			}
+		}, HEARTBEAT_INTERVAL);
+	}
+
 	_sendMessage(message) {
 		if (!this._connection?.state?.canSend) {
 			logger.warn('[ChatApp] Cannot send message - connection not ready');
@@ -546,6 +574,7 @@ export default class ChatApp {
 		});
 
 		this.loadMessageHistory(user.id);
+		this.markRead(user.id);
 	}
 
 	async refreshUserList() {
@@ -568,8 +597,45 @@ export default class ChatApp {
 		}
 	}
 
-	loadMessageHistory(userId) {
-		fetch(`/chat/history/${userId}/`, {
+	async refreshInbox() {
+		try {
+			const response = await fetch('/chat/inbox/', {
+				method: 'GET',
+				headers: { 'Content-Type': 'application/json' }
+			});
+
+			if (!response.ok) throw new Error('Failed to fetch inbox');
+
+			const conversations = await response.json();
+			store.dispatch({
+				domain: 'chat',
+				type: chatActions.SET_UNREAD,
+				payload: Object.fromEntries(
+					conversations
+						.filter(conversation => conversation.unread > 0)
+						.map(conversation => [conversation.user.id, conversation.unread])
+				)
+			});
+		} catch (error) {
+			logger.error('[ChatApp] Error refreshing inbox:', error);
+		}
+	}
+
+	markRead(userId) {
+		store.dispatch({
+			domain: 'chat',
+			type: chatActions.CLEAR_UNREAD,
+			payload: { friendId: userId }
+		});
+		this._sendMessage({
+			type: 'mark_read',
+			user_id: userId
+		});
+	}
+
+	_fetchHistory(userId, params = {}) {
+		const query = new URLSearchParams({ limit: HISTORY_PAGE_SIZE, ...params });
+		return fetch(`/chat/history/${userId}/?${query}`, {
 			method: 'GET',
 			headers: {
 				'X-CSRFToken': getCookie('csrftoken'),
@@ -578,14 +644,20 @@ export default class ChatApp {
 		})
 			.then(response => response.json())
 			.then(data => {
-				const messages = data.map(message => ({
+				this._olderHistory[userId] = data.length === HISTORY_PAGE_SIZE;
+				return data.map(message => ({
 					id: Number(message.id),
 					sender: Number(message.sender_id),
 					content: message.content,
 					timestamp: message.timestamp,
 					type: message.type || 'text'
 				}));
+			});
+	}
 
+	loadMessageHistory(userId) {
+		this._fetchHistory(userId)
+			.then(messages => {
 				// Update last message ID
 				messages.forEach(message => {
 					this._lastMessageId = Math.max(this._lastMessageId, message.id);
@@ -617,6 +689,37 @@ export default class ChatApp {
 			});
 	}
 
+	loadOlderMessages(userId) {
+		const oldest = store.getState('chat').messages[userId]?.[0];
+		if (this._loadingHistory || !this._olderHistory[userId] || !oldest) return;
+
+		this._loadingHistory = true;
+		const messageHistory = document.querySelector("#message-history");
+		const previousHeight = messageHistory ? messageHistory.scrollHeight : 0;
+		this._fetchHistory(userId, { before: oldest.id })
+			.then(messages => {
+				store.dispatch({
+					domain: 'chat',
+					type: actions.chat.PREPEND_MESSAGES,
+					payload: {
+						friendId: userId,
+						messages
+					}
+				});
+				// Keep the messages that were on screen in place
+				const history = document.querySelector("#message-history");
+				if (history) {
+					history.scrollTop = history.scrollHeight - previousHeight;
+				}
+			})
+			.catch(error => {
+				logger.error(`[ChatApp] Error loading older messages:`, error);
+			})
+			.finally(() => {
+				this._loadingHistory = false;
+			});
+	}
+
 	handleSpecialActions(e) {
 		const userId = Number(e.currentTarget.dataset.userId);
 		const isInvitePong = e.currentTarget.classList.contains('invite-pong');
@@ -721,22 +824,16 @@ export default class ChatApp {
 	setChatModalOpen(isOpen) {
 		this._isChatOpen = isOpen;
 
-		if (isOpen) {
-			// Clear all unread counts when opening chat
-			store.dispatch({
-				domain: 'chat',
-				type: chatActions.CLEAR_UNREAD
-			});
-
-			const chatBadge = document.querySelector('.chat-badge');
-			if (chatBadge) {
-				chatBadge.textContent = 0;
-				chatBadge.style.display = 'none';
-			}
+		// The open conversation is read, the others keep their unread count
+		const selectedUser = store.getState('chat')?.selectedUser;
+		if (isOpen && selectedUser) {
+			this.markRead(selectedUser.id);
 		}
 	}
 
 	destroy() {
+		clearInterval(this._heartbeat);
+		this._heartbeat = null;
 		connectionManager.removeConnectionGroup('chat');
 		this._connection = null;
 	}
@@ -783,6 +880,7 @@ export default class ChatApp {
 			payload: user
 		});
 		this.loadMessageHistory(user.id);
+		this.markRead(user.id);
 		// Persister l'état
 		localStorage.setItem('selectedChatUser', JSON.stringify(user));
 	}
@@ -25,6 +25,9 @@ export class PongNetworkManager {
 		this._messageQueue = [];
 		this._gameFinished = false;
 		this._connectionGroupName = `pong-${this._gameId}`;
+		this._reconnectGraceMs = 10000;
+		this._reconnectTimer = null;
+		this._clockSync = null;
 	}
 
 	/**
@@ -41,7 +44,8 @@ export class PongNetworkManager {
 			'game_complete': 'gameComplete',
 			'player_ready': 'playerReady',
 			'player_disconnected': 'playerDisconnected',
-			'physics_update': 'physicsUpdate'
+			'physics_update': 'physicsUpdate',
+			'lag_correction': 'lagCorrection'
 		};
 
 		this._messageHandlers = {
@@ -49,7 +53,13 @@ export class PongNetworkManager {
 			'physicsUpdate': (message) => {
 				this._eventEmitter.emit('remotePhysicsUpdate', message.state);
 			},
+			'lagCorrection': (message) => {
+				if (this._isHost)
+					this._eventEmitter.emit('lagCorrection', { ...message, elapsedMs: Math.max(0, this.serverNow() - message.at) });
+			},
 			'gameState': (message) => {
+				if (message.reconnect_grace_ms)
+					this._reconnectGraceMs = message.reconnect_grace_ms;
 				this._eventEmitter.emit('gameState', message);
 			},
 
@@ -100,7 +110,9 @@ export class PongNetworkManager {
 		this._handleStateChange = this._handleStateChange.bind(this);
 		this._handleWebSocketMessage = this._handleWebSocketMessage.bind(this);
 		this._handleDisconnect = this._handleDisconnect.bind(this);
+		this._handleReconnect = this._handleReconnect.bind(this);
 		this._handlePlayerDisconnect = this._handlePlayerDisconnect.bind(this);
+		this._handleClockPing = this._handleClockPing.bind(this);
 
 		return true;
 	}
@@ -138,6 +150,7 @@ export class PongNetworkManager {
 			signalingConnection.on('message', this._handleWebSocketMessage);
 			signalingConnection.on('stateChange', this._handleStateChange);
 			signalingConnection.on('close', this._handleDisconnect);
+			signalingConnection.on('open', this._handleReconnect);
 			signalingConnection.on('error', (error) => this._handleError(error));
 
 			// Connect to signaling server
@@ -235,7 +248,8 @@ export class PongNetworkManager {
 				return signalingConnection.send({
 					type: direction === 0 ? 'paddle_stop' : 'paddle_move',
 					direction: direction,
-					intensity: intensity
+					intensity: intensity,
+					t: this.serverNow()
 				});
 			}
 			return false;
@@ -467,11 +481,16 @@ export class PongNetworkManager {
 						this._handleMessage({ type: 'physicsUpdate', state: data.state });
 					break;
 
+				case 'clock_ping':
+					this._handleClockPing(data);
+					break;
+
 				case 'paddle_move':
 				case 'paddle_stop':
 					const inputData = {
 						direction: data.direction || 0,
-						intensity: data.intensity || 1.0
+						intensity: data.intensity || 1.0,
+						lagMs: data.lag_ms || 0
 					};
 					this._eventEmitter.emit('remoteInput', inputData);
 					break;
@@ -519,15 +538,86 @@ export class PongNetworkManager {
 	}
 
 	/**
-	 * Handle disconnection
+	 * Handle disconnection.
+	 * An abnormal closure is retried by the WebSocket connection, and the server
+	 * holds the game open for a grace window, so wait for it before giving up.
 	 * @private
+	 * @param {CloseEvent} event - The close event
 	 */
-	_handleDisconnect() {
+	_handleDisconnect(event) {
+		if (event && event.code === 1006 && this._connections) {
+			logger.warn(`Connection dropped, waiting ${this._reconnectGraceMs}ms for reconnection`);
+			this._eventEmitter.emit('networkReconnecting');
+			clearTimeout(this._reconnectTimer);
+			this._reconnectTimer = setTimeout(() => {
+				this._reconnectTimer = null;
+				this._handleDisconnect();
+			}, this._reconnectGraceMs);
+			return;
+		}
+
 		logger.warn('Connection lost, cleaning up');
 		this._eventEmitter.emit('networkDisconnect');
 		this._setConnectionState(ConnectionState.DISCONNECTED.name);
 	}
 
+	/**
+	 * Handle a successful reconnection within the grace window
+	 * @private
+	 */
+	_handleReconnect() {
+		if (!this._reconnectTimer) return;
+
+		clearTimeout(this._reconnectTimer);
+		this._reconnectTimer = null;
+		logger.info('Connection restored, resuming game');
+		this._setConnectionState(ConnectionState.CONNECTED.name);
+		this._eventEmitter.emit('networkReconnected');
+	}
+
+	/**
+	 * Answer a server clock ping and keep the link estimates it carries
+	 * @private
+	 * @param {Object} data - The clock_ping message
+	 */
+	_handleClockPing(data) {
+		const receivedAt = Date.now();
+		const signalingConnection = this._connections?.get('signaling');
+		if (signalingConnection && signalingConnection.state.canSend) {
+			signalingConnection.send({
+				type: 'clock_pong',
+				t0: data.t0,
+				t1: receivedAt,
+				t2: Date.now()
+			});
+		}
+
+		if (data.rtt_ms == null) return;
+		this._clockSync = {
+			rttMs: data.rtt_ms,
+			offsetMs: data.offset_ms,
+			jitterMs: data.jitter_ms,
+			interpolationDelayMs: data.interpolation_delay_ms
+		};
+		this._eventEmitter.emit('clockSync', this._clockSync);
+	}
+
+	/**
+	 * Latest RTT, clock offset and suggested interpolation delay, or null before the first estimate
+	 * @returns {Object|null}
+	 */
+	get clockSync() {
+		return this._clockSync;
+	}
+
+	/**
+	 * Current time on the server clock, in ms
+	 * @returns {number}
+	 */
+	serverNow() {
+		return Date.now() - (this._clockSync?.offsetMs || 0);
+	}
+
 	_handlePlayerDisconnect(message) {
 		logger.warn('Player disconnected:', message);
 		this._eventEmitter.emit('networkPlayerDisconnect', message);
@@ -631,6 +721,8 @@ export class PongNetworkManager {
 	destroy() {
 		try {
 			this._gameFinished = true;
+			clearTimeout(this._reconnectTimer);
+			this._reconnectTimer = null;
 			this._messageQueue = [];
 			if (this._connections) {
 				logger.debug('Cleaning up existing connections');
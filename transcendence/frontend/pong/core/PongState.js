@@ -92,6 +92,7 @@ export class PongPhysics {
   _setupEventListeners() {
     this.eventEmitter.on('playerInput', this._handlePlayerInput.bind(this));
     this.eventEmitter.on('remotePhysicsUpdate', this._handleRemotePhysicsUpdate.bind(this));
+    this.eventEmitter.on('lagCorrection', this._handleLagCorrection.bind(this));
     this.eventEmitter.on('gamePaused', () => this.physicsState.gameStatus = 'paused');
     this.eventEmitter.on('gameResumed', () => this.physicsState.gameStatus = 'playing');
     this.eventEmitter.on('gameDestroyed', () => { });
@@ -106,10 +107,50 @@ export class PongPhysics {
     const { player, input } = data;
     const paddleSpeed = this.settingsManager.getPaddleSpeed();
 
-    if (player === 'left')
-      this.physicsState.leftPaddle.dy = input.direction * input.intensity * paddleSpeed;
-    else if (player === 'right')
-      this.physicsState.rightPaddle.dy = input.direction * input.intensity * paddleSpeed;
+    const paddle = player === 'left' ? this.physicsState.leftPaddle :
+      player === 'right' ? this.physicsState.rightPaddle : null;
+    if (!paddle) return;
+
+    paddle.dy = input.direction * input.intensity * paddleSpeed;
+
+    // Remote inputs arrive late: move the paddle to where it would be had the input arrived on time
+    if (input.lagMs > 0) {
+      const canvasHeight = this.settingsManager.getCanvasHeight();
+      paddle.y = Math.max(paddle.height / 2,
+        Math.min(canvasHeight - (paddle.height / 2), paddle.y + paddle.dy * input.lagMs / 1000));
+    }
+  }
+
+  /**
+   * Handle a server correction for a late guest input that turned a miss into a hit (host only)
+   * @private
+   * @param {Object} correction - Ball bounced at the crossing time, rewound paddle position and elapsed time
+   */
+  _handleLagCorrection(correction) {
+    const { ball, rightPaddle, scores } = this.physicsState;
+    if (!this.isHost || ball.dx <= 0) return;
+    if (correction.scores && (correction.scores.left !== scores.left || correction.scores.right !== scores.right)) return;
+
+    const canvasHeight = this.settingsManager.getCanvasHeight();
+    const dt = correction.elapsedMs / 1000;
+    ball.x = correction.ball.x + correction.ball.dx * dt;
+    ball.y = correction.ball.y + correction.ball.dy * dt;
+    ball.dx = correction.ball.dx;
+    ball.dy = correction.ball.dy;
+
+    // Fold the ball back in if it would have bounced off a wall meanwhile
+    if (ball.y - ball.radius < 0) {
+      ball.y = 2 * ball.radius - ball.y;
+      ball.dy = -ball.dy;
+    } else if (ball.y + ball.radius > canvasHeight) {
+      ball.y = 2 * (canvasHeight - ball.radius) - ball.y;
+      ball.dy = -ball.dy;
+    }
+    ball.prevX = ball.x;
+    ball.prevY = ball.y;
+    rightPaddle.y = correction.paddle_y;
+
+    logger.debug(`Applied lag correction, rewound ${Math.round(correction.rewind_ms)}ms`);
   }
 
   /**
@@ -138,6 +138,9 @@ export default class Room {
 						if (data.room_state)
 							this._handleRoomStateUpdate(data.room_state);
 						break;
+					case 'room_patch':
+						this._handleRoomStateUpdate(store.getState('room'));
+						break;
 					case 'settings_update':
 						if (data.setting && data.value !== undefined)
 							this._handleSettingsUpdate(data);
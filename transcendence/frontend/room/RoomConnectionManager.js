@@ -35,6 +35,36 @@ export const RoomErrorCodes = {
 	INVALID_RESPONSE: 'INVALID_RESPONSE'
 };
 
+/**
+ * Applies JSON-Patch operations to the room state, copying only the touched top-level fields
+ * @returns {Object} Partial room state holding the patched fields
+ */
+export const applyRoomPatch = (state, ops) => {
+	const changes = {};
+	for (const { op, path, value } of ops) {
+		const keys = path.split('/').slice(1).map(key => key.replace(/~1/g, '/').replace(/~0/g, '~'));
+		const last = keys.pop();
+		if (keys.length === 0) {
+			changes[last] = op === 'remove' ? undefined : value;
+			continue;
+		}
+		const [top, ...rest] = keys;
+		if (!(top in changes))
+			changes[top] = structuredClone(state[top] ?? {});
+		let target = changes[top];
+		for (const key of rest) {
+			if (typeof target[key] !== 'object' || target[key] === null)
+				target[key] = {};
+			target = target[key];
+		}
+		if (op === 'remove')
+			delete target[last];
+		else
+			target[last] = value;
+	}
+	return changes;
+};
+
 /**
  * Manages room-specific connections and communication
  */
@@ -49,6 +79,8 @@ export class RoomConnectionManager {
 		this._groupName = `room:${roomId}`;
 		this._hasError = false;
 		this._isInitialized = false;
+		this._version = null;
+		this._resyncing = false;
 		this._setupConnections();
 	}
 
@@ -131,6 +163,7 @@ export class RoomConnectionManager {
 					this._isInitialized = true;
 					logger.info('[RoomConnectionManager] Room initialized successfully');
 				}
+				this._version = data.room_state.version ?? this._version;
 				store.dispatch({
 					domain: 'room',
 					type: actions.room.UPDATE_ROOM,
@@ -139,6 +172,11 @@ export class RoomConnectionManager {
 				return;
 			}
 
+			if (data.type === 'room_patch') {
+				this._handlePatch(data);
+				return;
+			}
+
 			if (data.type === 'settings_update') {
 				logger.debug('[RoomConnectionManager] Received settings update:', data);
 
@@ -176,6 +214,39 @@ export class RoomConnectionManager {
 		}
 	}
 
+	/**
+	 * Applies a room patch, or fetches a full snapshot when versions were missed
+	 * @private
+	 */
+	_handlePatch(data) {
+		// The initial snapshot is still on its way and will include this change
+		if (this._version === null || data.version <= this._version)
+			return;
+
+		if (data.base !== this._version) {
+			logger.debug(`[RoomConnectionManager] Room version gap (have ${this._version}, patch from ${data.base}), fetching snapshot`);
+			this._resync();
+			return;
+		}
+
+		store.dispatch({
+			domain: 'room',
+			type: actions.room.UPDATE_ROOM,
+			payload: applyRoomPatch(store.getState('room'), data.ops || [])
+		});
+		this._version = data.version;
+	}
+
+	async _resync() {
+		if (this._resyncing) return;
+		this._resyncing = true;
+		try {
+			await this.getCurrentState();
+		} finally {
+			this._resyncing = false;
+		}
+	}
+
 	/**
 	 * Handles connection close events
 	 * @private
@@ -307,6 +378,7 @@ export class RoomConnectionManager {
 		}
 		this._isInitialized = false;
 		this._hasError = true;
+		this._version = null;
 	}
 
 	/**
@@ -326,6 +398,7 @@ export class RoomConnectionManager {
 			logger.debug('[RoomConnectionManager] Received state response:', response);
 
 			if (response.status === 'success' && response.room_state) {
+				this._version = response.room_state.version ?? this._version;
 				store.dispatch({
 					domain: 'room',
 					type: actions.room.UPDATE_ROOM,
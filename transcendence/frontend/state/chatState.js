@@ -5,10 +5,12 @@ export const chatActions = {
 	SET_SELECTED_USER: 'SET_SELECTED_USER',
 	ADD_MESSAGE: 'ADD_MESSAGE',
 	ADD_MESSAGES: 'ADD_MESSAGES',
+	PREPEND_MESSAGES: 'PREPEND_MESSAGES',
 	CLEAR_HISTORY: 'CLEAR_HISTORY',
 	UPDATE_USER: 'UPDATE_USER',
 	UPDATE_USERS: 'UPDATE_USERS',
 	INCREMENT_UNREAD: 'INCREMENT_UNREAD',
+	SET_UNREAD: 'SET_UNREAD',
 	CLEAR_UNREAD: 'CLEAR_UNREAD',
 	FRIEND_REQUEST: 'FRIEND_REQUEST',
 };
@@ -112,6 +114,15 @@ export const chatReducers = {
 		lastUpdate: Date.now()
 	}),
 
+	[chatActions.PREPEND_MESSAGES]: (state, { friendId, messages }) => ({
+		...state,
+		messages: {
+			...state.messages,
+			[friendId]: [...messages, ...(state.messages[friendId] || [])]
+		},
+		lastUpdate: Date.now()
+	}),
+
 	[chatActions.CLEAR_HISTORY]: (state, { friendId }) => ({
 		...state,
 		messages: {
@@ -141,6 +152,12 @@ export const chatReducers = {
 		lastUpdate: Date.now()
 	}),
 
+	[chatActions.SET_UNREAD]: (state, unreadCounts) => ({
+		...state,
+		unreadCounts,
+		lastUpdate: Date.now()
+	}),
+
 	[chatActions.CLEAR_UNREAD]: (state, payload = {}) => {
 		if (payload.friendId) {
 			return {
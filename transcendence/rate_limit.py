@@ -0,0 +1,83 @@
+import time
+from typing import Dict, Tuple
+from django.http import JsonResponse
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from authentication.decorators import IsAuthenticatedWithCookie
+
+# Limit key covering every message of a socket, checked before parsing
+ALL = '*'
+
+# Message type -> (messages per second, burst)
+Limits = Dict[str, Tuple[float, float]]
+
+class TokenBucket:
+    """Allows `rate` messages per second on average, and bursts of up to `burst`"""
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, now: float) -> bool:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+class RateLimitStats:
+    """Messages dropped by rate limits on this worker, per consumer and limit"""
+
+    def __init__(self):
+        self.hits: Dict[str, Dict[str, int]] = {}
+
+    def hit(self, consumer: str, message_type: str) -> None:
+        counts = self.hits.setdefault(consumer, {})
+        counts[message_type] = counts.get(message_type, 0) + 1
+
+    def serialize(self) -> Dict[str, Dict[str, int]]:
+        return {consumer: dict(counts) for consumer, counts in self.hits.items()}
+
+rate_limit_stats = RateLimitStats()
+
+class RateLimiter:
+    """
+    Token buckets of one socket.
+
+    The `ALL` bucket is taken for every message before it is parsed, the
+    others for the message type they are named after. Message types without
+    a limit only count against `ALL`.
+    """
+
+    def __init__(self, consumer: str, limits: Limits):
+        self.consumer = consumer
+        self.limits = limits
+        self.buckets: Dict[str, TokenBucket] = {}
+        # The client hears about dropped messages at most once a second
+        self.notices = TokenBucket(1.0, 1.0)
+
+    def allow(self, message_type: str = ALL) -> bool:
+        limit = self.limits.get(message_type)
+        if limit is None:
+            return True
+        bucket = self.buckets.get(message_type)
+        if bucket is None:
+            bucket = self.buckets[message_type] = TokenBucket(*limit)
+        if bucket.take(time.monotonic()):
+            return True
+        rate_limit_stats.hit(self.consumer, message_type)
+        return False
+
+    def notify(self) -> bool:
+        """Whether the client should be told about a dropped message"""
+        return self.notices.take(time.monotonic())
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticatedWithCookie, IsAdminUser])
+def rate_limit_overview(request):
+    """Returns the messages dropped by rate limits on this server, to staff"""
+    return JsonResponse(rate_limit_stats.serialize())
@@ -131,10 +131,125 @@ DATABASES = {
 }
 
 
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer"
+# "memory" keeps every socket in one process, "postgres" lets several workers share groups
+CHANNEL_LAYER_BACKEND = env('CHANNEL_LAYER_BACKEND', default='memory')
+
+if CHANNEL_LAYER_BACKEND == 'postgres':
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "transcendence.channel_layers.PostgresChannelLayer",
+            "CONFIG": {
+                "pool_size": env.int('CHANNEL_LAYER_POOL_SIZE', default=4),
+                "group_expiry": env.int('CHANNEL_LAYER_GROUP_EXPIRY', default=86400),
+                # Seconds to reach Postgres before a socket fails instead of waiting forever
+                "connect_timeout": env.int('CHANNEL_LAYER_CONNECT_TIMEOUT', default=10),
+            }
+        }
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer"
+        }
     }
+
+# Pong runtime
+
+# Seconds between two flushes of buffered live scores to the database
+PONG_SCORE_FLUSH_INTERVAL = env.float('PONG_SCORE_FLUSH_INTERVAL', default=1.0)
+
+# Number of recent snapshots and inputs kept per game to resume dropped players
+PONG_SNAPSHOT_BUFFER_SIZE = env.int('PONG_SNAPSHOT_BUFFER_SIZE', default=32)
+
+# Seconds a game stays open after a player's socket drops
+PONG_RECONNECT_GRACE = env.float('PONG_RECONNECT_GRACE', default=10.0)
+
+# Snapshots per second sent to spectators, and spectators allowed per game
+PONG_SPECTATOR_RATE = env.float('PONG_SPECTATOR_RATE', default=10.0)
+PONG_MAX_SPECTATORS = env.int('PONG_MAX_SPECTATORS', default=200)
+
+# Opt-in replay recording: snapshots kept per second and seconds between file appends
+PONG_REPLAY_ENABLED = env.bool('PONG_REPLAY_ENABLED', default=False)
+PONG_REPLAY_DIR = BASE_DIR / 'media' / 'replays'
+PONG_REPLAY_SNAPSHOT_RATE = env.float('PONG_REPLAY_SNAPSHOT_RATE', default=20.0)
+PONG_REPLAY_FLUSH_INTERVAL = env.float('PONG_REPLAY_FLUSH_INTERVAL', default=2.0)
+
+# Seconds between clock sync pings on game sockets
+PONG_CLOCK_SYNC_INTERVAL = env.float('PONG_CLOCK_SYNC_INTERVAL', default=2.0)
+
+# Oldest guest input age (ms) that gets compensated, and snapshots replayed per rewind
+PONG_LAG_COMPENSATION_WINDOW = env.float('PONG_LAG_COMPENSATION_WINDOW', default=200.0)
+PONG_MAX_REWIND_STEPS = env.int('PONG_MAX_REWIND_STEPS', default=16)
+
+# Seconds a cached room snapshot is trusted without an invalidation from this worker
+PONG_ROOM_CACHE_TTL = env.float('PONG_ROOM_CACHE_TTL', default=5.0)
+
+# Maintenance (manage.py pong_maintenance): seconds between passes, rows per batch,
+# seconds before empty and occupied rooms are expired and ongoing games without a
+# score change are finished
+PONG_MAINTENANCE_INTERVAL = env.float('PONG_MAINTENANCE_INTERVAL', default=60.0)
+PONG_MAINTENANCE_BATCH_SIZE = env.int('PONG_MAINTENANCE_BATCH_SIZE', default=500)
+PONG_ROOM_IDLE_TIMEOUT = env.float('PONG_ROOM_IDLE_TIMEOUT', default=600.0)
+PONG_ROOM_MAX_IDLE = env.float('PONG_ROOM_MAX_IDLE', default=86400.0)
+PONG_GAME_STALE_TIMEOUT = env.float('PONG_GAME_STALE_TIMEOUT', default=3600.0)
+
+# Rate limits per room and game socket: (messages per second, burst) for every
+# message ('*', checked before parsing) and for single message types.
+# Hosts send a physics update per frame.
+PONG_ROOM_RATE_LIMITS = {
+    '*': (env.float('PONG_ROOM_RATE', default=10.0), env.float('PONG_ROOM_BURST', default=30.0)),
+    'update_property': (4.0, 10.0),
+    'invite_friend': (2.0, 10.0),
+    'start_game': (1.0, 3.0),
+}
+PONG_GAME_RATE_LIMITS = {
+    '*': (env.float('PONG_GAME_RATE', default=250.0), env.float('PONG_GAME_BURST', default=500.0)),
+}
+
+# Chat runtime
+
+# Seconds a disconnected user stays online, so a quick reconnect sends no status update
+CHAT_PRESENCE_FLAP_WINDOW = env.float('CHAT_PRESENCE_FLAP_WINDOW', default=2.0)
+
+# Seconds between two writes of presence changes to the online column, and seconds
+# without a heartbeat before a chat socket is closed (clients send one every 25s)
+# or without a refresh before the users of a worker count as gone
+CHAT_PRESENCE_FLUSH_INTERVAL = env.float('CHAT_PRESENCE_FLUSH_INTERVAL', default=2.0)
+CHAT_PRESENCE_TIMEOUT = env.float('CHAT_PRESENCE_TIMEOUT', default=75.0)
+
+# Messages per chat history page by default, and at most
+CHAT_HISTORY_PAGE_SIZE = env.int('CHAT_HISTORY_PAGE_SIZE', default=50)
+CHAT_HISTORY_MAX_PAGE_SIZE = env.int('CHAT_HISTORY_MAX_PAGE_SIZE', default=200)
+
+# Most recent conversations listed in the chat inbox
+CHAT_INBOX_SIZE = env.int('CHAT_INBOX_SIZE', default=50)
+
+# Results per chat search page by default
+CHAT_SEARCH_PAGE_SIZE = env.int('CHAT_SEARCH_PAGE_SIZE', default=20)
+
+# Write-behind chat messages: seconds between inserts, messages per insert,
+# and message ids taken from the sequence at once
+CHAT_WRITE_INTERVAL = env.float('CHAT_WRITE_INTERVAL', default=0.02)
+CHAT_WRITE_BATCH_SIZE = env.int('CHAT_WRITE_BATCH_SIZE', default=100)
+CHAT_ID_BLOCK_SIZE = env.int('CHAT_ID_BLOCK_SIZE', default=32)
+
+# Archive (manage.py chat_archive): seconds between passes, days messages stay in
+# the message table, messages per archive segment and messages moved per transaction
+CHAT_ARCHIVE_INTERVAL = env.float('CHAT_ARCHIVE_INTERVAL', default=3600.0)
+CHAT_RETENTION_DAYS = env.float('CHAT_RETENTION_DAYS', default=90.0)
+CHAT_ARCHIVE_SEGMENT_SIZE = env.int('CHAT_ARCHIVE_SEGMENT_SIZE', default=500)
+CHAT_ARCHIVE_BATCH_SIZE = env.int('CHAT_ARCHIVE_BATCH_SIZE', default=5000)
+
+# Groups chat sockets are spread over for broadcasts to every user
+CHAT_BROADCAST_SHARDS = env.int('CHAT_BROADCAST_SHARDS', default=16)
+
+# Rate limits per chat socket, as for PONG_ROOM_RATE_LIMITS
+CHAT_RATE_LIMITS = {
+    '*': (env.float('CHAT_RATE', default=10.0), env.float('CHAT_BURST', default=30.0)),
+    'chat_message': (5.0, 15.0),
+    'friend_request': (1.0, 5.0),
+    'game_invitation': (1.0, 5.0),
+    'get_profile': (5.0, 20.0),
 }
 
 
@@ -0,0 +1,147 @@
+import asyncio, threading, time
+from unittest import skipUnless
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from rest_framework_simplejwt.tokens import AccessToken
+from authentication.models import User
+from .channel_layers import PostgresChannelLayer
+from .rate_limit import rate_limit_stats
+
+class LoopThread:
+    """An event loop running in a thread of its own, standing for one worker"""
+
+    def __init__(self, layer):
+        self.layer = layer
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def start(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=5):
+        return self.start(coro).result(timeout)
+
+    def stop(self):
+        self.run(self.layer.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+@skipUnless(connection.vendor == 'postgresql', 'PostgresChannelLayer needs Postgres')
+class PostgresChannelLayerTestCase(TransactionTestCase):
+    def setUp(self):
+        self.layer = self.make_layer()
+
+    def make_layer(self, **kwargs):
+        layer = PostgresChannelLayer(connect_timeout=5, **kwargs)
+        loops = [LoopThread(layer) for _ in range(2)]
+        for loop in loops:
+            self.addCleanup(loop.stop)
+        loops[0].run(layer.flush())
+        self.sender, self.receiver = loops
+        return layer
+
+    def count(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM {table}')
+            return cursor.fetchone()[0]
+
+    def backends(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM pg_stat_activity WHERE datname = current_database()')
+            return cursor.fetchone()[0]
+
+    def wait_until(self, condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            self.assertLess(time.monotonic(), deadline, 'Condition not met in time')
+            time.sleep(0.1)
+
+    def test_send_receive_across_loops(self):
+        channel = self.receiver.run(self.layer.new_channel())
+        received = self.receiver.start(self.layer.receive(channel))
+
+        self.sender.run(self.layer.send(channel, {'type': 'hello', 'text': 'from another loop'}))
+
+        self.assertEqual(received.result(5), {'type': 'hello', 'text': 'from another loop'})
+        # The sender never received, so it opened no pool
+        self.assertIsNone(self.sender.run(self.layer._state()).pool)
+
+    def test_group_send_to_other_loop(self):
+        remote = self.receiver.run(self.layer.new_channel())
+        local = self.sender.run(self.layer.new_channel())
+        for channel, loop in ((remote, self.receiver), (local, self.sender)):
+            loop.run(self.layer.group_add('room', channel))
+        received = [
+            self.receiver.start(self.layer.receive(remote)),
+            self.sender.start(self.layer.receive(local)),
+        ]
+
+        self.sender.run(self.layer.group_send('room', {'type': 'update', 'version': 1}))
+
+        for future in received:
+            self.assertEqual(future.result(5), {'type': 'update', 'version': 1})
+
+        self.receiver.run(self.layer.group_discard('room', remote))
+        self.assertEqual(self.count('channels_group'), 1)
+
+    def test_spilled_envelope(self):
+        self.layer = self.make_layer(spill_threshold=200)
+        channel = self.receiver.run(self.layer.new_channel())
+        received = self.receiver.start(self.layer.receive(channel))
+        message = {'type': 'state', 'data': 'x' * 1000}
+
+        self.sender.run(self.layer.send(channel, message))
+
+        self.assertEqual(received.result(5), message)
+        self.assertEqual(self.count('channels_message'), 1)
+
+    def test_group_expiry(self):
+        self.layer = self.make_layer(group_expiry=0, purge_interval=0.1)
+        channel = self.receiver.run(self.layer.new_channel())
+        self.receiver.run(self.layer.group_add('room', channel))
+        received = self.receiver.start(self.layer.receive(channel))
+
+        self.sender.run(self.layer.group_send('room', {'type': 'expired'}))
+        self.sender.run(self.layer.send(channel, {'type': 'direct'}))
+
+        self.assertEqual(received.result(5), {'type': 'direct'})
+        # Purged by the listening loop
+        self.wait_until(lambda: self.count('channels_group') == 0)
+
+    def test_async_to_sync_leaves_no_pool(self):
+        channel = self.receiver.run(self.layer.new_channel())
+        self.receiver.run(self.layer.group_add('room', channel))
+        backends = self.backends()
+
+        for i in range(20):
+            received = self.receiver.start(self.layer.receive(channel))
+            async_to_sync(self.layer.group_send)('room', {'type': 'update', 'version': i})
+            self.assertEqual(received.result(5), {'type': 'update', 'version': i})
+
+        # Only the receiving loop keeps a pool
+        self.assertEqual(sum(state.pool is not None for state in self.layer._states.values()), 1)
+        # Closed connections leave pg_stat_activity once their backend exits
+        self.wait_until(lambda: self.backends() <= backends)
+
+class RateLimitOverviewTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', password='password123', email='user@test.com')
+
+    def get(self):
+        self.client.cookies['access_token'] = str(AccessToken.for_user(self.user))
+        return self.client.get('/rate-limits')
+
+    def test_staff_only(self):
+        # Denied, and sent to the login page by the authentication middleware
+        response = self.get()
+        self.assertEqual((response.status_code, response['Location']), (302, settings.LOGIN_URL))
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), rate_limit_stats.serialize())
@@ -19,6 +19,7 @@ from django.urls import path, register_converter, include
 from django.contrib.auth import views as auth_views
 from authentication.views import register, login_view, index, logout_view, forgot_password, otp, oauth_callback, set_password, check_user
 from home.views import profile, settings_view, change_password, games_history, enable_2fa
+from transcendence.rate_limit import rate_limit_overview
 from django.conf.urls.static import static
 from django.conf import settings
 
@@ -122,6 +123,7 @@ urlpatterns = [
     path('change-password', change_password, name='change-password'),
     path('chat/', include('chat.urls')),
     path('pong/', include('pong.urls')),
+    path('rate-limits', rate_limit_overview, name='rate-limits'),
     path('set-password', set_password, name='set-password'),
     path('callback', oauth_callback, name='callback'),
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),